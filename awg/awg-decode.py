@@ -1,67 +1,102 @@
 import sys
-import struct
-import zlib
-import base64
+import os
+import json
 import argparse
+from multiprocessing import Pool
 
-def qCompress(data, level=-1):
-    compressed = zlib.compress(data, level)
-    header = struct.pack('>I', len(data))
-    return header + compressed
-
-def qUncompress(data):
-    if len(data) < 4:
-        return b''
-    uncompressed_size = struct.unpack('>I', data[:4])[0]
-    compressed_data = data[4:]
-    try:
-        uncompressed_data = zlib.decompress(compressed_data)
-    except zlib.error:
-        return b''
-    if len(uncompressed_data) != uncompressed_size:
-        return b''
-    return uncompressed_data
-
-def base64url_encode(data):
-    encoded = base64.urlsafe_b64encode(data)
-    return encoded.rstrip(b'=')
-
-def base64url_decode(data):
-    padding_needed = (4 - len(data) % 4) % 4
-    data += b'=' * padding_needed
-    return base64.urlsafe_b64decode(data)
+from modules.vpn_codec import decode_vpn_uri
+from modules.vpn_codec import encode_vpn_uri
 
 def process_conf_data(data):
     return data
 
 def encode(data):
-    data_bytes = data.encode('utf-8')
-    compressed = qCompress(data_bytes, level=8)
-    base64_encoded = base64url_encode(compressed)
-    s = 'vpn://' + base64_encoded.decode('ascii')
-    return s
+    return encode_vpn_uri(data)
 
 def decode(s):
-    data = s.replace('vpn://', '')
-    data_bytes = data.encode('ascii')
-    compressed = base64url_decode(data_bytes)
-    uncompressed = qUncompress(compressed)
-    if uncompressed:
-        result = uncompressed
+    return decode_vpn_uri(s)
+
+def iter_conf_files(root):
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            if filename.endswith('.conf'):
+                yield os.path.join(dirpath, filename)
+
+def iter_stdin_uris():
+    for line_no, line in enumerate(sys.stdin, 1):
+        line = line.strip()
+        if line:
+            yield line_no, line
+
+def encode_file_record(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            data = f.read()
+        return {'path': path, 'vpn_uri': encode(process_conf_data(data))}
+    except Exception as e:
+        return {'path': path, 'error': str(e)}
+
+def decode_line_record(item):
+    line_no, vpn_string = item
+    try:
+        return {'line': line_no, 'config': decode(vpn_string)}
+    except Exception as e:
+        return {'line': line_no, 'error': str(e)}
+
+def run_batch(worker, items, jobs, out):
+    # Результаты выводятся в NDJSON по мере готовности, порядок входа сохраняется
+    failed = 0
+    if jobs > 1:
+        pool = Pool(jobs)
+        results = pool.imap(worker, items, chunksize=64)
     else:
-        result = compressed
-    return result.decode('utf-8')
+        pool = None
+        results = map(worker, items)
+    try:
+        for record in results:
+            if 'error' in record:
+                failed += 1
+            out.write(json.dumps(record, ensure_ascii=False) + '\n')
+            out.flush()
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+    return failed
 
 def main():
     parser = argparse.ArgumentParser(description='Encode and decode VPN configuration files to/from vpn:// format.')
     group = parser.add_mutually_exclusive_group(required=True)
     group.add_argument('-e', '--encode', action='store_true', help='Encode a .conf file to vpn:// format.')
     group.add_argument('-d', '--decode', action='store_true', help='Decode a vpn:// string to configuration data.')
-    parser.add_argument('input', help='Input file for encoding or vpn:// string for decoding.')
+    group.add_argument('--encode-dir', metavar='DIR', help='Encode every .conf file under DIR, writing NDJSON records.')
+    group.add_argument('--decode-stdin', action='store_true', help='Decode newline-delimited vpn:// strings from stdin, writing NDJSON records.')
+    parser.add_argument('input', nargs='?', help='Input file for encoding or vpn:// string for decoding.')
     parser.add_argument('-o', '--output', help='Output file. If not specified, output will be printed to console.')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='Worker processes for batch modes (default: 1).')
 
     args = parser.parse_args()
 
+    if (args.encode or args.decode) and not args.input:
+        parser.error('the input argument is required for --encode and --decode')
+
+    if args.encode_dir or args.decode_stdin:
+        if args.encode_dir and not os.path.isdir(args.encode_dir):
+            print(f'Error: Directory {args.encode_dir} not found.', file=sys.stderr)
+            sys.exit(1)
+        if args.encode_dir:
+            worker, items = encode_file_record, iter_conf_files(args.encode_dir)
+        else:
+            worker, items = decode_line_record, iter_stdin_uris()
+        jobs = max(1, args.jobs)
+        if args.output:
+            with open(args.output, 'w', encoding='utf-8') as f:
+                failed = run_batch(worker, items, jobs, f)
+        else:
+            failed = run_batch(worker, items, jobs, sys.stdout)
+        sys.exit(1 if failed else 0)
+
     if args.encode:
         try:
             with open(args.input, 'r', encoding='utf-8') as f:
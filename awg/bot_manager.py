@@ -1,4 +1,3 @@
-import db
 from dotenv import load_dotenv
 import importlib.util
 import os
@@ -17,12 +16,17 @@ def _ensure_stdlib_platform_module():
     sys.modules["platform"] = module
 
 
+# До импорта db: иначе пакет awg/platform подменяет стандартный platform
+# для uuid, paramiko и других модулей, которые db подтягивает
 _ensure_stdlib_platform_module()
 
+import db
 import aiohttp
 import logging
 import asyncio
 import aiofiles
+import io
+import hashlib
 import re
 import tempfile
 import json
@@ -32,7 +36,8 @@ import zipfile
 import ipaddress
 import humanize
 import shutil
-from aiogram import Bot, types
+import time
+from aiogram import types
 from aiogram.dispatcher import Dispatcher
 from aiogram.utils import exceptions as aiogram_exceptions
 from aiogram.dispatcher.middlewares import BaseMiddleware
@@ -40,6 +45,7 @@ from aiogram.utils import executor
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.utils.markdown import escape_md
 from datetime import datetime, timedelta
+from apscheduler.events import EVENT_JOB_ERROR, EVENT_JOB_EXECUTED, EVENT_JOB_SUBMITTED
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.date import DateTrigger
 from apscheduler.triggers.interval import IntervalTrigger
@@ -52,6 +58,30 @@ from modules.owner_groups import format_owner_label
 from modules.owner_groups import owner_sort_key
 from modules.owner_groups import encode_owner_token
 from modules.owner_groups import decode_owner_token
+from modules.geoip import open_asn_database
+from modules.vpn_codec import encode_vpn_uri
+from modules.document_cache import DocumentFileIdCache
+from modules.document_cache import content_digest
+from modules.outbound_queue import OutboundDispatcher
+from modules.outbound_queue import PRIORITY_HIGH
+from modules.outbound_queue import PRIORITY_NORMAL
+from modules.message_cleanup import DelayedMessageDeleter
+from modules.ssh_keeper import ConnectionKeeper
+from modules.remote_watcher import RemoteChangeWatcher
+from modules.session_store import SessionDatabase
+from modules.session_store import SessionStore
+from modules.client_index import ServerIndexCache
+from modules.render_cache import RenderCache
+from modules.render_cache import KeyboardMemo
+from modules.render_cache import render_digest
+from modules.webhook_runner import build_webhook_app
+from modules.webhook_runner import attach_asgi_app
+from modules.webhook_runner import run_webhook_app
+from modules.bot_metrics import MeteredBot
+from modules.bot_metrics import HandlerMetricsMiddleware
+from modules.bot_metrics import format_handler_stats
+from modules.bot_metrics import start_metrics_server
+from modules import metrics
 
 CURRENT_TIMEZONE = ZoneInfo('Europe/Moscow')
 
@@ -67,6 +97,9 @@ SERVERS_ROOT = os.path.join(DATA_DIR, 'servers')
 PROFILES_ROOT = os.path.join(DATA_DIR, 'profiles')
 ISP_CACHE_FILE = os.path.join(DATA_DIR, 'isp_cache.json')
 SSH_KEYS_DIR = os.path.join(DATA_DIR, 'ssh_keys')
+DOCUMENT_CACHE_FILE = os.path.join(DATA_DIR, 'document_cache.json')
+PENDING_DELETIONS_FILE = os.path.join(DATA_DIR, 'pending_deletions.json')
+SESSIONS_FILE = os.path.join(DATA_DIR, 'sessions.sqlite3')
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -79,6 +112,21 @@ config = db.get_config()
 # Сначала пробуем взять из переменных окружения, если нет — из config
 bot_token = os.getenv('BOT_TOKEN') or config.get('bot_token')
 admin_id = os.getenv('ADMIN_ID') or config.get('admin_id')
+# Локальная база ASN/ISP (.mmdb или .csv/.tsv) вместо запросов к ip-api.com
+geoip_db_path = os.getenv('GEOIP_DB_PATH') or config.get('geoip_db_path')
+# Webhook вместо long polling: включается, если задан публичный адрес
+webhook_url = os.getenv('WEBHOOK_URL') or config.get('webhook_url')
+webhook_path = os.getenv('WEBHOOK_PATH') or config.get('webhook_path') or '/telegram/webhook'
+webhook_secret = os.getenv('WEBHOOK_SECRET') or config.get('webhook_secret')
+webapp_host = os.getenv('WEBAPP_HOST') or config.get('webapp_host') or '0.0.0.0'
+webapp_port = int(os.getenv('WEBAPP_PORT') or config.get('webapp_port') or 8443)
+webhook_workers = int(os.getenv('WEBHOOK_WORKERS') or config.get('webhook_workers') or 8)
+# Порт админского API, запускаемого в том же процессе (только в режиме webhook)
+admin_api_port = os.getenv('ADMIN_API_PORT') or config.get('admin_api_port')
+# Порт для /metrics в режиме polling (в режиме webhook метрики отдаются на WEBAPP_PORT)
+metrics_port = os.getenv('METRICS_PORT') or config.get('metrics_port')
+# Наблюдение за wg0.conf и clientsTable на серверах через постоянный SSH-канал
+remote_watch = (os.getenv('REMOTE_WATCH') or config.get('remote_watch') or '').lower() in ('1', 'true', 'yes')
 
 if not all([bot_token, admin_id]):
     logger.error("Отсутствуют обязательные настройки бота (bot_token или admin_id).")
@@ -88,7 +136,7 @@ servers = db.load_servers()
 if not servers:
     logger.warning("Не найдено ни одного сервера в конфигурации")
 
-bot = Bot(str(bot_token))
+bot = MeteredBot(str(bot_token))
 try:
     admin = int(str(admin_id))
 except (TypeError, ValueError):
@@ -148,16 +196,92 @@ def update_server_settings(server_id=None):
 class AdminMessageDeletionMiddleware(BaseMiddleware):
     async def on_process_message(self, message: types.Message, data: dict):
         if is_admin(message):
-            asyncio.create_task(delete_message_after_delay(message.chat.id, message.message_id, delay=5))
+            schedule_message_deletion(message.chat.id, message.message_id, delay=5)
 
 dp = Dispatcher(bot)
 scheduler = AsyncIOScheduler(timezone=pytz.UTC)
+outbound = OutboundDispatcher(bot.send_message)
+message_cleaner = DelayedMessageDeleter(bot.delete_message, PENDING_DELETIONS_FILE)
+connection_keeper = ConnectionKeeper(
+    db.remote_server_ids,
+    db.is_server_connected,
+    db.connect_server,
+    should_skip=lambda server_id: not db.is_server_available(server_id),
+)
+# При работающем наблюдении хеши файлов можно не сверять с сервером так часто
+REMOTE_WATCH_FRESH_SECONDS = 60
+main_loop = None
+
+def handle_remote_change(server_id, path):
+    db.remote_snapshots.invalidate(server_id, path)
+    client_name_indexes.invalidate(server_id)
+    inline_indexes.invalidate(server_id)
+    # Профили, созданные или удалённые не через бота, сверяем сразу, а не по расписанию
+    job = scheduler.get_job('check_profiles_consistency')
+    if job is not None:
+        job.modify(next_run_time=datetime.now(pytz.UTC) + timedelta(seconds=10))
+
+remote_watcher = RemoteChangeWatcher(
+    db.watch_targets,
+    db.open_watch_channel,
+    lambda server_id, path: main_loop.call_soon_threadsafe(handle_remote_change, server_id, path),
+)
+
+def remote_fresh_seconds(server_id):
+    # Долгий срок только пока канал наблюдения этого сервера работает:
+    # без него изменения файлов никто не заметит
+    if server_id in remote_watcher.modes:
+        return REMOTE_WATCH_FRESH_SECONDS
+    return None
+
+def metrics_role(event) -> str:
+    try:
+        if isinstance(event, types.InlineQuery):
+            return 'admin' if event.from_user.id == admin else 'user'
+        return 'admin' if is_admin(event) else 'user'
+    except AttributeError:
+        return 'user'
 
 dp.middleware.setup(AdminMessageDeletionMiddleware())
+dp.middleware.setup(HandlerMetricsMiddleware(metrics_role))
+metrics.REGISTRY.gauge('awg_bot_outbound_queue_depth', 'Сообщения в очереди на отправку').add_callback(
+    lambda: outbound.queue_depth, name='bot'
+)
+metrics.REGISTRY.gauge('awg_bot_pending_deletions', 'Сообщения, ожидающие удаления').add_callback(
+    lambda: message_cleaner.queue_depth, name='bot'
+)
+# Запуски, переданные исполнителю и ещё не завершённые: число зарегистрированных
+# задач во время работы не меняется и очередь не показывает. AsyncIOScheduler
+# рассылает эти события в потоке цикла событий, блокировка не нужна
+scheduler_runs = {'in_flight': 0}
+
+def track_scheduler_runs(event):
+    if event.code == EVENT_JOB_SUBMITTED:
+        scheduler_runs['in_flight'] += 1
+    else:
+        scheduler_runs['in_flight'] = max(0, scheduler_runs['in_flight'] - 1)
+
+scheduler.add_listener(track_scheduler_runs, EVENT_JOB_SUBMITTED | EVENT_JOB_EXECUTED | EVENT_JOB_ERROR)
+metrics.REGISTRY.gauge(
+    'awg_scheduler_queue_depth',
+    'Запуски задач планировщика, ожидающие выполнения или выполняющиеся',
+).add_callback(lambda: scheduler_runs['in_flight'], name='bot')
+metrics.REGISTRY.counter('awg_cache_requests_total', 'Обращения к кешам', ('cache', 'result')).add_callback(
+    lambda: {
+        ('render', 'hit'): render_cache.hits,
+        ('render', 'miss'): render_cache.misses,
+    },
+    name='bot_render_cache',
+)
+POLL_DURATION = metrics.REGISTRY.histogram(
+    'awg_poll_duration_seconds', 'Длительность периодических опросов серверов', ('job',)
+)
+metrics_runner = None
 
 main_menu_markup = InlineKeyboardMarkup(row_width=1).add(
     InlineKeyboardButton("➕ Добавить пользователя", callback_data="add_user"),
     InlineKeyboardButton("📋 Список клиентов", callback_data="list_users"),
+    InlineKeyboardButton("🔎 Найти клиента", callback_data="search_clients"),
     InlineKeyboardButton("🔑 Создать бекап", callback_data="create_backup"),
     InlineKeyboardButton("⚙ Управление серверами", callback_data="manage_servers")
 )
@@ -232,13 +356,166 @@ def build_client_status_label(username: str, active_lookup: dict[str, dict[str,
     return f"{status_icon}{status_suffix} {username}"
 
 
+async def render_main_message(callback_query, chat_id, message_id, text, reply_markup, parse_mode='Markdown', digest=None):
+    """Редактирует главное сообщение, пропуская вызов Telegram, если экран не изменился."""
+    digest = digest or render_digest(text, reply_markup, parse_mode)
+    current_message = callback_query.message
+    edit_date = None
+    if current_message and current_message.chat.id == chat_id and current_message.message_id == message_id:
+        edit_date = current_message.edit_date
+        if render_cache.is_rendered(chat_id, message_id, digest, edit_date):
+            return False
+    try:
+        result = await bot.edit_message_text(
+            chat_id=chat_id,
+            message_id=message_id,
+            text=text,
+            reply_markup=reply_markup,
+            parse_mode=parse_mode
+        )
+    except aiogram_exceptions.MessageNotModified:
+        render_cache.remember(chat_id, message_id, digest, edit_date)
+        return False
+    except Exception:
+        render_cache.forget(chat_id, message_id)
+        raise
+    render_cache.remember(chat_id, message_id, digest, getattr(result, 'edit_date', None))
+    return True
+
+
+def owner_groups_version(server_id, clients):
+    """Версия данных для группировки по владельцам: состав клиентов и mtime expirations.json."""
+    names = hashlib.sha1('\n'.join(str(client[0]) for client in clients).encode('utf-8')).hexdigest()
+    try:
+        expirations_mtime = os.stat(db.EXPIRATIONS_FILE).st_mtime_ns
+    except OSError:
+        expirations_mtime = 0
+    return (server_id, names, expirations_mtime)
+
+
+def build_owner_groups_screen(server_id, clients):
+    version = owner_groups_version(server_id, clients)
+    screen = owner_keyboards.get(version)
+    if screen is not None:
+        return screen
+
+    expirations = db.load_expirations()
+    owner_groups: dict[object, list] = {}
+    for client in clients:
+        username = client[0]
+        owner_id = resolve_owner_id(username, server_id, expirations)
+        owner_groups.setdefault(owner_id, []).append(client)
+
+    keyboard = InlineKeyboardMarkup(row_width=1)
+    unknown_clients = owner_groups.pop(None, [])
+    if unknown_clients:
+        unknown_text = f"{format_owner_label(None)} ({len(unknown_clients)})"
+        keyboard.add(InlineKeyboardButton(
+            text=unknown_text,
+            callback_data=f"list_users_owner:{encode_owner_token(None)}:0"
+        ))
+
+    for owner_id in sorted(owner_groups.keys(), key=owner_sort_key):
+        owner_text = f"{format_owner_label(owner_id)} ({len(owner_groups[owner_id])})"
+        keyboard.add(InlineKeyboardButton(
+            text=owner_text,
+            callback_data=f"list_users_owner:{encode_owner_token(owner_id)}:0"
+        ))
+
+    keyboard.add(InlineKeyboardButton(text="Домой", callback_data="home"))
+    text_header = (
+        f"Все пользователи\n"
+        f"Текущий сервер: *{server_id}*\n"
+        "Выберите владельца для просмотра конфигураций."
+    )
+    screen = (text_header, keyboard, render_digest(text_header, keyboard, 'Markdown'))
+    owner_keyboards.put(version, screen)
+    return screen
+
+
+def escape_markdown_legacy(value: str) -> str:
+    return re.sub(r'([_*`\[])', r'\\\1', value)
+
+
+def build_client_search_screen(server_id, prefix, cursor=None):
+    index = client_name_indexes.get(server_id)
+    names, next_cursor = index.search(prefix, cursor=cursor)
+    keyboard = InlineKeyboardMarkup(row_width=1)
+    for name in names:
+        keyboard.add(InlineKeyboardButton(text=name, callback_data=f"client_{name}"))
+    if next_cursor:
+        keyboard.add(InlineKeyboardButton(text="Следующая страница", callback_data=f"search_page:{next_cursor}"))
+    keyboard.add(InlineKeyboardButton(text="🔎 Новый поиск", callback_data="search_clients"))
+    keyboard.add(InlineKeyboardButton(text="Домой", callback_data="home"))
+    text = (
+        f"Поиск: {escape_markdown_legacy(prefix)}\n"
+        f"Текущий сервер: *{server_id}*\n"
+        f"Найдено: {index.count(prefix)}"
+    )
+    return text, keyboard
+
+
 current_server = None
 
-# Состояния пользователей (выбранный сервер и др.)
-user_state = {}
-user_main_messages = {}
+# Состояния пользователей (выбранный сервер и др.) переживают перезапуск бота
+session_db = SessionDatabase(SESSIONS_FILE)
+user_state = SessionStore(session_db, 'user_state')
+user_main_messages = SessionStore(session_db, 'main_messages')
 isp_cache = {}
 CACHE_TTL = timedelta(hours=24)
+asn_database = None
+document_cache = DocumentFileIdCache(DOCUMENT_CACHE_FILE)
+render_cache = RenderCache()
+owner_keyboards = KeyboardMemo(maxsize=64)
+
+
+def load_client_names(server_id):
+    clients = db.get_client_list(server_id=server_id) or []
+    return [
+        (client[0], client[0]) for client in clients
+        if isinstance(client, (list, tuple)) and client
+    ]
+
+
+client_name_indexes = ServerIndexCache(load_client_names)
+
+INLINE_DEADLINE = 2.0
+INLINE_RESULTS_LIMIT = 50
+
+
+def expirations_version(server_id):
+    try:
+        return os.stat(db.EXPIRATIONS_FILE).st_mtime_ns
+    except OSError:
+        return 0
+
+
+def load_inline_index_items(server_id):
+    """Ключи inline-поиска: имя клиента, владелец (ID и slug) и IP-адрес."""
+    clients = db.get_client_list(server_id=server_id) or []
+    expirations = db.load_expirations()
+    items = []
+    for client in clients:
+        if not isinstance(client, (list, tuple)) or not client:
+            continue
+        name = client[0]
+        ip = str(client[2]).split('/')[0] if len(client) > 2 and client[2] else ''
+        owner_id = resolve_owner_id(name, server_id, expirations)
+        server_entry = (expirations.get(name) or {}).get(server_id) or {}
+        owner_slug = server_entry.get('owner_slug') if isinstance(server_entry, dict) else None
+        record = {'server_id': server_id, 'name': name, 'owner': format_owner_label(owner_id), 'ip': ip}
+        items.append((name, record))
+        if owner_id is not None:
+            items.append((str(owner_id).lstrip('@'), record))
+        if owner_slug:
+            items.append((owner_slug, record))
+        if ip:
+            items.append((ip, record))
+    return items
+
+
+inline_indexes = ServerIndexCache(load_inline_index_items, ttl=300, version=expirations_version)
+inline_index_builds: dict[str, asyncio.Future] = {}
 
 def get_interface_name():
     if not WG_CONFIG_FILE:
@@ -301,6 +578,10 @@ async def get_isp_info(ip: str) -> str:
             return "Private Range"
     except:
         return "Invalid IP"
+    if asn_database:
+        record = asn_database.lookup(ip)
+        if record and record.get('isp'):
+            return record['isp']
     url = f"http://ip-api.com/json/{ip}?fields=status,message,isp"
     try:
         async with aiohttp.ClientSession() as session:
@@ -340,12 +621,27 @@ async def cleanup_connection_data(username: str, server_id = None):
             await f.write(json.dumps(limited_ips))
 
 async def load_isp_cache_task():
+    global asn_database
     await load_isp_cache()
+    if geoip_db_path and not asn_database:
+        loop = asyncio.get_running_loop()
+        asn_database = await loop.run_in_executor(None, open_asn_database, geoip_db_path)
     scheduler.add_job(cleanup_isp_cache, 'interval', hours=1)
 
+async def flush_sessions():
+    # Обработчики меняют сессии на месте без блокировки, поэтому снимок
+    # берётся в потоке цикла событий, а в SQLite пишется в пуле потоков
+    loop = asyncio.get_running_loop()
+    for store in (user_state, user_main_messages):
+        try:
+            batch = store.prepare_flush()
+            await loop.run_in_executor(None, store.commit_flush, batch)
+        except Exception as e:
+            logger.error(f"Ошибка при сохранении сессий {store.namespace}: {e}")
+
 def create_zip(backup_filepath):
     with zipfile.ZipFile(backup_filepath, 'w') as zipf:
-        for main_file in ['awg/awg-decode.py', 'awg/newclient.sh', 'awg/removeclient.sh']:
+        for main_file in ['awg/awg-decode.py', 'awg/modules/vpn_codec.py', 'awg/newclient.sh', 'awg/removeclient.sh']:
             if os.path.exists(main_file):
                 zipf.write(main_file, main_file)
         for root, dirs, files in os.walk(DATA_DIR):
@@ -354,12 +650,15 @@ def create_zip(backup_filepath):
                 arcname = os.path.relpath(filepath, os.getcwd())
                 zipf.write(filepath, arcname)
 
-async def delete_message_after_delay(chat_id: int, message_id: int, delay: int):
-    await asyncio.sleep(delay)
-    try:
-        await bot.delete_message(chat_id, message_id)
-    except:
-        pass
+def schedule_message_deletion(chat_id: int, message_id: int, delay: int):
+    message_cleaner.schedule(chat_id, message_id, delay)
+
+def notify_admin(text: str, priority: int = PRIORITY_NORMAL, coalesce: bool = False, delete_after: int | None = None, **options):
+    on_sent = None
+    if delete_after:
+        def on_sent(message: types.Message):
+            schedule_message_deletion(message.chat.id, message.message_id, delay=delete_after)
+    outbound.enqueue(admin, text, priority=priority, coalesce=coalesce, on_sent=on_sent, **options)
 
 def parse_relative_time(relative_str: str) -> datetime:
     try:
@@ -430,6 +729,172 @@ async def choose_server_callback(callback_query: types.CallbackQuery):
         menu = get_user_server_keyboard()
         await bot.edit_message_text(chat_id=callback_query.message.chat.id, message_id=callback_query.message.message_id, text=text, reply_markup=menu)
 
+def _log_inline_index_error(server_id, future):
+    if not future.cancelled() and future.exception():
+        logger.error(f"Не удалось построить индекс поиска для сервера {server_id}: {future.exception()}")
+
+async def get_inline_indexes(server_ids):
+    """Индексы серверов, готовые к дедлайну; по остальным используется предыдущая версия."""
+    loop = asyncio.get_running_loop()
+    pending = {}
+    for server_id in server_ids:
+        future = inline_index_builds.get(server_id)
+        if future is None or future.done():
+            future = loop.run_in_executor(None, inline_indexes.get, server_id)
+            future.add_done_callback(lambda f, sid=server_id: _log_inline_index_error(sid, f))
+            inline_index_builds[server_id] = future
+        pending[server_id] = future
+    if pending:
+        await asyncio.wait(pending.values(), timeout=INLINE_DEADLINE)
+    indexes = {}
+    for server_id, future in pending.items():
+        if future.done() and not future.cancelled() and not future.exception():
+            indexes[server_id] = future.result()
+        else:
+            stale_index = inline_indexes.peek(server_id)
+            if stale_index is not None:
+                indexes[server_id] = stale_index
+    return indexes
+
+@dp.inline_handler()
+async def inline_search_handler(inline_query: types.InlineQuery):
+    prefix = inline_query.query.strip()
+    if inline_query.from_user.id != admin or not prefix:
+        await inline_query.answer([], cache_time=5, is_personal=True)
+        return
+
+    server_ids = sorted(db.get_server_list())
+    # offset: "<номер сервера>|<курсор внутри индекса сервера>"
+    start_position, _, cursor = (inline_query.offset or '0|').partition('|')
+    try:
+        start_position = int(start_position)
+    except ValueError:
+        start_position, cursor = 0, ''
+
+    indexes = await get_inline_indexes(server_ids[start_position:])
+    results = []
+    seen = set()
+    next_offset = ''
+    for position in range(start_position, len(server_ids)):
+        index = indexes.get(server_ids[position])
+        if index is None:
+            continue
+        records, next_cursor = index.search(
+            prefix,
+            limit=INLINE_RESULTS_LIMIT - len(results),
+            cursor=cursor if position == start_position else None
+        )
+        for record in records:
+            key = (record['server_id'], record['name'])
+            if key in seen:
+                continue
+            seen.add(key)
+            description = " · ".join(part for part in (record['server_id'], record['owner'], record['ip']) if part)
+            results.append(types.InlineQueryResultArticle(
+                id=hashlib.sha1(f"{key[0]}:{key[1]}".encode('utf-8')).hexdigest(),
+                title=record['name'],
+                description=description,
+                # Результаты собраны со всех серверов: сервер передаётся в команде,
+                # чтобы /find открыл клиента там, где он найден
+                input_message_content=types.InputTextMessageContent(f"/find {record['name']} {record['server_id']}")
+            ))
+        if next_cursor:
+            next_offset = f"{position}|{next_cursor}"
+            break
+        if len(results) >= INLINE_RESULTS_LIMIT:
+            if position + 1 < len(server_ids):
+                next_offset = f"{position + 1}|"
+            break
+
+    await inline_query.answer(results, cache_time=5, is_personal=True, next_offset=next_offset)
+
+@dp.message_handler(commands=['stats'])
+async def stats_command_handler(message: types.Message):
+    if not is_admin(message):
+        await message.answer("У вас нет доступа к этому боту.")
+        return
+    sent_message = await message.answer(f"```\n{format_handler_stats()}\n```", parse_mode='Markdown')
+    schedule_message_deletion(sent_message.chat.id, sent_message.message_id, delay=120)
+
+@dp.message_handler(commands=['sshstats'])
+async def ssh_stats_command_handler(message: types.Message):
+    if not is_admin(message):
+        await message.answer("У вас нет доступа к этому боту.")
+        return
+    lines = ["сервер/команда            n  conn  chan  1st  total"]
+    for item in db.get_ssh_timings():
+        phases = item['phases']
+        def phase_ms(name):
+            value = phases.get(name, {}).get('mean')
+            return f"{value * 1000:>5.0f}" if value is not None else "    -"
+        label = f"{item['server_id']}/{item['kind']}"[:22]
+        lines.append(
+            f"{label:<22} {item['count']:>4} {phase_ms('connect')} {phase_ms('channel_open')} "
+            f"{phase_ms('first_byte')} {phase_ms('total')}"
+        )
+    unavailable = [item for item in db.get_circuit_states() if item['state'] != 'closed']
+    if unavailable:
+        lines.append("")
+        lines.append("недоступные серверы:")
+        for item in unavailable:
+            lines.append(f"{item['server_id']}: {item['state']}, повтор через {item['retry_in']:.0f} с")
+    slow = db.get_slow_commands(5)
+    if slow:
+        lines.append("")
+        lines.append("последние медленные:")
+        for item in slow:
+            lines.append(f"{item['server_id']}/{item['kind']}: {item['phases'].get('total', 0):.2f} с")
+    sessions = db.server_sessions.stats()
+    lines.append(
+        f"соединения: повторно {sessions['reused']}, новых {sessions['connected']}, ошибок {sessions['failed']}"
+    )
+    lines.append("среднее время в мс")
+    sent_message = await message.answer("```\n" + "\n".join(lines) + "\n```", parse_mode='Markdown')
+    schedule_message_deletion(sent_message.chat.id, sent_message.message_id, delay=120)
+
+@dp.message_handler(commands=['find'])
+async def find_command_handler(message: types.Message):
+    if not is_admin(message):
+        await message.answer("У вас нет доступа к этому боту.")
+        return
+    prefix, _, server_id = message.get_args().strip().partition(' ')
+    server_id = server_id.strip()
+    schedule_message_deletion(message.chat.id, message.message_id, delay=5)
+    if server_id and server_id != current_server and not update_server_settings(server_id):
+        sent_message = await message.answer(f"Сервер {server_id} не найден.")
+        schedule_message_deletion(sent_message.chat.id, sent_message.message_id, delay=5)
+        return
+    if not prefix or not current_server:
+        sent_message = await message.answer("Использование: /find <начало имени клиента> [сервер]")
+        schedule_message_deletion(sent_message.chat.id, sent_message.message_id, delay=5)
+        return
+    await show_client_search(message.from_user.id, message.chat.id, prefix)
+
+async def show_client_search(user_id: int, chat_id: int, prefix: str):
+    entry = user_main_messages.setdefault(user_id, {})
+    entry.pop('state', None)
+    entry['search_prefix'] = prefix
+    text, keyboard = build_client_search_screen(current_server, prefix)
+    main_chat_id = entry.get('chat_id')
+    main_message_id = entry.get('message_id')
+    if main_chat_id and main_message_id:
+        try:
+            await bot.edit_message_text(
+                chat_id=main_chat_id,
+                message_id=main_message_id,
+                text=text,
+                reply_markup=keyboard,
+                parse_mode='Markdown'
+            )
+            return
+        except aiogram_exceptions.MessageNotModified:
+            return
+        except Exception as e:
+            logger.error(f"Ошибка при редактировании сообщения: {e}")
+    sent_message = await bot.send_message(chat_id, text, reply_markup=keyboard, parse_mode='Markdown')
+    entry['chat_id'] = sent_message.chat.id
+    entry['message_id'] = sent_message.message_id
+
 @dp.message_handler()
 async def handle_messages(message: types.Message):
     # Проверяем, есть ли доступ у пользователя/чата
@@ -458,7 +923,7 @@ async def handle_messages(message: types.Message):
                         InlineKeyboardButton("Отмена", callback_data="manage_servers")
                     )
                 )
-            asyncio.create_task(delete_message_after_delay(message.chat.id, message.message_id, delay=5))
+            schedule_message_deletion(message.chat.id, message.message_id, delay=5)
             return
         
         user_main_messages[user_id]['server_id'] = server_id
@@ -475,7 +940,7 @@ async def handle_messages(message: types.Message):
                     InlineKeyboardButton("Отмена", callback_data="manage_servers")
                 )
             )
-        asyncio.create_task(delete_message_after_delay(message.chat.id, message.message_id, delay=5))
+        schedule_message_deletion(message.chat.id, message.message_id, delay=5)
         
     elif user_state == 'waiting_for_server_host':
         host = message.text.strip()
@@ -493,7 +958,7 @@ async def handle_messages(message: types.Message):
                     InlineKeyboardButton("Отмена", callback_data="manage_servers")
                 )
             )
-        asyncio.create_task(delete_message_after_delay(message.chat.id, message.message_id, delay=5))
+        schedule_message_deletion(message.chat.id, message.message_id, delay=5)
         
     elif user_state == 'waiting_for_server_port':
         try:
@@ -512,7 +977,7 @@ async def handle_messages(message: types.Message):
                         InlineKeyboardButton("Отмена", callback_data="manage_servers")
                     )
                 )
-            asyncio.create_task(delete_message_after_delay(message.chat.id, message.message_id, delay=5))
+            schedule_message_deletion(message.chat.id, message.message_id, delay=5)
         except ValueError:
             main_chat_id = user_main_messages.get(user_id, {}).get('chat_id')
             main_message_id = user_main_messages.get(user_id, {}).get('message_id')
@@ -525,7 +990,7 @@ async def handle_messages(message: types.Message):
                         InlineKeyboardButton("Отмена", callback_data="manage_servers")
                     )
                 )
-            asyncio.create_task(delete_message_after_delay(message.chat.id, message.message_id, delay=5))
+            schedule_message_deletion(message.chat.id, message.message_id, delay=5)
             
     elif user_state == 'waiting_for_server_username':
         username = message.text.strip()
@@ -547,7 +1012,7 @@ async def handle_messages(message: types.Message):
                 text="Выберите тип аутентификации:",
                 reply_markup=auth_markup
             )
-        asyncio.create_task(delete_message_after_delay(message.chat.id, message.message_id, delay=5))
+        schedule_message_deletion(message.chat.id, message.message_id, delay=5)
         
     elif user_state == 'waiting_for_password':
         password = message.text.strip()
@@ -599,7 +1064,7 @@ async def handle_messages(message: types.Message):
                     )
                 )
         
-        asyncio.create_task(delete_message_after_delay(message.chat.id, message.message_id, delay=5))
+        schedule_message_deletion(message.chat.id, message.message_id, delay=5)
             
     elif user_state == 'waiting_for_key_path':
         server_data = user_main_messages[user_id]
@@ -617,7 +1082,7 @@ async def handle_messages(message: types.Message):
                         InlineKeyboardButton("Отмена", callback_data="manage_servers")
                     )
                 )
-            asyncio.create_task(delete_message_after_delay(message.chat.id, message.message_id, delay=5))
+            schedule_message_deletion(message.chat.id, message.message_id, delay=5)
             return
         
         success = db.add_server(
@@ -666,7 +1131,7 @@ async def handle_messages(message: types.Message):
                     )
                 )
         
-        asyncio.create_task(delete_message_after_delay(message.chat.id, message.message_id, delay=5))
+        schedule_message_deletion(message.chat.id, message.message_id, delay=5)
 
     elif user_state == 'waiting_for_password_update':
         new_password = message.text.strip()
@@ -686,7 +1151,7 @@ async def handle_messages(message: types.Message):
                     )
                 )
             entry.pop('state', None)
-            asyncio.create_task(delete_message_after_delay(message.chat.id, message.message_id, delay=5))
+            schedule_message_deletion(message.chat.id, message.message_id, delay=5)
             return
 
         if not new_password:
@@ -699,7 +1164,7 @@ async def handle_messages(message: types.Message):
                         InlineKeyboardButton("Отмена", callback_data="manage_servers")
                     )
                 )
-            asyncio.create_task(delete_message_after_delay(message.chat.id, message.message_id, delay=5))
+            schedule_message_deletion(message.chat.id, message.message_id, delay=5)
             return
 
         success = db.update_server_password(server_id, new_password)
@@ -717,7 +1182,7 @@ async def handle_messages(message: types.Message):
                     InlineKeyboardButton("Домой", callback_data="home")
                 )
             )
-        asyncio.create_task(delete_message_after_delay(message.chat.id, message.message_id, delay=5))
+        schedule_message_deletion(message.chat.id, message.message_id, delay=5)
 
     elif user_state == 'waiting_for_key_update':
         entry = user_main_messages.get(user_id, {})
@@ -736,7 +1201,7 @@ async def handle_messages(message: types.Message):
                     )
                 )
             entry.pop('state', None)
-            asyncio.create_task(delete_message_after_delay(message.chat.id, message.message_id, delay=5))
+            schedule_message_deletion(message.chat.id, message.message_id, delay=5)
             return
 
         resolved_path, key_error = await resolve_private_key_input(message, server_id)
@@ -750,7 +1215,7 @@ async def handle_messages(message: types.Message):
                         InlineKeyboardButton("Отмена", callback_data="manage_servers")
                     )
                 )
-            asyncio.create_task(delete_message_after_delay(message.chat.id, message.message_id, delay=5))
+            schedule_message_deletion(message.chat.id, message.message_id, delay=5)
             return
 
         success = db.update_server_key(server_id, resolved_path)
@@ -768,7 +1233,7 @@ async def handle_messages(message: types.Message):
                     InlineKeyboardButton("Домой", callback_data="home")
                 )
             )
-        asyncio.create_task(delete_message_after_delay(message.chat.id, message.message_id, delay=5))
+        schedule_message_deletion(message.chat.id, message.message_id, delay=5)
         
     elif user_state == 'waiting_for_client_description':
         description = message.text.strip()
@@ -779,7 +1244,7 @@ async def handle_messages(message: types.Message):
         if not client_base or not server_id:
             await message.answer("Не удалось определить параметры клиента. Попробуйте начать заново.", parse_mode="Markdown")
             entry.pop('state', None)
-            asyncio.create_task(delete_message_after_delay(message.chat.id, message.message_id, delay=5))
+            schedule_message_deletion(message.chat.id, message.message_id, delay=5)
             return
 
         if description == '-':
@@ -788,11 +1253,11 @@ async def handle_messages(message: types.Message):
             slug = slugify_description(description)
             if description and not slug:
                 await message.answer("Описание может содержать только буквы, цифры и дефисы. Попробуйте снова или отправьте `-`.", parse_mode="Markdown")
-                asyncio.create_task(delete_message_after_delay(message.chat.id, message.message_id, delay=5))
+                schedule_message_deletion(message.chat.id, message.message_id, delay=5)
                 return
 
         entry['state'] = None
-        asyncio.create_task(delete_message_after_delay(message.chat.id, message.message_id, delay=5))
+        schedule_message_deletion(message.chat.id, message.message_id, delay=5)
         await finalize_client_creation(
             user_id=user_id,
             server_id=server_id,
@@ -801,9 +1266,15 @@ async def handle_messages(message: types.Message):
             slug=slug
         )
         
+    elif user_state == 'waiting_for_client_search':
+        prefix = (message.text or '').strip()
+        schedule_message_deletion(message.chat.id, message.message_id, delay=5)
+        if prefix and current_server:
+            await show_client_search(user_id, message.chat.id, prefix)
+
     else:
         sent_message = await message.reply("Неизвестная команда или действие.")
-        asyncio.create_task(delete_message_after_delay(sent_message.chat.id, sent_message.message_id, delay=5))
+        schedule_message_deletion(sent_message.chat.id, sent_message.message_id, delay=5)
 
 @dp.callback_query_handler(lambda c: c.data.startswith('add_user'))
 async def add_user_start(callback_query: types.CallbackQuery):
@@ -866,7 +1337,7 @@ async def finalize_client_creation(user_id: int, server_id: str, owner_id: int,
     entry.pop('pending_owner_id', None)
 
     try:
-        existing_clients = db.get_client_list(server_id=server_id)
+        existing_clients = db.get_client_list(server_id=server_id) or []
     except Exception as e:
         logger.error(f"Не удалось получить список существующих клиентов: {e}")
         existing_clients = []
@@ -893,6 +1364,8 @@ async def finalize_client_creation(user_id: int, server_id: str, owner_id: int,
 
     success = db.root_add(client_name, server_id=server_id, ipv6=False, owner_slug=base)
     if success:
+        client_name_indexes.invalidate(server_id)
+        inline_indexes.invalidate(server_id)
         try:
             conf_path = profile_file(server_id, client_name, f'{client_name}.conf')
             vpn_key = ""
@@ -909,15 +1382,8 @@ async def finalize_client_creation(user_id: int, server_id: str, owner_id: int,
             else:
                 caption = "VPN ключ не был сгенерирован."
             if os.path.exists(conf_path):
-                with open(conf_path, 'rb') as config_file:
-                    sent_doc = await bot.send_document(
-                        chat_id,
-                        config_file,
-                        caption=caption,
-                        parse_mode="Markdown",
-                        disable_notification=True
-                    )
-                    asyncio.create_task(delete_message_after_delay(chat_id, sent_doc.message_id, delay=300))
+                sent_doc = await send_config_document(chat_id, server_id, client_name, conf_path, caption)
+                schedule_message_deletion(chat_id, sent_doc.message_id, delay=300)
         except Exception as e:
             logger.error(f"Ошибка при отправке конфигурации: {e}")
             confirmation_text += "\n⚠️ Ошибка при генерации файла конфигурации."
@@ -963,6 +1429,34 @@ async def skip_client_description(callback_query: types.CallbackQuery):
     )
     await callback_query.answer()
 
+async def send_config_document(chat_id: int, server_id: str, client_name: str, conf_path: str, caption: str):
+    async with aiofiles.open(conf_path, 'rb') as f:
+        content = await f.read()
+    digest = content_digest(content)
+    file_id = document_cache.get(server_id, client_name, digest)
+    if file_id:
+        try:
+            return await bot.send_document(
+                chat_id,
+                file_id,
+                caption=caption,
+                parse_mode="Markdown",
+                disable_notification=True
+            )
+        except aiogram_exceptions.BadRequest as e:
+            logger.warning(f"Сохранённый file_id для {client_name} недействителен: {e}")
+            document_cache.invalidate(server_id, client_name)
+    sent_doc = await bot.send_document(
+        chat_id,
+        types.InputFile(io.BytesIO(content), filename=os.path.basename(conf_path)),
+        caption=caption,
+        parse_mode="Markdown",
+        disable_notification=True
+    )
+    if sent_doc.document:
+        document_cache.put(server_id, client_name, digest, sent_doc.document.file_id)
+    return sent_doc
+
 def parse_traffic_limit(traffic_limit: str) -> int:
     mapping = {'B':1, 'KB':10**3, 'MB':10**6, 'GB':10**9, 'TB':10**12}
     match = re.match(r'^(\d+(?:\.\d+)?)\s*(B|KB|MB|GB|TB)$', traffic_limit, re.IGNORECASE)
@@ -981,6 +1475,47 @@ def format_vpn_key(vpn_key, num_lines=8):
     formatted_key = '\n'.join(lines)
     return formatted_key
 
+@dp.callback_query_handler(lambda c: c.data == 'search_clients')
+async def search_clients_callback(callback_query: types.CallbackQuery):
+    if not is_admin(callback_query):
+        await callback_query.answer("У вас нет прав для этого действия.", show_alert=True)
+        return
+    if not current_server:
+        await callback_query.answer("Сначала выберите сервер в разделе 'Управление серверами'", show_alert=True)
+        return
+    entry = user_main_messages.setdefault(callback_query.from_user.id, {})
+    entry['state'] = 'waiting_for_client_search'
+    entry['chat_id'] = callback_query.message.chat.id
+    entry['message_id'] = callback_query.message.message_id
+    await bot.edit_message_text(
+        chat_id=callback_query.message.chat.id,
+        message_id=callback_query.message.message_id,
+        text=f"Текущий сервер: *{current_server}*\nВведите начало имени клиента (или используйте /find <имя>):",
+        reply_markup=InlineKeyboardMarkup().add(InlineKeyboardButton("Отмена", callback_data="home")),
+        parse_mode='Markdown'
+    )
+    await callback_query.answer()
+
+@dp.callback_query_handler(lambda c: c.data.startswith('search_page:'))
+async def search_page_callback(callback_query: types.CallbackQuery):
+    if not is_admin(callback_query) or not current_server:
+        await callback_query.answer("У вас нет прав для этого действия.", show_alert=True)
+        return
+    user_id = callback_query.from_user.id
+    prefix = user_main_messages.get(user_id, {}).get('search_prefix')
+    if not prefix:
+        await callback_query.answer("Поиск устарел, начните заново.", show_alert=True)
+        return
+    cursor = callback_query.data.split(':', 1)[1]
+    text, keyboard = build_client_search_screen(current_server, prefix, cursor=cursor)
+    try:
+        await render_main_message(
+            callback_query, callback_query.message.chat.id, callback_query.message.message_id, text, keyboard
+        )
+    except Exception as e:
+        logger.error(f"Ошибка при редактировании сообщения: {e}")
+    await callback_query.answer()
+
 @dp.callback_query_handler(lambda c: c.data.startswith('client_'))
 async def client_selected_callback(callback_query: types.CallbackQuery):
     user_id = callback_query.from_user.id
@@ -991,7 +1526,7 @@ async def client_selected_callback(callback_query: types.CallbackQuery):
     _, username = callback_query.data.split('client_', 1)
     username = username.strip()
     original_username = username
-    clients = db.get_client_list(server_id=server_id)
+    clients = db.get_client_list(server_id=server_id) or []
     client_info = next((c for c in clients if c[0] == username), None)
     if not client_info:
         await callback_query.answer("Ошибка: пользователь не найден.", show_alert=True)
@@ -1169,56 +1704,20 @@ async def list_users_callback(callback_query: types.CallbackQuery):
         clients = [clients]
 
     if admin_request:
-        expirations = db.load_expirations()
-        owner_groups: dict[object, list] = {}
-        for client in clients:
-            username = client[0]
-            owner_id = resolve_owner_id(username, server_id, expirations)
-            owner_groups.setdefault(owner_id, []).append(client)
-
-        keyboard = InlineKeyboardMarkup(row_width=1)
-        unknown_clients = owner_groups.pop(None, [])
-        if unknown_clients:
-            unknown_text = f"{format_owner_label(None)} ({len(unknown_clients)})"
-            keyboard.add(InlineKeyboardButton(
-                text=unknown_text,
-                callback_data=f"list_users_owner:{encode_owner_token(None)}:0"
-            ))
-
-        for owner_id in sorted(owner_groups.keys(), key=owner_sort_key):
-            owner_text = f"{format_owner_label(owner_id)} ({len(owner_groups[owner_id])})"
-            keyboard.add(InlineKeyboardButton(
-                text=owner_text,
-                callback_data=f"list_users_owner:{encode_owner_token(owner_id)}:0"
-            ))
-
-        keyboard.add(InlineKeyboardButton(text="Домой", callback_data="home"))
-        text_header = (
-            f"Все пользователи\n"
-            f"Текущий сервер: *{server_id}*\n"
-            "Выберите владельца для просмотра конфигураций."
-        )
+        text_header, keyboard, screen_digest = build_owner_groups_screen(server_id, clients)
 
         main_chat_id = user_main_messages.get(user_id, {}).get('chat_id')
         main_message_id = user_main_messages.get(user_id, {}).get('message_id')
 
         if main_chat_id and main_message_id:
-            current_message = callback_query.message
-            def markup_equal(a, b):
-                return getattr(a, 'to_python', lambda: a)() == getattr(b, 'to_python', lambda: b)()
-            if current_message.text != text_header or not markup_equal(current_message.reply_markup, keyboard):
-                try:
-                    await bot.edit_message_text(
-                        chat_id=main_chat_id,
-                        message_id=main_message_id,
-                        text=text_header,
-                        reply_markup=keyboard,
-                        parse_mode='Markdown'
-                    )
-                except Exception as e:
-                    logger.error(f"Ошибка при редактировании сообщения: {e}")
-                    await callback_query.answer("Ошибка при обновлении сообщения.", show_alert=True)
-                    return
+            try:
+                await render_main_message(
+                    callback_query, main_chat_id, main_message_id, text_header, keyboard, digest=screen_digest
+                )
+            except Exception as e:
+                logger.error(f"Ошибка при редактировании сообщения: {e}")
+                await callback_query.answer("Ошибка при обновлении сообщения.", show_alert=True)
+                return
         else:
             sent_message = await callback_query.message.reply(
                 text_header,
@@ -1267,22 +1766,11 @@ async def list_users_callback(callback_query: types.CallbackQuery):
     main_message_id = user_main_messages.get(user_id, {}).get('message_id')
 
     if main_chat_id and main_message_id:
-        current_message = callback_query.message
-        def markup_equal(a, b):
-            return getattr(a, 'to_python', lambda: a)() == getattr(b, 'to_python', lambda: b)()
-        # Проверяем, изменились ли текст или клавиатура
-        if current_message.text != text_header or not markup_equal(current_message.reply_markup, keyboard):
-            try:
-                await bot.edit_message_text(
-                    chat_id=main_chat_id,
-                    message_id=main_message_id,
-                    text=text_header,
-                    reply_markup=keyboard,
-                    parse_mode='Markdown'
-                )
-            except Exception as e:
-                logger.error(f"Ошибка при редактировании сообщения: {e}")
-                await callback_query.answer("Ошибка при обновлении сообщения.", show_alert=True)
+        try:
+            await render_main_message(callback_query, main_chat_id, main_message_id, text_header, keyboard)
+        except Exception as e:
+            logger.error(f"Ошибка при редактировании сообщения: {e}")
+            await callback_query.answer("Ошибка при обновлении сообщения.", show_alert=True)
     else:
         sent_message = await callback_query.message.reply(
             text_header,
@@ -1375,22 +1863,12 @@ async def list_users_owner_callback(callback_query: types.CallbackQuery):
     main_message_id = user_main_messages.get(user_id, {}).get('message_id')
 
     if main_chat_id and main_message_id:
-        current_message = callback_query.message
-        def markup_equal(a, b):
-            return getattr(a, 'to_python', lambda: a)() == getattr(b, 'to_python', lambda: b)()
-        if current_message.text != text_header or not markup_equal(current_message.reply_markup, keyboard):
-            try:
-                await bot.edit_message_text(
-                    chat_id=main_chat_id,
-                    message_id=main_message_id,
-                    text=text_header,
-                    reply_markup=keyboard,
-                    parse_mode='Markdown'
-                )
-            except Exception as e:
-                logger.error(f"Ошибка при редактировании сообщения: {e}")
-                await callback_query.answer("Ошибка при обновлении сообщения.", show_alert=True)
-                return
+        try:
+            await render_main_message(callback_query, main_chat_id, main_message_id, text_header, keyboard)
+        except Exception as e:
+            logger.error(f"Ошибка при редактировании сообщения: {e}")
+            await callback_query.answer("Ошибка при обновлении сообщения.", show_alert=True)
+            return
     else:
         sent_message = await callback_query.message.reply(
             text_header,
@@ -1507,22 +1985,24 @@ async def ip_info_callback(callback_query: types.CallbackQuery):
     else:
         await callback_query.answer("Нет информации о подключении пользователя.", show_alert=True)
         return
-    url = f"http://ip-api.com/json/{ip_address}?fields=message,country,countryCode,region,regionName,city,zip,lat,lon,timezone,isp,org,as,hosting"
-    try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url) as resp:
-                if resp.status == 200:
-                    data = await resp.json()
-                    if 'message' in data:
-                        await callback_query.answer(f"Ошибка при получении данных: {data['message']}", show_alert=True)
+    data = asn_database.lookup(ip_address) if asn_database and ip_address else None
+    if not data:
+        url = f"http://ip-api.com/json/{ip_address}?fields=message,country,countryCode,region,regionName,city,zip,lat,lon,timezone,isp,org,as,hosting"
+        try:
+            async with aiohttp.ClientSession() as session:
+                async with session.get(url) as resp:
+                    if resp.status == 200:
+                        data = await resp.json()
+                        if 'message' in data:
+                            await callback_query.answer(f"Ошибка при получении данных: {data['message']}", show_alert=True)
+                            return
+                    else:
+                        await callback_query.answer(f"Ошибка при запросе к API: {resp.status}", show_alert=True)
                         return
-                else:
-                    await callback_query.answer(f"Ошибка при запросе к API: {resp.status}", show_alert=True)
-                    return
-    except Exception as e:
-        logger.error(f"Ошибка при запросе к API: {e}")
-        await callback_query.answer("Ошибка при запросе к API.", show_alert=True)
-        return
+        except Exception as e:
+            logger.error(f"Ошибка при запросе к API: {e}")
+            await callback_query.answer("Ошибка при запросе к API.", show_alert=True)
+            return
     info_text = f"*IP информация для {username}:*\n"
     for key, value in data.items():
         info_text += f"{key.capitalize()}: {value}\n"
@@ -1640,6 +2120,9 @@ async def client_delete_callback(callback_query: types.CallbackQuery):
         except:
             pass
         db.cleanup_local_profile(username, effective_server_id)
+        document_cache.invalidate(effective_server_id, username)
+        client_name_indexes.invalidate(effective_server_id)
+        inline_indexes.invalidate(effective_server_id)
         confirmation_text = f"Пользователь *{username}* успешно удален."
     else:
         confirmation_text = f"Не удалось удалить пользователя *{username}*."
@@ -1663,33 +2146,23 @@ async def client_delete_callback(callback_query: types.CallbackQuery):
             home_text = "Выберите сервер"
     
     if main_chat_id and main_message_id:
-        # Получаем текущее сообщение
-        current_message = callback_query.message
-        # Проверка: если текст и клавиатура совпадают, не обновляем
-        def markup_equal(a, b):
-            return getattr(a, 'to_python', lambda: a)() == getattr(b, 'to_python', lambda: b)()
-
         # Сначала показываем подтверждение удаления
-        if current_message.text != confirmation_text or not markup_equal(current_message.reply_markup, InlineKeyboardMarkup().add(InlineKeyboardButton("🏠 Домой", callback_data="home"))):
-            await bot.edit_message_text(
-                chat_id=main_chat_id,
-                message_id=main_message_id,
-                text=confirmation_text,
-                parse_mode="Markdown",
-                reply_markup=InlineKeyboardMarkup().add(
-                    InlineKeyboardButton("🏠 Домой", callback_data="home")
-                )
-            )
+        await render_main_message(
+            callback_query,
+            main_chat_id,
+            main_message_id,
+            confirmation_text,
+            InlineKeyboardMarkup().add(InlineKeyboardButton("🏠 Домой", callback_data="home"))
+        )
         # Через небольшую задержку показываем домашний экран
         await asyncio.sleep(2)
-        if current_message.text != home_text or not markup_equal(current_message.reply_markup, menu_to_show):
-            await bot.edit_message_text(
-                chat_id=main_chat_id,
-                message_id=main_message_id,
-                text=home_text,
-                parse_mode="Markdown",
-                reply_markup=menu_to_show
-            )
+        await bot.edit_message_text(
+            chat_id=main_chat_id,
+            message_id=main_message_id,
+            text=home_text,
+            parse_mode="Markdown",
+            reply_markup=menu_to_show
+        )
     else:
         await callback_query.answer("Ошибка: главное сообщение не найдено.", show_alert=True)
         return
@@ -2066,32 +2539,31 @@ async def send_user_config(callback_query: types.CallbackQuery):
                 caption = f"{instruction_text}\n{key_message}"
             else:
                 caption = "VPN ключ не был сгенерирован."
-            with open(conf_path, 'rb') as config:
-                # Отправляем в тот же чат, где была нажата кнопка
-                sent_doc = await bot.send_document(
-                    callback_query.message.chat.id,
-                    config,
-                    caption=caption,
-                    parse_mode="Markdown",
-                    disable_notification=True
-                )
-                sent_messages.append(sent_doc.message_id)
+            # Отправляем в тот же чат, где была нажата кнопка
+            sent_doc = await send_config_document(
+                callback_query.message.chat.id,
+                current_server,
+                username,
+                conf_path,
+                caption
+            )
+            sent_messages.append(sent_doc.message_id)
         else:
             confirmation_text = f"Не удалось создать конфигурацию для пользователя *{username}*."
             sent_message = await bot.send_message(callback_query.message.chat.id, confirmation_text, parse_mode="Markdown", disable_notification=True)
-            asyncio.create_task(delete_message_after_delay(callback_query.message.chat.id, sent_message.message_id, delay=15))
+            schedule_message_deletion(callback_query.message.chat.id, sent_message.message_id, delay=15)
             await callback_query.answer()
             return
     except Exception as e:
         confirmation_text = f"Произошла ошибка: {e}"
         sent_message = await bot.send_message(callback_query.message.chat.id, confirmation_text, parse_mode="Markdown", disable_notification=True)
-        asyncio.create_task(delete_message_after_delay(callback_query.message.chat.id, sent_message.message_id, delay=15))
+        schedule_message_deletion(callback_query.message.chat.id, sent_message.message_id, delay=15)
         await callback_query.answer()
         return
     if not sent_messages:
         confirmation_text = f"Не удалось найти файлы конфигурации для пользователя *{username}*."
         sent_message = await bot.send_message(callback_query.message.chat.id, confirmation_text, parse_mode="Markdown", disable_notification=True)
-        asyncio.create_task(delete_message_after_delay(callback_query.message.chat.id, sent_message.message_id, delay=15))
+        schedule_message_deletion(callback_query.message.chat.id, sent_message.message_id, delay=15)
         await callback_query.answer()
         return
     else:
@@ -2102,11 +2574,11 @@ async def send_user_config(callback_query: types.CallbackQuery):
             parse_mode="Markdown",
             disable_notification=True
         )
-        asyncio.create_task(delete_message_after_delay(callback_query.message.chat.id, sent_confirmation.message_id, delay=15))
+        schedule_message_deletion(callback_query.message.chat.id, sent_confirmation.message_id, delay=15)
     for message_id in sent_messages:
-        asyncio.create_task(delete_message_after_delay(callback_query.message.chat.id, message_id, delay=15))
+        schedule_message_deletion(callback_query.message.chat.id, message_id, delay=15)
         
-    clients = db.get_client_list(server_id=current_server)
+    clients = db.get_client_list(server_id=current_server) or []
     client_info = next((c for c in clients if c[0] == username), None)
 
     last_handshake_str = None
@@ -2376,11 +2848,21 @@ async def check_profiles_consistency():
     servers = db.load_servers()
     expirations = db.load_expirations()
     for server_id in servers.keys():
+        # Пустой список от недоступного сервера удалил бы все локальные профили
+        if not db.is_server_available(server_id):
+            logger.info(f"Сервер {server_id} недоступен, проверка согласованности пропущена")
+            continue
         try:
-            remote_clients = {client[0] for client in db.get_client_list(server_id=server_id)}
+            remote_list = db.get_client_list(server_id=server_id)
         except Exception as e:
             logger.error(f"Ошибка при получении списка клиентов сервера {server_id}: {e}")
             continue
+        if remote_list is None:
+            # Сбой чтения до размыкания цепи или во время пробы: пустой список
+            # здесь удалил бы все локальные профили сервера
+            logger.warning(f"Список клиентов сервера {server_id} не получен, проверка согласованности пропущена")
+            continue
+        remote_clients = {client[0] for client in remote_list}
         local_clients = db.list_local_profiles(server_id)
         tracked_clients = {
             user for user, server_info in expirations.items()
@@ -2390,6 +2872,9 @@ async def check_profiles_consistency():
         for client_name in stale_clients:
             logger.warning(f"Профиль {client_name} отсутствует на сервере {server_id}. Удаляем локальные данные.")
             db.cleanup_local_profile(client_name, server_id, remove_expiration=True)
+            document_cache.invalidate(server_id, client_name)
+            client_name_indexes.invalidate(server_id)
+            inline_indexes.invalidate(server_id)
             if client_name in expirations and server_id in expirations[client_name]:
                 del expirations[client_name][server_id]
                 if not expirations[client_name]:
@@ -2403,6 +2888,9 @@ async def update_all_clients_traffic():
     if not current_server:
         logger.info("Сервер не выбран, пропуск обновления трафика")
         return
+    if not db.is_server_available(current_server):
+        logger.info(f"Сервер {current_server} недоступен, пропуск обновления трафика")
+        return
         
     logger.info(f"Начало обновления трафика для всех клиентов на сервере {current_server}")
     active_clients = db.get_active_list(server_id=current_server)
@@ -2420,39 +2908,34 @@ async def update_all_clients_traffic():
                 await deactivate_user(username)
     logger.info("Завершено обновление трафика для всех клиентов.")
 
+def timed_job(job_id, job_func):
+    async def run():
+        started = time.perf_counter()
+        try:
+            await job_func()
+        finally:
+            POLL_DURATION.labels(job_id).observe(time.perf_counter() - started)
+    return run
+
 def ensure_scheduler_jobs():
     jobs = [
         ("update_all_clients_traffic", update_all_clients_traffic, IntervalTrigger(minutes=1)),
         ("periodic_ensure_peer_names", periodic_ensure_peer_names, IntervalTrigger(minutes=1)),
         ("check_profiles_consistency", check_profiles_consistency, IntervalTrigger(minutes=5)),
+        ("probe_unavailable_servers", probe_unavailable_servers, IntervalTrigger(seconds=15)),
     ]
     for job_id, job_func, trigger in jobs:
         if scheduler.get_job(job_id):
             continue
-        scheduler.add_job(job_func, trigger, id=job_id, replace_existing=True)
+        scheduler.add_job(timed_job(job_id, job_func), trigger, id=job_id, replace_existing=True)
 
 async def generate_vpn_key(conf_path: str) -> str:
     try:
-        process = await asyncio.create_subprocess_exec(
-            'python3.11',
-            'awg/awg-decode.py',
-            '--encode',
-            conf_path,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE
-        )
-        stdout, stderr = await process.communicate()
-        if process.returncode != 0:
-            logger.error(f"awg-decode.py ошибка: {stderr.decode().strip()}")
-            return ""
-        vpn_key = stdout.decode().strip()
-        if vpn_key.startswith('vpn://'):
-            return vpn_key
-        else:
-            logger.error(f"awg-decode.py вернул некорректный формат: {vpn_key}")
-            return ""
+        async with aiofiles.open(conf_path, 'r', encoding='utf-8') as f:
+            conf_text = await f.read()
+        return encode_vpn_uri(conf_text)
     except Exception as e:
-        logger.error(f"Ошибка при вызове awg-decode.py: {e}")
+        logger.error(f"Ошибка при генерации vpn:// ключа: {e}")
         return ""
 
 async def deactivate_user(client_name: str):
@@ -2464,12 +2947,13 @@ async def deactivate_user(client_name: str):
         except:
             pass
         db.cleanup_local_profile(client_name, current_server)
+        document_cache.invalidate(current_server, client_name)
+        client_name_indexes.invalidate(current_server)
+        inline_indexes.invalidate(current_server)
         confirmation_text = f"Конфигурация пользователя *{client_name}* была деактивирована из-за превышения лимита трафика."
-        sent_message = await bot.send_message(admin, confirmation_text, parse_mode="Markdown", disable_notification=True)
-        asyncio.create_task(delete_message_after_delay(admin, sent_message.message_id, delay=15))
+        notify_admin(confirmation_text, coalesce=True, delete_after=15, parse_mode="Markdown", disable_notification=True)
     else:
-        sent_message = await bot.send_message(admin, f"Не удалось деактивировать пользователя *{client_name}*.", parse_mode="Markdown", disable_notification=True)
-        asyncio.create_task(delete_message_after_delay(admin, sent_message.message_id, delay=15))
+        notify_admin(f"Не удалось деактивировать пользователя *{client_name}*.", coalesce=True, delete_after=15, parse_mode="Markdown", disable_notification=True)
 
 async def check_environment():
     if not current_server:
@@ -2484,9 +2968,8 @@ async def check_environment():
     server_config = servers[current_server]
     try:
         if server_config.get('is_remote') == 'true':
-            ssh = db.SSHManager(current_server)
-            if not ssh.connect():
-                logger.error("Не удалось установить SSH соединение")
+            ssh = db.server_sessions.get(current_server)
+            if ssh is None:
                 return False
                 
             cmd = f"docker ps --filter 'name={DOCKER_CONTAINER}' --format '{{{{.Names}}}}'"
@@ -2496,8 +2979,7 @@ async def check_environment():
                 return False
 
             cmd = f"docker exec {DOCKER_CONTAINER} test -f {WG_CONFIG_FILE}"
-            output, error = ssh.execute_command(cmd)
-            if error and 'No such file' in error:
+            if not ssh.run(cmd).ok:
                 logger.error(f"Конфигурационный файл WireGuard '{WG_CONFIG_FILE}' не найден в контейнере '{DOCKER_CONTAINER}'.")
                 return False
         else:
@@ -2520,14 +3002,40 @@ async def check_environment():
         return False
 
 async def periodic_ensure_peer_names():
+    if not db.is_server_available(current_server):
+        return
     db.ensure_peer_names(server_id=current_server)
 
+async def probe_unavailable_servers():
+    loop = asyncio.get_running_loop()
+    for server_id in db.BREAKERS.due_for_probe():
+        available = await loop.run_in_executor(None, db.probe_server, server_id)
+        if available:
+            notify_admin(f"Сервер {server_id} снова доступен")
+
 async def on_startup(dp):
     os.makedirs(DATA_DIR, exist_ok=True)
     os.makedirs(SERVERS_ROOT, exist_ok=True)
     os.makedirs(PROFILES_ROOT, exist_ok=True)
     if not scheduler.running:
         scheduler.start()
+    outbound.start()
+    message_cleaner.load()
+    message_cleaner.start()
+    connection_keeper.start()
+    db.start_data_watcher()
+    global main_loop
+    main_loop = asyncio.get_running_loop()
+    if remote_watch:
+        db.remote_snapshots.fresh_window = remote_fresh_seconds
+        remote_watcher.start()
+    scheduler.add_job(flush_sessions, IntervalTrigger(seconds=10), id='flush_sessions', replace_existing=True)
+    global metrics_runner
+    # Отдельный порт и в режиме webhook: приложение webhook доступно из интернета,
+    # а метрики раскрывают имена серверов и нагрузку
+    if metrics_port and metrics_runner is None:
+        metrics_runner = await start_metrics_server(webapp_host, int(metrics_port))
+        logger.info(f"Метрики доступны на порту {metrics_port}: /metrics")
 
     await load_isp_cache_task()
     
@@ -2540,11 +3048,11 @@ async def on_startup(dp):
                 logger.info(f"Выбран сервер по умолчанию: {current_server}")
             else:
                 logger.error(f"Ошибка при инициализации сервера по умолчанию: {current_server}")
-                await bot.send_message(admin, "Ошибка при инициализации сервера. Проверьте настройки в разделе 'Управление серверами'")
+                notify_admin("Ошибка при инициализации сервера. Проверьте настройки в разделе 'Управление серверами'", priority=PRIORITY_HIGH)
                 return
         else:
             logger.error("Не найдено ни одного сервера")
-            await bot.send_message(admin, "Не найдено ни одного сервера. Добавьте сервер через меню 'Управление серверами'")
+            notify_admin("Не найдено ни одного сервера. Добавьте сервер через меню 'Управление серверами'", priority=PRIORITY_HIGH)
             return
     
     global environment_ready, environment_warning_sent
@@ -2552,9 +3060,9 @@ async def on_startup(dp):
     if not environment_ready:
         if not environment_warning_sent:
             logger.warning("Необходимо инициализировать AmneziaVPN перед запуском бота.")
-            await bot.send_message(
-                admin,
-                "Необходимо инициализировать AmneziaVPN перед запуском бота. Бот продолжит работу, но функции управления сервером могут быть недоступны, пока вы не завершите инициализацию или не обновите SSH ключ в меню 'Управление серверами'."
+            notify_admin(
+                "Необходимо инициализировать AmneziaVPN перед запуском бота. Бот продолжит работу, но функции управления сервером могут быть недоступны, пока вы не завершите инициализацию или не обновите SSH ключ в меню 'Управление серверами'.",
+                priority=PRIORITY_HIGH
             )
             environment_warning_sent = True
     else:
@@ -2583,10 +3091,56 @@ async def on_startup(dp):
                     await deactivate_user(client_name)
 
 async def on_shutdown(dp):
+    await outbound.stop()
+    await message_cleaner.stop()
+    await connection_keeper.stop()
+    remote_watcher.stop()
+    await flush_sessions()
+    if metrics_runner is not None:
+        await metrics_runner.cleanup()
     if scheduler.running:
         scheduler.shutdown()
         logger.info("Планировщик остановлен.")
 
+def _share_modules_with_admin_api():
+    """Отдаёт API уже загруженные ботом db и modules.* под именами awg.*.
+
+    Бот импортирует их как верхнеуровневые модули, а API — через пакет awg.
+    Без подмены в процессе появились бы вторые копии db и modules.*:
+    отдельные SSH-соединения, кеши и наблюдатели, и запись через API не
+    сбрасывала бы кеши бота.
+    """
+    import awg
+
+    sys.modules.setdefault('awg.db', db)
+    awg.db = sys.modules['awg.db']
+    for name, module in list(sys.modules.items()):
+        if name == 'modules' or name.startswith('modules.'):
+            sys.modules.setdefault(f'awg.{name}', module)
+
+def run_webhook():
+    app = build_webhook_app(
+        dp,
+        webhook_url,
+        webhook_path,
+        workers=webhook_workers,
+        secret_token=webhook_secret,
+        on_startup=on_startup,
+        on_shutdown=on_shutdown,
+    )
+    if admin_api_port:
+        project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        if project_root not in sys.path:
+            sys.path.append(project_root)
+        _share_modules_with_admin_api()
+        from awg.platform.api.main import app as admin_api
+        attach_asgi_app(app, admin_api, webapp_host, int(admin_api_port))
+        logger.info(f"Админский API запущен в процессе бота на порту {admin_api_port}")
+    run_webhook_app(app, webapp_host, webapp_port)
+
 if __name__ == '__main__':
     asyncio.set_event_loop(asyncio.new_event_loop())
-    executor.start_polling(dp, on_startup=on_startup, on_shutdown=on_shutdown)
+    if webhook_url:
+        run_webhook()
+    else:
+        executor.start_polling(dp, on_startup=on_startup, on_shutdown=on_shutdown)
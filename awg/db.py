@@ -1,4 +1,6 @@
+import asyncio
 import os
+import re
 import subprocess
 import configparser
 import json
@@ -10,19 +12,63 @@ import paramiko
 import getpass
 import threading
 import time
+import secrets
 import shutil
 import bcrypt
 from datetime import datetime, timedelta
 
+try:
+    from modules import metrics
+    from modules import command_timing
+    from modules.circuit_breaker import BREAKERS
+    from modules.remote_snapshot import RemoteSnapshotCache
+    from modules.data_watcher import BUS, CachedFile, DataDirWatcher
+    from modules.file_lock import atomic_write_json, file_lock
+    from modules.channel_reader import CommandResult, drain_channel, run_local
+except ImportError:
+    from awg.modules import metrics
+    from awg.modules import command_timing
+    from awg.modules.circuit_breaker import BREAKERS
+    from awg.modules.remote_snapshot import RemoteSnapshotCache
+    from awg.modules.data_watcher import BUS, CachedFile, DataDirWatcher
+    from awg.modules.file_lock import atomic_write_json, file_lock
+    from awg.modules.channel_reader import CommandResult, drain_channel, run_local
+
+SSH_COMMAND_ERRORS = metrics.REGISTRY.counter(
+    'awg_ssh_command_errors_total', 'Ошибки выполнения команд по SSH', ('server',)
+)
+PEERS_TOTAL = metrics.REGISTRY.gauge('awg_peers', 'Число пиров в конфигурации сервера', ('server',))
+PEERS_ONLINE = metrics.REGISTRY.gauge('awg_peers_online', 'Пиры с рукопожатием за последние 3 минуты', ('server',))
+PEER_BYTES = metrics.REGISTRY.gauge('awg_peer_bytes', 'Трафик пиров по данным wg show', ('server', 'direction'))
+
 DATA_DIR = 'data'
 SERVERS_ROOT = os.path.join(DATA_DIR, 'servers')
 PROFILES_ROOT = os.path.join(DATA_DIR, 'profiles')
 GLOBAL_CONFIG_PATH = os.path.join(DATA_DIR, 'setting.ini')
 EXPIRATIONS_FILE = os.path.join(DATA_DIR, 'expirations.json')
 SERVERS_FILE = os.path.join(DATA_DIR, 'servers.json')
+SSH_KEEPALIVE_SECONDS = int(os.getenv('SSH_KEEPALIVE_SECONDS') or 30)
 UTC = pytz.UTC
 
 os.makedirs(DATA_DIR, exist_ok=True)
+
+# Изменения этих файлов другим процессом (бот или API) сбрасывают кеши в этом
+DATA_WATCH_FILES = ['servers.json', 'expirations.json', 'profile_registry.json']
+data_watcher = DataDirWatcher(DATA_DIR, DATA_WATCH_FILES, BUS)
+_servers_cache = CachedFile(BUS, 'servers.json', lambda: _read_servers(), path=SERVERS_FILE)
+_expirations_cache = CachedFile(BUS, 'expirations.json', lambda: _read_expirations(), path=EXPIRATIONS_FILE)
+metrics.REGISTRY.counter('awg_cache_requests_total', 'Обращения к кешам', ('cache', 'result')).add_callback(
+    lambda: {
+        ('servers', 'hit'): _servers_cache.hits,
+        ('servers', 'miss'): _servers_cache.misses,
+        ('expirations', 'hit'): _expirations_cache.hits,
+        ('expirations', 'miss'): _expirations_cache.misses,
+    },
+    name='db_data_files',
+)
+
+def start_data_watcher():
+    data_watcher.start()
 os.makedirs(SERVERS_ROOT, exist_ok=True)
 os.makedirs(PROFILES_ROOT, exist_ok=True)
 
@@ -129,16 +175,27 @@ def is_ip_address(value):
     except socket.error:
         return False
 
-def load_servers():
+def _read_servers():
     if not os.path.exists(SERVERS_FILE):
         return {}
-    with open(SERVERS_FILE, 'r') as f:
-        return json.load(f)
+    with file_lock(SERVERS_FILE, shared=True):
+        with open(SERVERS_FILE, 'r') as f:
+            return json.load(f)
+
+def load_servers():
+    return _servers_cache.get()
 
 def save_servers(servers):
-    os.makedirs(os.path.dirname(SERVERS_FILE), exist_ok=True)
-    with open(SERVERS_FILE, 'w') as f:
-        json.dump(servers, f)
+    with file_lock(SERVERS_FILE):
+        atomic_write_json(SERVERS_FILE, servers)
+    BUS.publish(os.path.basename(SERVERS_FILE))
+
+def servers_transaction():
+    """Монопольная блокировка servers.json на весь цикл load_servers → изменение → save_servers."""
+    return file_lock(SERVERS_FILE)
+
+def expirations_transaction():
+    return file_lock(EXPIRATIONS_FILE)
 
 def hash_password(password):
     if not password:
@@ -161,7 +218,6 @@ def add_server(
     endpoint=None,
     server_name=None,
 ):
-    servers = load_servers()
     server_key = str(server_id)
     server_config = {
         'name': server_name or str(server_id),
@@ -177,8 +233,10 @@ def add_server(
         'endpoint': endpoint or (host if host else None),
         'is_remote': 'true'
     }
-    servers[server_key] = server_config
-    save_servers(servers)
+    with servers_transaction():
+        servers = load_servers()
+        servers[server_key] = server_config
+        save_servers(servers)
     
     try:
         ssh = SSHManager(
@@ -197,8 +255,12 @@ def add_server(
                 detected_endpoint = output.strip() if output and not error else None
                 if detected_endpoint:
                     server_config['endpoint'] = detected_endpoint
-                    servers[server_key] = server_config
-                    save_servers(servers)
+                    # Определение адреса идёт по сети: перечитываем файл, чтобы не затереть чужие изменения
+                    with servers_transaction():
+                        servers = load_servers()
+                        if server_key in servers:
+                            servers[server_key]['endpoint'] = detected_endpoint
+                            save_servers(servers)
     except Exception as e:
         logger.error(f"Не удалось получить endpoint для сервера {server_key}: {e}")
     
@@ -207,16 +269,17 @@ def add_server(
 def update_server_password(server_id, new_password):
     if not server_id or not new_password:
         return False
-    servers = load_servers()
-    if server_id not in servers:
-        logger.error(f"Сервер {server_id} не найден при обновлении пароля")
-        return False
-
     hashed = hash_password(new_password)
-    servers[server_id]['password'] = hashed
-    servers[server_id]['_original_password'] = new_password
-    save_servers(servers)
+    with servers_transaction():
+        servers = load_servers()
+        if server_id not in servers:
+            logger.error(f"Сервер {server_id} не найден при обновлении пароля")
+            return False
+        servers[server_id]['password'] = hashed
+        servers[server_id]['_original_password'] = new_password
+        save_servers(servers)
 
+    BREAKERS.discard(server_id)
     if server_id in SSHManager._instances:
         ssh = SSHManager._instances[server_id]
         ssh.password = new_password
@@ -233,16 +296,16 @@ def update_server_password(server_id, new_password):
 def update_server_key(server_id, key_path):
     if not server_id or not key_path:
         return False
-    servers = load_servers()
-    if server_id not in servers:
-        logger.error(f"Сервер {server_id} не найден при обновлении ключа")
-        return False
-
-    servers[server_id]['auth_type'] = 'key'
-    servers[server_id]['key_path'] = key_path
-    servers[server_id]['password'] = None
-    servers[server_id]['_original_password'] = None
-    save_servers(servers)
+    with servers_transaction():
+        servers = load_servers()
+        if server_id not in servers:
+            logger.error(f"Сервер {server_id} не найден при обновлении ключа")
+            return False
+        servers[server_id]['auth_type'] = 'key'
+        servers[server_id]['key_path'] = key_path
+        servers[server_id]['password'] = None
+        servers[server_id]['_original_password'] = None
+        save_servers(servers)
 
     if server_id in SSHManager._instances:
         ssh = SSHManager._instances[server_id]
@@ -268,20 +331,24 @@ def remove_server(server_id):
 
         server_config = servers[server_id]
         
-        expirations = load_expirations()
-        for username in list(expirations.keys()):
-            if server_id in expirations[username]:
-                del expirations[username][server_id]
-                if not expirations[username]:
-                    del expirations[username]
-        save_expirations(expirations)
+        with expirations_transaction():
+            expirations = load_expirations()
+            for username in list(expirations.keys()):
+                if server_id in expirations[username]:
+                    del expirations[username][server_id]
+                    if not expirations[username]:
+                        del expirations[username]
+            save_expirations(expirations)
 
         if server_id in SSHManager._instances:
             SSHManager._instances[server_id].close()
             del SSHManager._instances[server_id]
+        BREAKERS.discard(server_id)
 
-        del servers[server_id]
-        save_servers(servers)
+        with servers_transaction():
+            servers = load_servers()
+            servers.pop(server_id, None)
+            save_servers(servers)
 
         profiles_dir = os.path.join(PROFILES_ROOT, str(server_id))
         if os.path.exists(profiles_dir):
@@ -316,6 +383,7 @@ class SSHManager:
             cls._instances[server_id] = super(SSHManager, cls).__new__(cls)
             cls._instances[server_id].client = None
             cls._instances[server_id].initialized = False
+            cls._instances[server_id]._connect_lock = threading.Lock()
         return cls._instances[server_id]
 
     def __init__(self, server_id=None, host=None, port=None, username=None, auth_type=None, password=None, key_path=None):
@@ -328,87 +396,149 @@ class SSHManager:
             self.auth_type = auth_type
             self.key_path = key_path
             self.password = password
+            self.last_error = None
             self.initialized = True
         if password is not None:
             self.password = password
 
+    def apply_config(self, server):
+        self.host = server['host']
+        self.port = int(server['port'])
+        self.username = server['username']
+        self.auth_type = server['auth_type']
+        if self.auth_type == 'password':
+            if not self.password:
+                self.password = server.get('_original_password')
+                if not self.password:
+                    logger.error("Пароль не установлен")
+                    return False
+        else:
+            self.key_path = server['key_path']
+        return True
+
     def load_settings_from_config(self):
         try:
             servers = load_servers()
             if self.server_id in servers:
-                server = servers[self.server_id]
-                self.host = server['host']
-                self.port = int(server['port'])
-                self.username = server['username']
-                self.auth_type = server['auth_type']
-                if self.auth_type == 'password':
-                    if not self.password:
-                        self.password = server.get('_original_password')
-                        if not self.password:
-                            logger.error("Пароль не установлен")
-                            return False
-                else:
-                    self.key_path = server['key_path']
-                return True
+                return self.apply_config(servers[self.server_id])
             return False
         except Exception as e:
             logger.error(f"Ошибка загрузки настроек SSH: {e}")
             return False
 
-    def ensure_connection(self):
-        if not self.client or not self.client.get_transport() or not self.client.get_transport().is_active():
-            if not all([self.host, self.port, self.username, self.auth_type]):
-                if not self.load_settings_from_config():
-                    logger.error("Не удалось загрузить настройки SSH из конфигурации")
-                    return False
+    def _transport_active(self):
+        transport = self.client.get_transport() if self.client else None
+        return bool(transport and transport.is_active())
 
-            self.client = paramiko.SSHClient()
-            self.client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-            try:
-                if self.auth_type == "password":
-                    self.client.connect(
-                        self.host,
-                        self.port,
-                        self.username,
-                        self.password,
-                        timeout=10,
-                        look_for_keys=False,
-                        allow_agent=False
-                    )
-                    
-                    if not hasattr(self, '_original_password'):
-                        self._original_password = self.password
-                    else:
-                        self.password = self._original_password
-                else:
-                    self.client.connect(
-                        self.host,
-                        self.port,
-                        self.username,
-                        key_filename=self.key_path,
-                        timeout=10,
-                        look_for_keys=False,
-                        allow_agent=False
-                    )
+    def ensure_connection(self, timer=None):
+        if self._transport_active():
+            return True
+        # Фоновое переподключение и запрос пользователя не должны открыть два соединения
+        with self._connect_lock:
+            if self._transport_active():
                 return True
-            except Exception as e:
-                logger.error(f"Ошибка подключения SSH: {e}")
+            return self._connect(timer)
+
+    def _connect(self, timer=None):
+        if not all([self.host, self.port, self.username, self.auth_type]):
+            if not self.load_settings_from_config():
+                logger.error("Не удалось загрузить настройки SSH из конфигурации")
                 return False
-        return True
 
-    def execute_command(self, command):
+        breaker = BREAKERS.get(self.server_id)
+        if not breaker.allow():
+            self.last_error = f"Сервер недоступен, повтор через {breaker.retry_in():.0f} с: {breaker.last_error}"
+            return False
+
+        connect_started = time.perf_counter()
+        self.client = paramiko.SSHClient()
+        self.client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
         try:
-            if not self.ensure_connection():
-                return None, "Failed to establish SSH connection"
-            
-            stdin, stdout, stderr = self.client.exec_command(command, timeout=30)
-            output = stdout.read().decode()
-            error = stderr.read().decode()
-            return output, error
+            if self.auth_type == "password":
+                self.client.connect(
+                    self.host,
+                    self.port,
+                    self.username,
+                    self.password,
+                    timeout=10,
+                    look_for_keys=False,
+                    allow_agent=False
+                )
+                
+                if not hasattr(self, '_original_password'):
+                    self._original_password = self.password
+                else:
+                    self.password = self._original_password
+            else:
+                self.client.connect(
+                    self.host,
+                    self.port,
+                    self.username,
+                    key_filename=self.key_path,
+                    timeout=10,
+                    look_for_keys=False,
+                    allow_agent=False
+                )
+            # Keepalive держит NAT и firewall открытыми и быстрее выявляет
+            # разорванное соединение, чем ошибка следующей команды
+            self.client.get_transport().set_keepalive(SSH_KEEPALIVE_SECONDS)
+            if timer is not None:
+                timer.mark('connect', since=connect_started)
+            breaker.record_success()
+            return True
+        except Exception as e:
+            logger.error(f"Ошибка подключения SSH: {e}")
+            self.last_error = f"Ошибка подключения SSH: {e}"
+            breaker.record_failure(e)
+            return False
+
+    def run(self, command, on_stdout_line=None, on_stderr_line=None, timeout=30):
+        """Выполняет команду и возвращает CommandResult с кодом завершения.
+
+        Успех определяется по коду завершения, а не по содержимому stderr:
+        wg-quick и docker пишут туда предупреждения и при удачном запуске.
+        """
+        timer = command_timing.CommandTimer(self.server_id, command)
+        try:
+            if not self.ensure_connection(timer):
+                SSH_COMMAND_ERRORS.labels(self.server_id).inc()
+                return CommandResult('', self.last_error or "Failed to establish SSH connection", None)
+
+            metrics.count_nested_call('ssh')
+            channel_started = time.perf_counter()
+            channel = self.client.get_transport().open_session(timeout=timeout)
+            timer.mark('channel_open', since=channel_started)
+            try:
+                channel.exec_command(command)
+                result = drain_channel(
+                    channel,
+                    timeout=timeout,
+                    on_stdout_line=on_stdout_line,
+                    on_stderr_line=on_stderr_line,
+                    on_first_byte=lambda: timer.mark('first_byte'),
+                )
+            finally:
+                channel.close()
+            if not result.ok:
+                SSH_COMMAND_ERRORS.labels(self.server_id).inc()
+            return result
         except Exception as e:
             logger.error(f"Ошибка выполнения команды: {e}")
+            SSH_COMMAND_ERRORS.labels(self.server_id).inc()
+            BREAKERS.get(self.server_id).record_failure(e)
             self.client = None
-            return None, str(e)
+            return CommandResult('', str(e), None)
+        finally:
+            timer.finish()
+
+    def execute_command(self, command):
+        """Совместимая обёртка над run(): (stdout, текст ошибки или '' при нулевом коде)."""
+        result = self.run(command)
+        if result.exit_status is None:
+            return None, result.describe_error()
+        if not result.ok:
+            return result.stdout, result.describe_error()
+        return result.stdout, ''
 
     def connect(self):
         if not all([self.host, self.port, self.username, self.auth_type]):
@@ -427,41 +557,167 @@ class SSHManager:
 
 ssh_manager = SSHManager()
 
+SSH_SESSIONS = metrics.REGISTRY.counter(
+    'awg_ssh_sessions_total',
+    'Выдачи соединений: reused — живое соединение, connected — новое подключение, failed — ошибка',
+    ('result',),
+)
+
+
+class ServerSessions:
+    """Единая точка получения соединения с сервером и выполнения команд на нём.
+
+    Настройки серверов читаются из servers.json один раз и перечитываются
+    только при изменении файла. Для локального сервера команды выполняются
+    через subprocess с тем же CommandResult.
+    """
+
+    def __init__(self):
+        self._servers = {}
+        self._servers_mtime = None
+        self._lock = threading.Lock()
+
+    def server_config(self, server_id):
+        try:
+            mtime = os.stat(SERVERS_FILE).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        if mtime != self._servers_mtime:
+            with self._lock:
+                if mtime != self._servers_mtime:
+                    self._servers = load_servers() if mtime is not None else {}
+                    self._servers_mtime = mtime
+        return self._servers.get(server_id)
+
+    def is_remote(self, server_id):
+        config = self.server_config(server_id)
+        return bool(config) and config.get('is_remote') == 'true'
+
+    def manager(self, server_id):
+        ssh = SSHManager(server_id=server_id)
+        if not ssh.host:
+            config = self.server_config(server_id)
+            if config:
+                ssh.apply_config(config)
+        return ssh
+
+    def get(self, server_id):
+        """SSHManager с открытым соединением или None, если подключиться не удалось."""
+        ssh = self.manager(server_id)
+        if ssh._transport_active():
+            SSH_SESSIONS.labels('reused').inc()
+            return ssh
+        if ssh.ensure_connection():
+            SSH_SESSIONS.labels('connected').inc()
+            return ssh
+        SSH_SESSIONS.labels('failed').inc()
+        logger.error(f"Не удалось установить SSH соединение с сервером {server_id}: {ssh.last_error}")
+        return None
+
+    def run(self, server_id, command, on_stdout_line=None, on_stderr_line=None, timeout=30):
+        if not self.is_remote(server_id):
+            # Локальный docker exec учитывается наравне с командой по SSH
+            metrics.count_nested_call('ssh')
+            timer = command_timing.CommandTimer(server_id, command)
+            try:
+                return run_local(command, timeout, on_stdout_line, on_stderr_line)
+            finally:
+                timer.finish()
+        ssh = self.get(server_id)
+        if ssh is None:
+            return CommandResult('', self.manager(server_id).last_error or "Failed to establish SSH connection", None)
+        return ssh.run(command, on_stdout_line, on_stderr_line, timeout)
+
+    async def run_async(self, server_id, command, on_stdout_line=None, on_stderr_line=None, timeout=30):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            None, self.run, server_id, command, on_stdout_line, on_stderr_line, timeout
+        )
+
+    def stats(self):
+        return {
+            result: int(SSH_SESSIONS.labels(result).value)
+            for result in ('reused', 'connected', 'failed')
+        }
+
+
+server_sessions = ServerSessions()
+
+CLIENTS_TABLE_PATH = '/opt/amnezia/awg/clientsTable'
+remote_snapshots = RemoteSnapshotCache()
+
+def read_server_files(server_id, *paths):
+    """Содержимое файлов в контейнере сервера; скачиваются только файлы с изменившимся sha256."""
+    setting = server_sessions.server_config(server_id) or {}
+    docker_container = setting.get('docker_container')
+    if not docker_container:
+        logger.error(f"Сервер {server_id} не найден")
+        return None
+    files = remote_snapshots.read(
+        server_id,
+        docker_container,
+        list(paths),
+        lambda command: server_sessions.run(server_id, command),
+    )
+    if files is None:
+        logger.error(f"Не удалось прочитать файлы сервера {server_id}: {', '.join(paths)}")
+    return files
+
 def execute_docker_command(command, server_id=None):
     if server_id is None:
         raise Exception("Server ID is required")
-    setting = get_config(server_id=server_id)
-    if setting.get("is_remote") == "true":
-        try:
-            servers = load_servers()
-            server_config = servers.get(server_id, {})
-            
-            if server_id in SSHManager._instances and hasattr(SSHManager._instances[server_id], '_original_password'):
-                ssh = SSHManager._instances[server_id]
-            else:
-                ssh = SSHManager(
-                    server_id=server_id,
-                    host=server_config.get('host'),
-                    port=int(server_config.get('port', 22)),
-                    username=server_config.get('username'),
-                    auth_type=server_config.get('auth_type'),
-                    key_path=server_config.get('key_path'),
-                    password=server_config.get('_original_password')
-                )
-            if not ssh.ensure_connection():
-                raise Exception("Не удалось установить SSH подключение")
-
-            output, error = ssh.execute_command(command)
-            if error and ('error' in error.lower() or 'command not found' in error.lower()):
-                raise Exception(error)
-            if output is None:
-                raise Exception("Failed to execute command")
-            return output
-        except Exception as e:
-            raise Exception(f"SSH command failed: {e}")
-    else:
-        return subprocess.check_output(command, shell=True).decode()
+    result = server_sessions.run(server_id, command)
+    if not result.ok:
+        prefix = "SSH command failed" if server_sessions.is_remote(server_id) else "Local command failed"
+        raise Exception(f"{prefix}: {result.describe_error()}")
+    return result.stdout
     
+def remote_server_ids():
+    return [server_id for server_id, server in load_servers().items() if server.get('is_remote') == 'true']
+
+def is_server_connected(server_id):
+    ssh = SSHManager._instances.get(server_id)
+    return ssh is not None and ssh._transport_active()
+
+def connect_server(server_id):
+    """Открывает соединение заранее, чтобы запрос пользователя не ждал рукопожатия."""
+    return server_sessions.manager(server_id).connect()
+
+def watch_targets():
+    """Серверы и файлы для наблюдения: {server_id: (контейнер, [wg0.conf, clientsTable])}."""
+    targets = {}
+    for server_id, server in load_servers().items():
+        if server.get('is_remote') != 'true' or not server.get('docker_container'):
+            continue
+        targets[server_id] = (server['docker_container'], [server['wg_config_file'], CLIENTS_TABLE_PATH])
+    return targets
+
+def open_watch_channel(server_id, command):
+    """Отдельный канал на общем соединении сервера для долгоживущей команды."""
+    ssh = server_sessions.get(server_id)
+    if ssh is None:
+        return None
+    channel = ssh.client.get_transport().open_session(timeout=30)
+    channel.exec_command(command)
+    return channel
+
+def is_server_available(server_id):
+    """False, пока цепь сервера разомкнута после серии ошибок подключения."""
+    return BREAKERS.is_available(server_id)
+
+def probe_server(server_id):
+    """Пробное подключение к серверу с разомкнутой цепью; вызывается из фоновой задачи."""
+    return server_sessions.run(server_id, "true", timeout=10).ok
+
+def get_circuit_states():
+    return BREAKERS.snapshot()
+
+def get_ssh_timings():
+    return command_timing.timing_summary()
+
+def get_slow_commands(limit=20):
+    return command_timing.slow_commands(limit)
+
 def get_amnezia_container():
     try:
         cmd = "docker ps --filter 'name=amnezia-awg' --format '{{.Names}}'"
@@ -721,14 +977,15 @@ def create_config(path=GLOBAL_CONFIG_PATH, servers_list=None):
                     endpoint=server.get('endpoint')
                 )
             else:
-                servers = load_servers()
-                servers[server['name']] = {
-                    'docker_container': server['docker_container'],
-                    'wg_config_file': server['wg_config_file'],
-                    'endpoint': server['endpoint'],
-                    'is_remote': 'false'
-                }
-                save_servers(servers)
+                with servers_transaction():
+                    servers = load_servers()
+                    servers[server['name']] = {
+                        'docker_container': server['docker_container'],
+                        'wg_config_file': server['wg_config_file'],
+                        'endpoint': server['endpoint'],
+                        'is_remote': 'false'
+                    }
+                    save_servers(servers)
 
     with open(path, "w") as config_file:
         config.write(config_file)
@@ -756,87 +1013,46 @@ def get_config(path=GLOBAL_CONFIG_PATH, server_id=None):
 
         return out
 
-def get_clients_from_clients_table(server_id=None):
-    if server_id is None:
-        return {}
-    setting = get_config(server_id=server_id)
-    docker_container = setting['docker_container']
-    clients_table_path = '/opt/amnezia/awg/clientsTable'
-    is_remote = setting.get('is_remote') == 'true'
-    
+def _parse_clients_table(content):
     try:
-        if is_remote:
-            servers = load_servers()
-            server_config = servers.get(server_id, {})
-            
-            if server_id in SSHManager._instances and hasattr(SSHManager._instances[server_id], '_original_password'):
-                ssh = SSHManager._instances[server_id]
-            else:
-                ssh = SSHManager(
-                    server_id=server_id,
-                    host=server_config.get('host'),
-                    port=int(server_config.get('port', 22)),
-                    username=server_config.get('username'),
-                    auth_type=server_config.get('auth_type'),
-                    key_path=server_config.get('key_path'),
-                    password=server_config.get('_original_password')
-                )
-            if not ssh.connect():
-                logger.error("Не удалось установить SSH соединение")
-                return {}
-                
-        cmd = f"docker exec -i {docker_container} cat {clients_table_path}"
-        if is_remote:
-            output, error = ssh.execute_command(cmd)
-            if error:
-                logger.error(f"Ошибка выполнения команды: {error}")
-                return {}
-            clients_table = json.loads(output or "[]")
-        else:
-            output = subprocess.check_output(cmd, shell=True).decode()
-            clients_table = json.loads(output)
-            
-        client_map = {client['clientId']: client['userData']['clientName'] for client in clients_table}
-        return client_map
+        clients_table = json.loads(content or "[]")
+        return {client['clientId']: client['userData']['clientName'] for client in clients_table}
     except Exception as e:
         logger.error(f"Ошибка при получении clientsTable: {e}")
         return {}
 
+def get_clients_from_clients_table(server_id=None):
+    if server_id is None:
+        return {}
+    files = read_server_files(server_id, CLIENTS_TABLE_PATH)
+    if files is None:
+        return {}
+    return _parse_clients_table(files[CLIENTS_TABLE_PATH])
+
 def parse_client_name(full_name):
     return full_name.split('[')[0].strip()
 
 def get_client_list(server_id=None):
+    """Клиенты сервера [имя, PublicKey, AllowedIPs]; None, если конфигурацию не удалось прочитать.
+
+    Пустой список означает, что клиентов действительно нет: по нему можно
+    удалять локальные профили, а по None — нельзя.
+    """
     if server_id is None:
         return []
     setting = get_config(server_id=server_id)
     wg_config_file = setting['wg_config_file']
-    docker_container = setting['docker_container']
-    is_remote = setting.get('is_remote') == 'true'
-
-    client_map = get_clients_from_clients_table(server_id=server_id)
 
     try:
-        if is_remote:
-            servers = load_servers()
-            server_config = servers.get(server_id, {})
-            
-            if server_id in SSHManager._instances and hasattr(SSHManager._instances[server_id], '_original_password'):
-                ssh = SSHManager._instances[server_id]
-            else:
-                ssh = SSHManager(
-                    server_id=server_id,
-                    host=server_config.get('host'),
-                    port=int(server_config.get('port', 22)),
-                    username=server_config.get('username'),
-                    auth_type=server_config.get('auth_type'),
-                    key_path=server_config.get('key_path'),
-                    password=server_config.get('_original_password')
-                )
-            if not ssh.connect():
-                logger.error("Не удалось установить SSH соединение")
-                return []
-        cmd = f"docker exec -i {docker_container} cat {wg_config_file}"
-        config_content = execute_docker_command(cmd, server_id=server_id)
+        # wg0.conf и clientsTable проверяются одной командой
+        files = read_server_files(server_id, wg_config_file, CLIENTS_TABLE_PATH)
+        if files is None:
+            return None
+        config_content = files[wg_config_file]
+        if config_content is None:
+            logger.error(f"Файл {wg_config_file} не найден на сервере {server_id}")
+            return None
+        client_map = _parse_clients_table(files[CLIENTS_TABLE_PATH])
 
         clients = []
         lines = config_content.splitlines()
@@ -867,48 +1083,24 @@ def get_client_list(server_id=None):
         return clients
     except Exception as e:
         logger.error(f"Ошибка при получении списка клиентов: {e}")
-        return []
+        return None
 
 def get_active_list(server_id=None):
     if server_id is None:
         return []
     setting = get_config(server_id=server_id)
     docker_container = setting['docker_container']
-    is_remote = setting.get('is_remote') == 'true'
     
     try:
-        clients = get_client_list(server_id=server_id)
+        clients = get_client_list(server_id=server_id) or []
         client_key_map = {client[1]: client[0] for client in clients}
         
-        if is_remote:
-            servers = load_servers()
-            server_config = servers.get(server_id, {})
-            
-            if server_id in SSHManager._instances and hasattr(SSHManager._instances[server_id], '_original_password'):
-                ssh = SSHManager._instances[server_id]
-            else:
-                ssh = SSHManager(
-                    server_id=server_id,
-                    host=server_config.get('host'),
-                    port=int(server_config.get('port', 22)),
-                    username=server_config.get('username'),
-                    auth_type=server_config.get('auth_type'),
-                    key_path=server_config.get('key_path'),
-                    password=server_config.get('_original_password')
-                )
-            if not ssh.connect():
-                logger.error("Не удалось установить SSH соединение")
-                return []
-                
         cmd = f"docker exec -i {docker_container} wg show"
-        if is_remote:
-            output, error = ssh.execute_command(cmd)
-            if error:
-                logger.error(f"Ошибка выполнения команды: {error}")
-                return []
-            wg_output = output
-        else:
-            wg_output = subprocess.check_output(cmd, shell=True).decode()
+        result = server_sessions.run(server_id, cmd)
+        if not result.ok:
+            logger.error(f"Ошибка выполнения команды: {result.describe_error()}")
+            return []
+        wg_output = result.stdout
         
         active_clients = []
         current_peer = {}
@@ -932,11 +1124,56 @@ def get_active_list(server_id=None):
             current_peer['name'] = client_key_map[current_peer['public_key']]
             active_clients.append(current_peer)
             
+        _record_peer_metrics(server_id, len(clients), active_clients)
         return active_clients
     except Exception as e:
         logger.error(f"Error getting active list: {e}")
         return []
 
+_HANDSHAKE_UNITS = {'second': 1, 'minute': 60, 'hour': 3600, 'day': 86400, 'week': 604800}
+_SIZE_UNITS = {'B': 1, 'KiB': 1024, 'MiB': 1024 ** 2, 'GiB': 1024 ** 3, 'TiB': 1024 ** 4}
+
+
+def _handshake_age(value):
+    """Возраст рукопожатия в секундах из строки wg show ("1 minute, 5 seconds ago")."""
+    if not value:
+        return None
+    if value.strip().lower() == 'now':
+        return 0
+    total = 0
+    matched = False
+    for amount, unit in re.findall(r'(\d+)\s+(second|minute|hour|day|week)s?', value):
+        total += int(amount) * _HANDSHAKE_UNITS[unit]
+        matched = True
+    return total if matched else None
+
+
+def _transfer_bytes(value):
+    received = sent = 0.0
+    for amount, unit, direction in re.findall(r'([\d.]+)\s+(B|KiB|MiB|GiB|TiB)\s+(received|sent)', value or ''):
+        size = float(amount) * _SIZE_UNITS[unit]
+        if direction == 'received':
+            received += size
+        else:
+            sent += size
+    return received, sent
+
+
+def _record_peer_metrics(server_id, peers_count, active_clients):
+    online = 0
+    received_total = sent_total = 0.0
+    for peer in active_clients:
+        age = _handshake_age(peer.get('last_handshake'))
+        if age is not None and age <= 180:
+            online += 1
+        received, sent = _transfer_bytes(peer.get('transfer'))
+        received_total += received
+        sent_total += sent
+    PEERS_TOTAL.labels(server_id).set(peers_count)
+    PEERS_ONLINE.labels(server_id).set(online)
+    PEER_BYTES.labels(server_id, 'received').set(received_total)
+    PEER_BYTES.labels(server_id, 'sent').set(sent_total)
+
 def root_add(id_user, server_id=None, ipv6=False, owner_slug=None):
     if server_id is None:
         return False
@@ -949,6 +1186,8 @@ def root_add(id_user, server_id=None, ipv6=False, owner_slug=None):
     owner_slug = owner_slug or resolve_owner_slug(id_user, server_id)
 
     clients = get_client_list(server_id=server_id)
+    if clients is None:
+        return False
     client_entry = next((c for c in clients if c[0] == id_user), None)
     if client_entry:
         logger.info(f"Пользователь {id_user} уже существует.")
@@ -959,65 +1198,50 @@ def root_add(id_user, server_id=None, ipv6=False, owner_slug=None):
 
     if is_remote:
         try:
-            servers = load_servers()
-            server_config = servers.get(server_id, {})
-
-            if server_id in SSHManager._instances and hasattr(SSHManager._instances[server_id], '_original_password'):
-                ssh = SSHManager._instances[server_id]
-            else:
-                ssh = SSHManager(
-                    server_id=server_id,
-                    host=server_config.get('host'),
-                    port=int(server_config.get('port', 22)),
-                    username=server_config.get('username'),
-                    auth_type=server_config.get('auth_type'),
-                    key_path=server_config.get('key_path'),
-                    password=server_config.get('_original_password')
-                )
-            if not ssh.connect():
-                logger.error("Не удалось установить SSH соединение")
+            ssh = server_sessions.get(server_id)
+            if ssh is None:
                 return False
 
-            output, error = ssh.execute_command(f"docker exec -i {docker_container} wg genkey")
-            if error:
-                logger.error(f"Ошибка генерации приватного ключа: {error}")
+            result = ssh.run(f"docker exec -i {docker_container} wg genkey")
+            if not result.ok:
+                logger.error(f"Ошибка генерации приватного ключа: {result.describe_error()}")
                 return False
-            private_key = output.strip()
+            private_key = result.stdout.strip()
 
             cmd = f"echo '{private_key}' | docker exec -i {docker_container} wg pubkey"
-            output, error = ssh.execute_command(cmd)
-            if error:
-                logger.error(f"Ошибка генерации публичного ключа: {error}")
+            result = ssh.run(cmd)
+            if not result.ok:
+                logger.error(f"Ошибка генерации публичного ключа: {result.describe_error()}")
                 return False
-            client_public_key = output.strip()
+            client_public_key = result.stdout.strip()
 
-            output, error = ssh.execute_command(f"docker exec -i {docker_container} wg genpsk")
-            if error:
-                logger.error(f"Ошибка генерации PSK: {error}")
+            result = ssh.run(f"docker exec -i {docker_container} wg genpsk")
+            if not result.ok:
+                logger.error(f"Ошибка генерации PSK: {result.describe_error()}")
                 return False
-            psk = output.strip()
+            psk = result.stdout.strip()
 
             server_conf_path = os.path.join(server_dir_path, 'server.conf')
-            output, error = ssh.execute_command(f"docker exec -i {docker_container} cat {wg_config_file}")
-            if error:
-                logger.error(f"Ошибка получения конфигурации сервера: {error}")
+            result = ssh.run(f"docker exec -i {docker_container} cat {wg_config_file}")
+            if not result.ok:
+                logger.error(f"Ошибка получения конфигурации сервера: {result.describe_error()}")
                 return False
             with open(server_conf_path, 'w') as f:
-                f.write(output)
+                f.write(result.stdout)
 
             cmd = f"docker exec -i {docker_container} sh -c 'grep PrivateKey {wg_config_file} | cut -d\" \" -f 3'"
-            output, error = ssh.execute_command(cmd)
-            if error:
-                logger.error(f"Ошибка получения приватного ключа сервера: {error}")
+            result = ssh.run(cmd)
+            if not result.ok:
+                logger.error(f"Ошибка получения приватного ключа сервера: {result.describe_error()}")
                 return False
-            server_private_key = output.strip()
+            server_private_key = result.stdout.strip()
 
             cmd = f"echo '{server_private_key}' | docker exec -i {docker_container} wg pubkey"
-            output, error = ssh.execute_command(cmd)
-            if error:
-                logger.error(f"Ошибка генерации публичного ключа сервера: {error}")
+            result = ssh.run(cmd)
+            if not result.ok:
+                logger.error(f"Ошибка генерации публичного ключа сервера: {result.describe_error()}")
                 return False
-            server_public_key = output.strip()
+            server_public_key = result.stdout.strip()
 
             if not all([private_key, client_public_key, server_public_key, psk]):
                 logger.error("Не все ключи были успешно сгенерированы")
@@ -1118,6 +1342,7 @@ AllowedIPs = {client_ip}
                     "last_outgoing": 0
                 }, f)
 
+            remote_snapshots.invalidate(server_id)
             return True
 
         except Exception as e:
@@ -1134,6 +1359,7 @@ AllowedIPs = {client_ip}
             owner_slug or _default_owner_slug(id_user)
         ]
         if subprocess.call(cmd) == 0:
+            remote_snapshots.invalidate(server_id)
             return True
         return False
 
@@ -1146,6 +1372,8 @@ def deactive_user_db(client_name, server_id=None):
     is_remote = setting.get('is_remote') == 'true'
 
     clients = get_client_list(server_id=server_id)
+    if clients is None:
+        return False
     client_entry = next((c for c in clients if c[0] == client_name), None)
     if not client_entry:
         logger.error(f"Пользователь {client_name} не найден в списке клиентов.")
@@ -1156,23 +1384,8 @@ def deactive_user_db(client_name, server_id=None):
 
     if is_remote:
         try:
-            servers = load_servers()
-            server_config = servers.get(server_id, {})
-            
-            if server_id in SSHManager._instances and hasattr(SSHManager._instances[server_id], '_original_password'):
-                ssh = SSHManager._instances[server_id]
-            else:
-                ssh = SSHManager(
-                    server_id=server_id,
-                    host=server_config.get('host'),
-                    port=int(server_config.get('port', 22)),
-                    username=server_config.get('username'),
-                    auth_type=server_config.get('auth_type'),
-                    key_path=server_config.get('key_path'),
-                    password=server_config.get('_original_password')
-                )
-            if not ssh.connect():
-                logger.error("Не удалось установить SSH соединение")
+            ssh = server_sessions.get(server_id)
+            if ssh is None:
                 return False
 
             awk_script = f"""
@@ -1234,9 +1447,9 @@ def deactive_user_db(client_name, server_id=None):
             ]
 
             for cmd in commands:
-                output, error = ssh.execute_command(cmd)
-                if error and not ('Warning' in error or 'wireguard-go' in error):
-                    logger.error(f"Ошибка выполнения команды {cmd}: {error}")
+                result = ssh.run(cmd)
+                if not result.ok:
+                    logger.error(f"Ошибка выполнения команды {cmd}: {result.describe_error()}")
                     return False
                 
             output, _ = ssh.execute_command(f"docker exec -i {docker_container} cat /opt/amnezia/awg/clientsTable")
@@ -1251,6 +1464,7 @@ def deactive_user_db(client_name, server_id=None):
                 logger.error(f"Ошибка обновления clientsTable: {e}")
 
             cleanup_local_profile(client_name, server_id)
+            remote_snapshots.invalidate(server_id)
             return True
 
         except Exception as e:
@@ -1268,13 +1482,300 @@ def deactive_user_db(client_name, server_id=None):
         ]
         if subprocess.call(cmd) == 0:
             cleanup_local_profile(client_name, server_id)
+            remote_snapshots.invalidate(server_id)
             return True
         return False
 
+WG_EXTRA_PARAMS = ('Jc', 'Jmin', 'Jmax', 'S1', 'S2', 'H1', 'H2', 'H3', 'H4')
+
+def _restart_interface_command(docker_container, wg_config_file):
+    return f"docker exec -i {docker_container} sh -c 'wg-quick down {wg_config_file} && wg-quick up {wg_config_file}'"
+
+def _upload_to_container(server_id, docker_container, local_path, target):
+    """Копирует локальный файл в контейнер сервера: по SFTP во временный файл и docker cp."""
+    if not server_sessions.is_remote(server_id):
+        return server_sessions.run(server_id, f"docker cp {local_path} {docker_container}:{target}")
+    ssh = server_sessions.get(server_id)
+    if ssh is None:
+        return CommandResult('', "Failed to establish SSH connection", None)
+    remote_tmp = f"/tmp/{os.path.basename(local_path)}.{secrets.token_hex(8)}"
+    sftp = ssh.client.open_sftp()
+    try:
+        sftp.put(local_path, remote_tmp)
+    finally:
+        sftp.close()
+    result = ssh.run(f"docker cp {remote_tmp} {docker_container}:{target}")
+    ssh.run(f"rm -f {remote_tmp}")
+    return result
+
+def _read_peer_files(server_id, wg_config_file):
+    """wg0.conf и clientsTable из проверенного по sha256 снимка; None при ошибке."""
+    # Перед записью хеши сверяются заново: файл мог поменяться с прошлой проверки
+    remote_snapshots.invalidate(server_id)
+    files = read_server_files(server_id, wg_config_file, CLIENTS_TABLE_PATH)
+    if files is None or files[wg_config_file] is None:
+        return None
+    try:
+        clients_table = json.loads(files[CLIENTS_TABLE_PATH] or "[]")
+    except json.JSONDecodeError:
+        clients_table = []
+    return files[wg_config_file], clients_table
+
+def _upload_peer_files(server_id, docker_container, wg_config_file, config_content, clients_table):
+    server_dir_path = server_storage_dir(server_id)
+    server_conf_path = os.path.join(server_dir_path, 'server.conf')
+    clients_table_path = os.path.join(server_dir_path, 'clientsTable')
+    with open(server_conf_path, 'w') as f:
+        f.write(config_content)
+    with open(clients_table_path, 'w') as f:
+        json.dump(clients_table, f)
+
+    result = _upload_to_container(server_id, docker_container, server_conf_path, wg_config_file)
+    if not result.ok:
+        return f"Ошибка загрузки {wg_config_file}: {result.describe_error()}"
+    result = _upload_to_container(server_id, docker_container, clients_table_path, CLIENTS_TABLE_PATH)
+    if not result.ok:
+        return f"Ошибка загрузки clientsTable: {result.describe_error()}"
+    return None
+
+def _write_peer_files(server_id, docker_container, wg_config_file, original, updated):
+    """Загружает wg0.conf и clientsTable и один раз перезапускает интерфейс; текст ошибки или None.
+
+    original и updated — пары (содержимое wg0.conf, clientsTable). При любой
+    ошибке на сервер возвращаются исходные файлы, чтобы конфигурация не
+    осталась изменённой наполовину.
+    """
+    restart = _restart_interface_command(docker_container, wg_config_file)
+    try:
+        error = _upload_peer_files(server_id, docker_container, wg_config_file, *updated)
+        if error is None:
+            result = server_sessions.run(server_id, restart)
+            if result.ok:
+                return None
+            error = f"Ошибка перезапуска интерфейса: {result.describe_error()}"
+    except Exception as e:
+        error = f"Ошибка записи конфигурации: {e}"
+
+    logger.error(f"Сервер {server_id}: {error}; возвращаем прежние wg0.conf и clientsTable")
+    try:
+        if _upload_peer_files(server_id, docker_container, wg_config_file, *original) is None:
+            server_sessions.run(server_id, restart)
+    except Exception as e:
+        logger.error(f"Не удалось восстановить конфигурацию сервера {server_id}: {e}")
+    return error
+
+def _config_value(config_content, key):
+    for line in config_content.splitlines():
+        name, sep, value = line.partition('=')
+        if sep and name.strip() == key:
+            return value.strip()
+    return None
+
+def _remove_peer_sections(config_content, public_keys):
+    """wg0.conf без секций [Peer] с указанными PublicKey."""
+    sections = [[]]
+    for line in config_content.splitlines():
+        if line.strip().startswith('['):
+            sections.append([])
+        sections[-1].append(line)
+    kept = [
+        section for section in sections
+        if not (section and section[0].strip() == '[Peer]' and _config_value('\n'.join(section), 'PublicKey') in public_keys)
+    ]
+    return '\n'.join(line for section in kept for line in section) + '\n'
+
+def _prepare_batch_keys(server_id, docker_container, config_content, count):
+    """Ключи клиентов и параметры сервера для root_add_batch; RuntimeError при ошибке."""
+    server_private_key = _config_value(config_content, 'PrivateKey')
+    listen_port = _config_value(config_content, 'ListenPort')
+    if not server_private_key or not listen_port:
+        raise RuntimeError("не удалось получить ключ или порт сервера")
+    additional_params = [
+        line.strip() for line in config_content.splitlines()
+        if any(line.startswith(param) for param in WG_EXTRA_PARAMS)
+    ]
+
+    result = server_sessions.run(server_id, f"echo '{server_private_key}' | docker exec -i {docker_container} wg pubkey")
+    if not result.ok:
+        raise RuntimeError(f"ошибка генерации публичного ключа сервера: {result.describe_error()}")
+    server_public_key = result.stdout.strip()
+
+    # Ключи всех клиентов одной командой: по строке «приватный публичный psk» на клиента
+    keygen = (
+        f"docker exec -i {docker_container} sh -c "
+        f"'for i in $(seq {count}); do k=$(wg genkey); "
+        f"echo \"$k $(echo \"$k\" | wg pubkey) $(wg genpsk)\"; done'"
+    )
+    result = server_sessions.run(server_id, keygen, timeout=max(30, count // 10))
+    keys = [line.split() for line in result.stdout.splitlines() if line.strip()]
+    if not result.ok or len(keys) != count or any(len(triple) != 3 for triple in keys):
+        raise RuntimeError(f"ошибка генерации ключей: {result.describe_error() if not result.ok else 'неполный вывод'}")
+    return keys, server_public_key, listen_port, additional_params
+
+def root_add_batch(clients, server_id=None):
+    """Добавляет несколько клиентов одной записью wg0.conf и clientsTable и одним перезапуском интерфейса.
+
+    clients — список пар (имя, owner_slug). Возвращает {имя: None при успехе или текст ошибки}.
+    """
+    if server_id is None or not clients:
+        return {}
+    setting = get_config(server_id=server_id)
+    endpoint = setting['endpoint']
+    wg_config_file = setting['wg_config_file']
+    docker_container = setting['docker_container']
+
+    files = _read_peer_files(server_id, wg_config_file)
+    if files is None:
+        return {name: "Не удалось прочитать конфигурацию сервера" for name, _ in clients}
+    config_content, clients_table = files
+
+    results = {}
+    existing = {parse_client_name(client['userData']['clientName']) for client in clients_table if 'userData' in client}
+    existing.update(parse_client_name(line.strip()[1:].strip()) for line in config_content.splitlines() if line.strip().startswith('#'))
+    used_octets = {int(octet) for octet in re.findall(r'10\.8\.1\.(\d+)/32', config_content)}
+    free_octets = (octet for octet in range(2, 255) if octet not in used_octets)
+    pending = []
+    for name, owner_slug in clients:
+        if name in existing or name in results:
+            results[name] = "Профиль с таким именем уже существует на этом сервере."
+            continue
+        octet = next(free_octets, None)
+        if octet is None:
+            results[name] = "Нет свободных IP-адресов"
+            continue
+        results[name] = None
+        pending.append((name, owner_slug, f"10.8.1.{octet}/32"))
+    if not pending:
+        return results
+
+    def fail(message):
+        logger.error(f"Пакетное добавление клиентов на сервер {server_id}: {message}")
+        for name, _, _ in pending:
+            results[name] = message
+        return results
+
+    try:
+        keys, server_public_key, listen_port, additional_params = _prepare_batch_keys(
+            server_id, docker_container, config_content, len(pending)
+        )
+    except Exception as e:
+        return fail(f"Ошибка при добавлении пользователей: {e}")
+
+    creation_date = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    original_table = list(clients_table)
+    peers = []
+    for (name, _, client_ip), (_, client_public_key, psk) in zip(pending, keys):
+        peers.append(f"""
+[Peer]
+# {name}
+PublicKey = {client_public_key}
+PresharedKey = {psk}
+AllowedIPs = {client_ip}
+""")
+        clients_table.append({
+            "clientId": client_public_key,
+            "userData": {
+                "clientName": name,
+                "creationDate": creation_date
+            }
+        })
+
+    error = _write_peer_files(
+        server_id, docker_container, wg_config_file,
+        (config_content, original_table),
+        (config_content.rstrip('\n') + '\n' + ''.join(peers), clients_table),
+    )
+    remote_snapshots.invalidate(server_id)
+    if error:
+        return fail(error)
+
+    for (name, owner_slug, client_ip), (private_key, _, psk) in zip(pending, keys):
+        try:
+            profile_path = profile_dir(server_id, name, owner_slug=owner_slug)
+            with open(os.path.join(profile_path, f"{name}.conf"), 'w') as f:
+                f.write(f"""[Interface]
+Address = {client_ip}
+DNS = 1.1.1.1, 1.0.0.1
+PrivateKey = {private_key}
+{os.linesep.join(additional_params)}
+[Peer]
+PublicKey = {server_public_key}
+PresharedKey = {psk}
+AllowedIPs = 0.0.0.0/0
+Endpoint = {endpoint}:{listen_port}
+PersistentKeepalive = 25""")
+            with open(os.path.join(profile_path, 'traffic.json'), 'w') as f:
+                json.dump({
+                    "total_incoming": 0,
+                    "total_outgoing": 0,
+                    "last_incoming": 0,
+                    "last_outgoing": 0
+                }, f)
+        except Exception as e:
+            logger.error(f"Пир {name} добавлен на сервер {server_id}, но конфигурация клиента не сохранена: {e}")
+            results[name] = f"Пир добавлен на сервер, но .conf не сохранен: {e}"
+    return results
+
+def deactive_users_batch(client_names, server_id=None):
+    """Удаляет несколько клиентов одной записью wg0.conf и clientsTable и одним перезапуском интерфейса.
+
+    Возвращает {имя: None при успехе или текст ошибки}.
+    """
+    if server_id is None or not client_names:
+        return {}
+    setting = get_config(server_id=server_id)
+    wg_config_file = setting['wg_config_file']
+    docker_container = setting['docker_container']
+
+    files = _read_peer_files(server_id, wg_config_file)
+    if files is None:
+        return {name: "Не удалось прочитать конфигурацию сервера" for name in client_names}
+    config_content, clients_table = files
+
+    clients = get_client_list(server_id=server_id)
+    if clients is None:
+        return {name: "Не удалось прочитать конфигурацию сервера" for name in client_names}
+    public_keys = {client[0]: client[1] for client in clients}
+    results = {}
+    removed = {}
+    for name in client_names:
+        if name not in public_keys:
+            results[name] = "Пользователь не найден в списке клиентов."
+            continue
+        results[name] = None
+        removed[public_keys[name]] = name
+    if not removed:
+        return results
+
+    error = _write_peer_files(
+        server_id, docker_container, wg_config_file,
+        (config_content, clients_table),
+        (
+            _remove_peer_sections(config_content, set(removed)),
+            [client for client in clients_table if client.get('clientId') not in removed],
+        ),
+    )
+    remote_snapshots.invalidate(server_id)
+    if error:
+        logger.error(f"Пакетное удаление клиентов на сервере {server_id}: {error}")
+        for name in removed.values():
+            results[name] = error
+        return results
+
+    for name in removed.values():
+        try:
+            cleanup_local_profile(name, server_id)
+        except Exception as e:
+            logger.error(f"Пир {name} удален с сервера {server_id}, но локальные файлы не очищены: {e}")
+    return results
+
 def load_expirations():
+    return _expirations_cache.get()
+
+def _read_expirations():
     if not os.path.exists(EXPIRATIONS_FILE):
         return {}
-    with open(EXPIRATIONS_FILE, 'r') as f:
+    with file_lock(EXPIRATIONS_FILE, shared=True), open(EXPIRATIONS_FILE, 'r') as f:
         try:
             data = json.load(f)
             if data and not isinstance(next(iter(data.values())), dict):
@@ -1303,7 +1804,6 @@ def load_expirations():
             return {}
 
 def save_expirations(expirations):
-    os.makedirs(os.path.dirname(EXPIRATIONS_FILE), exist_ok=True)
     data = {}
     for user, servers in expirations.items():
         data[user] = {}
@@ -1314,28 +1814,32 @@ def save_expirations(expirations):
                 'owner_id': info.get('owner_id'),
                 'owner_slug': info.get('owner_slug')
             }
-    with open(EXPIRATIONS_FILE, 'w') as f:
-        json.dump(data, f)
+    with file_lock(EXPIRATIONS_FILE):
+        atomic_write_json(EXPIRATIONS_FILE, data)
+    BUS.publish(os.path.basename(EXPIRATIONS_FILE))
 
 def set_user_expiration(username: str, expiration = None, traffic_limit = "Неограниченно", owner_id = None, server_id = None, owner_slug: str = None):
-    if server_id is None:
+    set_users_expiration([(username, owner_id, owner_slug)], expiration, traffic_limit, server_id)
+
+def set_users_expiration(users, expiration = None, traffic_limit = "Неограниченно", server_id = None):
+    """Одинаковый срок и лимит для нескольких пользователей одной записью файла; users — (имя, owner_id, owner_slug)."""
+    if server_id is None or not users:
         return
-    expirations = load_expirations()
-    if username not in expirations:
-        expirations[username] = {}
-    if server_id not in expirations[username]:
-        expirations[username][server_id] = {}
-    if expiration:
-        if expiration.tzinfo is None:
-            expiration = expiration.replace(tzinfo=UTC)
-        expirations[username][server_id]['expiration_time'] = expiration
-    else:
-        expirations[username][server_id]['expiration_time'] = None
-    expirations[username][server_id]['traffic_limit'] = traffic_limit
-    expirations[username][server_id]['owner_id'] = owner_id
-    if owner_slug:
-        expirations[username][server_id]['owner_slug'] = owner_slug
-    save_expirations(expirations)
+    if expiration and expiration.tzinfo is None:
+        expiration = expiration.replace(tzinfo=UTC)
+    with expirations_transaction():
+        expirations = load_expirations()
+        for username, owner_id, owner_slug in users:
+            if username not in expirations:
+                expirations[username] = {}
+            if server_id not in expirations[username]:
+                expirations[username][server_id] = {}
+            expirations[username][server_id]['expiration_time'] = expiration or None
+            expirations[username][server_id]['traffic_limit'] = traffic_limit
+            expirations[username][server_id]['owner_id'] = owner_id
+            if owner_slug:
+                expirations[username][server_id]['owner_slug'] = owner_slug
+        save_expirations(expirations)
 
 def resolve_owner_slug(client_name, server_id=None):
     expirations = load_expirations()
@@ -1355,14 +1859,22 @@ def resolve_owner_slug(client_name, server_id=None):
     return _default_owner_slug(client_name)
 
 def remove_user_expiration(username: str, server_id: str = None):
+    remove_users_expiration([username], server_id)
+
+def remove_users_expiration(usernames, server_id: str = None):
     if server_id is None:
         return
-    expirations = load_expirations()
-    if username in expirations and server_id in expirations[username]:
-        del expirations[username][server_id]
-        if not expirations[username]:
-            del expirations[username]
-        save_expirations(expirations)
+    with expirations_transaction():
+        expirations = load_expirations()
+        changed = False
+        for username in usernames:
+            if username in expirations and server_id in expirations[username]:
+                del expirations[username][server_id]
+                if not expirations[username]:
+                    del expirations[username]
+                changed = True
+        if changed:
+            save_expirations(expirations)
 
 def get_users_with_expiration(server_id: str = None):
     if server_id is None:
@@ -1391,19 +1903,28 @@ def get_user_traffic_limit(username: str, server_id: str = None):
     expirations = load_expirations()
     return expirations.get(username, {}).get(server_id, {}).get('traffic_limit', "Неограниченно")
 
+def _collapse_blank_lines(content):
+    lines = [line.strip() for line in content.splitlines()]
+    return [line for index, line in enumerate(lines) if line or (index > 0 and lines[index - 1])]
+
 def ensure_peer_names(server_id=None):
     if server_id is None:
         return False
     try:
         clients = get_client_list(server_id=server_id)
+        if clients is None:
+            # Без списка клиентов все имена пиров были бы стёрты
+            return False
         client_map = {client[1]: client[0] for client in clients}
         
         setting = get_config(server_id=server_id)
         wg_config_file = setting['wg_config_file']
         docker_container = setting['docker_container']
         
-        cmd = f"docker exec -i {docker_container} cat {wg_config_file}"
-        config_content = execute_docker_command(cmd, server_id=server_id)
+        files = read_server_files(server_id, wg_config_file)
+        config_content = files and files[wg_config_file]
+        if config_content is None:
+            return False
         
         lines = config_content.splitlines()
         new_config = []
@@ -1418,6 +1939,8 @@ def ensure_peer_names(server_id=None):
                 while i < len(lines):
                     peer_line = lines[i].strip()
                     if peer_line == '':
+                        # Пустая строка-разделитель добавляется ниже один раз
+                        i += 1
                         break
                     if peer_line.startswith('PublicKey ='):
                         public_key = peer_line.split('=', 1)[1].strip()
@@ -1434,27 +1957,15 @@ def ensure_peer_names(server_id=None):
                 i += 1
         
         new_config_content = '\n'.join(new_config)
+        # Без изменений не перезаписываем: иначе wg0.conf менялся бы каждую минуту
+        # и хеш в remote_snapshots никогда бы не совпадал
+        if _collapse_blank_lines(new_config_content) == _collapse_blank_lines(config_content):
+            return True
         
-        if setting.get('is_remote') == 'true':
-            servers = load_servers()
-            server_config = servers.get(server_id, {})
-            
-            if server_id in SSHManager._instances and hasattr(SSHManager._instances[server_id], '_original_password'):
-                ssh = SSHManager._instances[server_id]
-            else:
-                ssh = SSHManager(
-                    server_id=server_id,
-                    host=server_config.get('host'),
-                    port=int(server_config.get('port', 22)),
-                    username=server_config.get('username'),
-                    auth_type=server_config.get('auth_type'),
-                    key_path=server_config.get('key_path'),
-                    password=server_config.get('_original_password')
-                )
-            
-            ssh.execute_command(f'echo \'{new_config_content}\' > /tmp/wg0.conf')
-            ssh.execute_command(f'docker cp /tmp/wg0.conf {docker_container}:{wg_config_file}')
-            ssh.execute_command('rm -f /tmp/wg0.conf')
+        if server_sessions.is_remote(server_id):
+            server_sessions.run(server_id, f'echo \'{new_config_content}\' > /tmp/wg0.conf')
+            server_sessions.run(server_id, f'docker cp /tmp/wg0.conf {docker_container}:{wg_config_file}')
+            server_sessions.run(server_id, 'rm -f /tmp/wg0.conf')
         else:
             with tempfile.NamedTemporaryFile(mode='w', delete=False) as temp_file:
                 temp_file.write(new_config_content)
@@ -1463,6 +1974,7 @@ def ensure_peer_names(server_id=None):
             subprocess.run(['docker', 'cp', temp_path, f"{docker_container}:{wg_config_file}"])
             os.unlink(temp_path)
         
+        remote_snapshots.invalidate(server_id)
         return True
     except Exception as e:
         logger.error(f"Ошибка при обновлении имен пиров: {e}")
@@ -1473,7 +1985,7 @@ def get_clients_by_owner(owner_id: int, server_id: str = None):
         return []
     expirations = load_expirations()
     user_clients = []
-    all_clients = get_client_list(server_id=server_id)
+    all_clients = get_client_list(server_id=server_id) or []
     
     for client_name, servers in expirations.items():
         if server_id in servers and servers[server_id].get('owner_id') == owner_id:
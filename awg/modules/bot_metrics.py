@@ -0,0 +1,130 @@
+import time
+from contextvars import ContextVar
+from typing import Callable
+
+from aiohttp import web
+from aiogram import Bot, types
+from aiogram.dispatcher.handler import current_handler
+from aiogram.dispatcher.middlewares import BaseMiddleware
+
+from modules import metrics
+
+HANDLER_DURATION = metrics.REGISTRY.histogram(
+    'awg_bot_handler_duration_seconds',
+    'Время обработки апдейта по обработчику',
+    ('handler', 'kind', 'role'),
+)
+HANDLER_SSH_CALLS = metrics.REGISTRY.histogram(
+    'awg_bot_handler_ssh_calls',
+    'Число команд на серверах за один апдейт',
+    ('handler', 'kind', 'role'),
+    buckets=metrics.COUNT_BUCKETS,
+)
+HANDLER_TELEGRAM_CALLS = metrics.REGISTRY.histogram(
+    'awg_bot_handler_telegram_calls',
+    'Число вызовов Telegram API за один апдейт',
+    ('handler', 'kind', 'role'),
+    buckets=metrics.COUNT_BUCKETS,
+)
+TELEGRAM_DURATION = metrics.REGISTRY.histogram(
+    'awg_bot_telegram_request_duration_seconds',
+    'Время вызова метода Telegram API',
+    ('method',),
+)
+
+_update_info: ContextVar[dict | None] = ContextVar('awg_update_info', default=None)
+
+
+class MeteredBot(Bot):
+    """Bot, учитывающий каждый вызов Telegram API."""
+
+    async def request(self, method, data=None, files=None, **kwargs):
+        metrics.count_nested_call('telegram')
+        started = time.perf_counter()
+        try:
+            return await super().request(method, data, files, **kwargs)
+        finally:
+            TELEGRAM_DURATION.labels(method).observe(time.perf_counter() - started)
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """Время обработки апдейтов и число вложенных вызовов по обработчикам.
+
+    Обработчик определяется по функции, выбранной диспетчером, поэтому все
+    callback_data с одним префиксом попадают в одну серию.
+    """
+
+    def __init__(self, role_of: Callable[[object], str]):
+        super().__init__()
+        self._role_of = role_of
+
+    async def on_pre_process_update(self, update: types.Update, data: dict):
+        data['_metrics_token'] = metrics.begin_update()
+        data['_metrics_info_token'] = _update_info.set({'handler': 'unhandled', 'kind': 'other', 'role': 'unknown'})
+        data['_metrics_started'] = time.perf_counter()
+
+    def _remember_handler(self, kind: str, event: object) -> None:
+        info = _update_info.get()
+        if info is None:
+            return
+        handler = current_handler.get()
+        info['handler'] = getattr(handler, '__name__', 'unknown')
+        info['kind'] = kind
+        info['role'] = self._role_of(event)
+
+    async def on_process_message(self, message: types.Message, data: dict):
+        self._remember_handler('message', message)
+
+    async def on_process_callback_query(self, callback_query: types.CallbackQuery, data: dict):
+        self._remember_handler('callback_query', callback_query)
+
+    async def on_process_inline_query(self, inline_query: types.InlineQuery, data: dict):
+        self._remember_handler('inline_query', inline_query)
+
+    async def on_post_process_update(self, update: types.Update, results, data: dict):
+        token = data.pop('_metrics_token', None)
+        info_token = data.pop('_metrics_info_token', None)
+        started = data.pop('_metrics_started', None)
+        if token is None or info_token is None or started is None:
+            return
+        calls = metrics.end_update(token)
+        info = _update_info.get() or {}
+        _update_info.reset(info_token)
+        labels = (info.get('handler'), info.get('kind'), info.get('role'))
+        HANDLER_DURATION.labels(*labels).observe(time.perf_counter() - started)
+        HANDLER_SSH_CALLS.labels(*labels).observe(calls.get('ssh', 0))
+        HANDLER_TELEGRAM_CALLS.labels(*labels).observe(calls.get('telegram', 0))
+
+
+def format_handler_stats(limit: int = 15) -> str:
+    """Сводка для /stats: самые затратные по суммарному времени обработчики."""
+    ssh_calls = dict(HANDLER_SSH_CALLS.items())
+    telegram_calls = dict(HANDLER_TELEGRAM_CALLS.items())
+    rows = sorted(HANDLER_DURATION.items(), key=lambda item: item[1].sum, reverse=True)[:limit]
+    if not rows:
+        return "Статистика пока не собрана."
+    lines = ["обработчик (роль)        n   avg   p95  ssh   tg"]
+    for key, histogram in rows:
+        handler, _, role = key
+        ssh = ssh_calls.get(key)
+        telegram = telegram_calls.get(key)
+        lines.append(
+            f"{handler[:20]:<20} {role[:1]} {histogram.count:>5} "
+            f"{histogram.mean * 1000:>5.0f} {histogram.quantile(0.95) * 1000:>5.0f} "
+            f"{ssh.mean if ssh else 0:>4.1f} {telegram.mean if telegram else 0:>4.1f}"
+        )
+    lines.append("время в мс; роль: a — админ, u — пользователь")
+    return "\n".join(lines)
+
+
+async def metrics_handler(request: web.Request) -> web.Response:
+    return web.Response(body=metrics.REGISTRY.render().encode('utf-8'), headers={'Content-Type': metrics.CONTENT_TYPE})
+
+
+async def start_metrics_server(host: str, port: int) -> web.AppRunner:
+    app = web.Application()
+    app.router.add_get('/metrics', metrics_handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
@@ -0,0 +1,134 @@
+import codecs
+import select
+import socket
+import subprocess
+import time
+from dataclasses import dataclass
+from typing import Callable
+
+CHUNK_SIZE = 32768
+LineCallback = Callable[[str], None]
+
+
+@dataclass(frozen=True)
+class CommandResult:
+    stdout: str
+    stderr: str
+    # None — команда не была выполнена (нет соединения, таймаут канала)
+    exit_status: int | None
+
+    @property
+    def ok(self) -> bool:
+        return self.exit_status == 0
+
+    def describe_error(self) -> str:
+        message = self.stderr.strip()
+        if self.exit_status is None:
+            return message or "команда не выполнена"
+        return message or f"код завершения {self.exit_status}"
+
+
+class _LineSplitter:
+    """Накопитель потока: декодирует UTF-8 по частям и отдаёт callback'у целые строки."""
+
+    def __init__(self, callback: LineCallback | None, collect: bool = True):
+        self._callback = callback
+        self._collect = collect
+        self._decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        self._parts: list[str] = []
+        self._pending = ''
+
+    def feed(self, data: bytes, final: bool = False) -> None:
+        text = self._decoder.decode(data, final=final)
+        if not text:
+            return
+        if self._collect:
+            self._parts.append(text)
+        if self._callback is None:
+            return
+        self._pending += text
+        *lines, self._pending = self._pending.split('\n')
+        for line in lines:
+            self._callback(line)
+
+    def close(self) -> str:
+        self.feed(b'', final=True)
+        if self._callback is not None and self._pending:
+            self._callback(self._pending)
+            self._pending = ''
+        return ''.join(self._parts)
+
+
+def drain_channel(
+    channel,
+    timeout: float | None = 30,
+    on_stdout_line: LineCallback | None = None,
+    on_stderr_line: LineCallback | None = None,
+    on_first_byte: Callable[[], None] | None = None,
+    collect: bool = True,
+) -> CommandResult:
+    """Читает stdout и stderr канала paramiko одновременно до его закрытия.
+
+    Оба потока вычитываются по мере поступления, поэтому команда, пишущая
+    много в stderr, не блокируется на заполненном окне канала.
+    timeout=None — ждать без ограничения (долгоживущие команды);
+    collect=False — только передавать строки в callback, не накапливая вывод.
+    """
+    stdout = _LineSplitter(on_stdout_line, collect)
+    stderr = _LineSplitter(on_stderr_line, collect)
+    deadline = time.monotonic() + timeout if timeout is not None else None
+    first_byte_seen = False
+
+    while True:
+        progressed = False
+        if channel.recv_ready():
+            data = channel.recv(CHUNK_SIZE)
+            if data:
+                stdout.feed(data)
+                progressed = True
+        if channel.recv_stderr_ready():
+            data = channel.recv_stderr(CHUNK_SIZE)
+            if data:
+                stderr.feed(data)
+                progressed = True
+        if progressed:
+            if not first_byte_seen:
+                first_byte_seen = True
+                if on_first_byte is not None:
+                    on_first_byte()
+            if deadline is not None:
+                deadline = time.monotonic() + timeout
+            continue
+        if channel.exit_status_ready() and not channel.recv_ready() and not channel.recv_stderr_ready():
+            break
+        if channel.closed:
+            # Канал закрыт с нашей стороны или оборвался: кода завершения не будет
+            return CommandResult(stdout=stdout.close(), stderr=stderr.close(), exit_status=None)
+        wait = 1.0
+        if deadline is not None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                channel.close()
+                raise socket.timeout(f"нет вывода команды в течение {timeout} с")
+            wait = min(remaining, wait)
+        select.select([channel], [], [], wait)
+
+    return CommandResult(stdout=stdout.close(), stderr=stderr.close(), exit_status=channel.recv_exit_status())
+
+
+def run_local(
+    command: str,
+    timeout: float = 30,
+    on_stdout_line: LineCallback | None = None,
+    on_stderr_line: LineCallback | None = None,
+) -> CommandResult:
+    """Локальный аналог drain_channel: communicate() уже читает оба потока одновременно."""
+    try:
+        completed = subprocess.run(command, shell=True, capture_output=True, timeout=timeout)
+    except subprocess.TimeoutExpired as exc:
+        return CommandResult(stdout='', stderr=f"таймаут {exc.timeout} с", exit_status=None)
+    stdout = _LineSplitter(on_stdout_line)
+    stderr = _LineSplitter(on_stderr_line)
+    stdout.feed(completed.stdout)
+    stderr.feed(completed.stderr)
+    return CommandResult(stdout=stdout.close(), stderr=stderr.close(), exit_status=completed.returncode)
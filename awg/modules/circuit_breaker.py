@@ -0,0 +1,133 @@
+import logging
+import os
+import threading
+import time
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+FAILURE_THRESHOLD = int(os.getenv('SSH_BREAKER_FAILURES') or 3)
+RESET_TIMEOUT = float(os.getenv('SSH_BREAKER_RESET_SECONDS') or 30)
+MAX_RESET_TIMEOUT = 300.0
+
+
+class CircuitBreaker:
+    """Состояние доступности одного сервера.
+
+    closed — вызовы идут как обычно; после FAILURE_THRESHOLD ошибок подряд
+    переходит в open и дальше отвечает сохранённой ошибкой без подключения.
+    По истечении reset_timeout пропускает одну пробную попытку (half_open):
+    успех закрывает цепь, неудача открывает её снова с удвоенным таймаутом.
+    """
+
+    def __init__(self, server_id, failure_threshold=FAILURE_THRESHOLD, reset_timeout=RESET_TIMEOUT):
+        self.server_id = server_id
+        self.failure_threshold = failure_threshold
+        self.base_reset_timeout = reset_timeout
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.last_error = None
+        self.opened_at = 0.0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def retry_in(self):
+        if self.state != OPEN:
+            return 0.0
+        return max(0.0, self.opened_at + self.reset_timeout - time.monotonic())
+
+    def allow(self):
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and self.retry_in() <= 0:
+                self.state = HALF_OPEN
+                self._trial_in_flight = False
+            if self.state == HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self.state != CLOSED:
+                logger.info(f"Сервер {self.server_id} снова доступен")
+            self.state = CLOSED
+            self.failures = 0
+            self.last_error = None
+            self.reset_timeout = self.base_reset_timeout
+            self._trial_in_flight = False
+
+    def record_failure(self, error):
+        with self._lock:
+            self.failures += 1
+            self.last_error = str(error)
+            if self.state == HALF_OPEN:
+                self.reset_timeout = min(self.reset_timeout * 2, MAX_RESET_TIMEOUT)
+                self._open()
+            elif self.state == CLOSED and self.failures >= self.failure_threshold:
+                self._open()
+
+    def _open(self):
+        self.state = OPEN
+        self.opened_at = time.monotonic()
+        self._trial_in_flight = False
+        logger.warning(
+            f"Сервер {self.server_id} помечен недоступным на {self.reset_timeout:.0f} с: {self.last_error}"
+        )
+
+    def snapshot(self):
+        return {
+            'server_id': str(self.server_id),
+            'state': self.state,
+            'failures': self.failures,
+            'last_error': self.last_error,
+            'retry_in': round(self.retry_in(), 1),
+        }
+
+
+class BreakerRegistry:
+    def __init__(self):
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    def get(self, server_id):
+        breaker = self._breakers.get(server_id)
+        if breaker is None:
+            with self._lock:
+                breaker = self._breakers.setdefault(server_id, CircuitBreaker(server_id))
+        return breaker
+
+    def is_available(self, server_id):
+        breaker = self._breakers.get(server_id)
+        return breaker is None or breaker.state != OPEN
+
+    def due_for_probe(self):
+        """Серверы в состоянии open, для которых истёк таймаут и пора сделать пробу."""
+        return [
+            server_id for server_id, breaker in list(self._breakers.items())
+            if breaker.state == OPEN and breaker.retry_in() <= 0
+        ]
+
+    def snapshot(self):
+        return [breaker.snapshot() for breaker in list(self._breakers.values())]
+
+    def discard(self, server_id):
+        self._breakers.pop(server_id, None)
+
+
+BREAKERS = BreakerRegistry()
+
+metrics.REGISTRY.gauge(
+    'awg_ssh_circuit_state', 'Состояние цепи сервера: 0 closed, 1 half_open, 2 open', ('server',)
+).add_callback(
+    lambda: {(item['server_id'],): _STATE_VALUES[item['state']] for item in BREAKERS.snapshot()},
+    name='circuit_breakers',
+)
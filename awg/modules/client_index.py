@@ -0,0 +1,106 @@
+import bisect
+import time
+import zlib
+from typing import Any, Callable, Hashable, Iterable
+
+PAGE_SIZE = 20
+DEFAULT_TTL = 60.0
+
+
+def _fold(value: str) -> str:
+    return value.casefold()
+
+
+def encode_cursor(position: int, boundary_key: str) -> str:
+    """Курсор: позиция в индексе и контрольная сумма ключа перед ней (влезает в callback_data)."""
+    return f"{position:x}.{zlib.crc32(boundary_key.encode('utf-8')) & 0xffff:x}"
+
+
+def decode_cursor(cursor: str) -> tuple[int, int] | None:
+    try:
+        position, checksum = cursor.split('.', 1)
+        return int(position, 16), int(checksum, 16)
+    except ValueError:
+        return None
+
+
+class SortedNameIndex:
+    """Отсортированный массив ключей для поиска по префиксу через bisect.
+
+    Одна запись может встречаться под несколькими ключами; поиск
+    возвращает записи в порядке ключей и курсор на следующую страницу.
+    """
+
+    def __init__(self, items: Iterable[tuple[str, Any]] = (), version: Hashable = None):
+        pairs = sorted((_fold(key), position, record) for position, (key, record) in enumerate(items) if key)
+        self._keys = [key for key, _, _ in pairs]
+        self._records = [record for _, _, record in pairs]
+        self.version = version
+        self.built_at = time.monotonic()
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def _resolve_cursor(self, prefix: str, cursor: str | None) -> int:
+        start = bisect.bisect_left(self._keys, prefix)
+        if not cursor:
+            return start
+        decoded = decode_cursor(cursor)
+        if decoded is None:
+            return start
+        position, checksum = decoded
+        if start < position <= len(self._keys):
+            if zlib.crc32(self._keys[position - 1].encode('utf-8')) & 0xffff == checksum:
+                return position
+        # Индекс перестроен после выдачи курсора — начинаем с начала диапазона
+        return start
+
+    def search(self, prefix: str, limit: int = PAGE_SIZE, cursor: str | None = None) -> tuple[list[Any], str | None]:
+        prefix = _fold(prefix)
+        position = self._resolve_cursor(prefix, cursor)
+        end = bisect.bisect_right(self._keys, prefix + '\U0010ffff', lo=position)
+        stop = min(end, position + limit)
+        records = self._records[position:stop]
+        next_cursor = encode_cursor(stop, self._keys[stop - 1]) if stop < end else None
+        return records, next_cursor
+
+    def count(self, prefix: str) -> int:
+        prefix = _fold(prefix)
+        start = bisect.bisect_left(self._keys, prefix)
+        return bisect.bisect_right(self._keys, prefix + '\U0010ffff', lo=start) - start
+
+
+class ServerIndexCache:
+    """Индексы имён по серверам, перестраиваемые не чаще раза в ttl секунд.
+
+    Если задана функция version, индекс перестраивается и раньше — как
+    только меняется дешёвая версия исходных данных (например, mtime файла).
+    """
+
+    def __init__(
+        self,
+        loader: Callable[[str], Iterable[tuple[str, Any]]],
+        ttl: float = DEFAULT_TTL,
+        version: Callable[[str], Hashable] | None = None,
+    ):
+        self._loader = loader
+        self._version = version
+        self.ttl = ttl
+        self._indexes: dict[str, SortedNameIndex] = {}
+
+    def peek(self, server_id: str) -> SortedNameIndex | None:
+        return self._indexes.get(server_id)
+
+    def get(self, server_id: str) -> SortedNameIndex:
+        index = self._indexes.get(server_id)
+        version = self._version(server_id) if self._version else None
+        if index is None or index.version != version or time.monotonic() - index.built_at > self.ttl:
+            index = SortedNameIndex(self._loader(server_id), version=version)
+            self._indexes[server_id] = index
+        return index
+
+    def invalidate(self, server_id: str | None = None) -> None:
+        if server_id is None:
+            self._indexes.clear()
+        else:
+            self._indexes.pop(server_id, None)
@@ -0,0 +1,121 @@
+import logging
+import math
+import os
+import re
+import shlex
+import time
+from collections import deque
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+SLOW_COMMAND_SECONDS = float(os.getenv('SSH_SLOW_COMMAND_SECONDS') or 2.0)
+SLOW_LOG_SIZE = 100
+PHASES = ('connect', 'channel_open', 'first_byte', 'total')
+
+PHASE_DURATION = metrics.REGISTRY.histogram(
+    'awg_ssh_phase_duration_seconds',
+    'Фазы выполнения команды на сервере: подключение, открытие канала, первый байт, всего',
+    ('server', 'kind', 'phase'),
+)
+
+_slow_commands: deque = deque(maxlen=SLOW_LOG_SIZE)
+_OPERATORS = {'|', '||', '&&', ';', '&'}
+_DOCKER_EXEC_RE = re.compile(r'^docker\s+exec\s+(?:-\w+\s+)*(\S+)\s+(.*)$', re.DOTALL)
+
+
+def command_kind(command: str) -> str:
+    """Короткий тип команды для меток: 'docker:wg', 'docker:cat', 'mv' и т.п."""
+    command = command.strip()
+    prefix = ''
+    match = _DOCKER_EXEC_RE.match(command)
+    if match:
+        prefix = 'docker:'
+        command = match.group(2)
+    try:
+        words = shlex.split(command)
+    except ValueError:
+        words = command.split()
+    if words[:1] == ['sudo']:
+        words = words[1:]
+    if len(words) > 2 and words[0] in ('sh', 'bash') and words[1] == '-c':
+        words = words[2].split()
+    return prefix + (os.path.basename(words[0])[:24] if words else 'shell')
+
+
+def redact_command(command: str) -> str:
+    """Команда без аргументов, только программы по операторам: 'echo | docker:wg'.
+
+    В аргументах бывают приватные ключи и PSK (echo '<ключ>' | wg pubkey),
+    а список медленных команд отдаётся в /sshstats и в API диагностики.
+    """
+    try:
+        lexer = shlex.shlex(command, posix=True, punctuation_chars=True)
+        lexer.whitespace_split = True
+        tokens = list(lexer)
+    except ValueError:
+        return command_kind(command)
+    parts: list[str] = []
+    segment: list[str] = []
+    for token in tokens + [';']:
+        if token not in _OPERATORS:
+            segment.append(token)
+            continue
+        if segment:
+            parts.append(command_kind(shlex.join(segment)))
+            parts.append(token)
+            segment = []
+    return ' '.join(parts[:-1]) or 'shell'
+
+
+class CommandTimer:
+    """Замер фаз одной команды; фазы, которых не было (например, connect при живом соединении), не пишутся."""
+
+    __slots__ = ('server_id', 'command', 'kind', 'started', 'phases')
+
+    def __init__(self, server_id: str | None, command: str):
+        self.server_id = str(server_id)
+        self.command = command
+        self.kind = command_kind(command)
+        self.started = time.perf_counter()
+        self.phases: dict[str, float] = {}
+
+    def mark(self, phase: str, since: float | None = None) -> None:
+        self.phases[phase] = time.perf_counter() - (since if since is not None else self.started)
+
+    def finish(self) -> float:
+        total = time.perf_counter() - self.started
+        self.phases['total'] = total
+        for phase, value in self.phases.items():
+            PHASE_DURATION.labels(self.server_id, self.kind, phase).observe(value)
+        if total >= SLOW_COMMAND_SECONDS:
+            phases = ', '.join(f"{phase}={value:.3f}s" for phase, value in self.phases.items())
+            logger.warning(f"Медленная команда на {self.server_id} ({self.kind}): {phases}")
+            _slow_commands.append({
+                'at': time.time(),
+                'server_id': self.server_id,
+                'kind': self.kind,
+                'command': redact_command(self.command),
+                'phases': {phase: round(value, 4) for phase, value in self.phases.items()},
+            })
+        return total
+
+
+def timing_summary() -> list[dict]:
+    """Сводка по (сервер, тип команды): число вызовов, среднее и p95 по каждой фазе."""
+    summary: dict[tuple[str, str], dict] = {}
+    for (server_id, kind, phase), histogram in PHASE_DURATION.items():
+        entry = summary.setdefault((server_id, kind), {'server_id': server_id, 'kind': kind, 'count': 0, 'phases': {}})
+        if phase == 'total':
+            entry['count'] = histogram.count
+        p95 = histogram.quantile(0.95)
+        entry['phases'][phase] = {
+            'mean': round(histogram.mean, 4),
+            'p95': None if math.isinf(p95) else p95,
+        }
+    return sorted(summary.values(), key=lambda item: (item['server_id'], item['kind']))
+
+
+def slow_commands(limit: int = 20) -> list[dict]:
+    return list(_slow_commands)[-limit:][::-1]
@@ -0,0 +1,195 @@
+import copy
+import ctypes
+import ctypes.util
+import logging
+import os
+import select
+import struct
+import threading
+from typing import Any, Callable
+
+from .file_lock import holds_exclusive
+
+logger = logging.getLogger(__name__)
+
+POLL_INTERVAL = 1.0
+
+_IN_MODIFY = 0x00000002
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_DELETE = 0x00000200
+_IN_NONBLOCK = os.O_NONBLOCK
+_EVENT_HEADER = struct.Struct('iIII')
+
+
+class InvalidationBus:
+    """Шина событий «файл изменился» внутри процесса.
+
+    Темы — имена файлов в data/. Подписчики вызываются из потока, который
+    опубликовал событие (наблюдатель или код, сохранивший файл).
+    """
+
+    def __init__(self):
+        self._subscribers: dict[str, list[Callable[[str], None]]] = {}
+        self._generations: dict[str, int] = {}
+        self._lock = threading.Lock()
+        # Кешам можно доверять, только пока наблюдатель следит за каталогом
+        self.watching = False
+
+    def subscribe(self, topic: str, callback: Callable[[str], None]) -> None:
+        with self._lock:
+            self._subscribers.setdefault(topic, []).append(callback)
+
+    def generation(self, topic: str) -> int:
+        return self._generations.get(topic, 0)
+
+    def publish(self, topic: str) -> None:
+        with self._lock:
+            self._generations[topic] = self._generations.get(topic, 0) + 1
+            callbacks = list(self._subscribers.get(topic, ()))
+        for callback in callbacks:
+            try:
+                callback(topic)
+            except Exception as exc:
+                logger.error(f"Ошибка обработчика изменения {topic}: {exc}")
+
+
+class CachedFile:
+    """Разобранное содержимое файла из data/, сбрасываемое событием шины.
+
+    Пока наблюдатель не запущен, кеш не используется и каждый вызов читает
+    файл заново. Внутри монопольной блокировки path файл тоже читается с
+    диска: событие о записи другим процессом могло ещё не дойти.
+    Возвращается копия: вызывающий код изменяет результат перед сохранением.
+    """
+
+    def __init__(self, bus: InvalidationBus, topic: str, loader: Callable[[], Any], path: str | None = None):
+        self._bus = bus
+        self.topic = topic
+        self._loader = loader
+        self.path = path
+        self._value = None
+        self._generation = None
+        self.hits = 0
+        self.misses = 0
+
+    def get(self) -> Any:
+        if not self._bus.watching or (self.path is not None and holds_exclusive(self.path)):
+            return self._loader()
+        generation = self._bus.generation(self.topic)
+        if self._generation == generation:
+            self.hits += 1
+            return copy.deepcopy(self._value)
+        self.misses += 1
+        value = self._loader()
+        # Если файл изменился во время чтения, поколение уже другое и значение не сохранится как свежее
+        self._value, self._generation = value, generation
+        return copy.deepcopy(value)
+
+
+class _Inotify:
+    def __init__(self, directory: str):
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or None, use_errno=True)
+        self.fd = libc.inotify_init1(_IN_NONBLOCK)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1')
+        mask = _IN_CLOSE_WRITE | _IN_MOVED_TO | _IN_CREATE | _IN_DELETE | _IN_MODIFY
+        if libc.inotify_add_watch(self.fd, os.fsencode(directory), mask) < 0:
+            errno = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(errno, 'inotify_add_watch')
+
+    def read_names(self, timeout: float) -> set[str]:
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return set()
+        try:
+            data = os.read(self.fd, 65536)
+        except BlockingIOError:
+            return set()
+        names = set()
+        offset = 0
+        while offset + _EVENT_HEADER.size <= len(data):
+            _, _, _, length = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+            names.add(data[offset:offset + length].rstrip(b'\0').decode(errors='replace'))
+            offset += length
+        return names
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+class DataDirWatcher:
+    """Поток, публикующий в шину изменения выбранных файлов каталога.
+
+    Использует inotify (через libc, без внешних зависимостей), а если он
+    недоступен — сравнивает mtime/размер/inode файлов раз в POLL_INTERVAL.
+    Следит за каталогом, а не за файлами: запись через временный файл и
+    rename заменяет inode.
+    """
+
+    def __init__(self, directory: str, filenames: list[str], bus: InvalidationBus, poll_interval: float = POLL_INTERVAL):
+        self.directory = directory
+        self.filenames = set(filenames)
+        self.bus = bus
+        self.poll_interval = poll_interval
+        self.mode = None
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def start(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='data-watcher', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self.bus.watching = False
+
+    def _run(self) -> None:
+        try:
+            inotify = _Inotify(self.directory)
+        except (OSError, AttributeError) as exc:
+            logger.info(f"inotify недоступен ({exc}), изменения в {self.directory} отслеживаются опросом")
+            self._poll()
+            return
+        self.mode = 'inotify'
+        self._set_watching()
+        try:
+            while not self._stop.is_set():
+                for name in inotify.read_names(self.poll_interval) & self.filenames:
+                    self.bus.publish(name)
+        finally:
+            inotify.close()
+
+    def _poll(self) -> None:
+        self.mode = 'poll'
+        states = {name: self._stat(name) for name in self.filenames}
+        self._set_watching()
+        while not self._stop.wait(self.poll_interval):
+            for name in self.filenames:
+                state = self._stat(name)
+                if state != states[name]:
+                    states[name] = state
+                    self.bus.publish(name)
+
+    def _set_watching(self) -> None:
+        # Всё, что закешировали до запуска наблюдения, могло устареть
+        for name in self.filenames:
+            self.bus.publish(name)
+        self.bus.watching = True
+
+    def _stat(self, name: str):
+        try:
+            stat = os.stat(os.path.join(self.directory, name))
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+
+BUS = InvalidationBus()
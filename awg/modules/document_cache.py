@@ -0,0 +1,61 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+def content_digest(content: bytes) -> str:
+    return hashlib.sha256(content).hexdigest()
+
+
+class DocumentFileIdCache:
+    """Хранит file_id уже загруженных в Telegram .conf файлов.
+
+    Ключ — (сервер, профиль); запись действительна, только пока хеш
+    содержимого файла совпадает с тем, что был отправлен.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._entries: dict[str, dict[str, str]] = self._load()
+
+    def _load(self) -> dict[str, dict[str, str]]:
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, 'r', encoding='utf-8') as file:
+                data = json.load(file)
+        except (OSError, json.JSONDecodeError) as exc:
+            logger.error(f"Не удалось прочитать кеш file_id {self.path}: {exc}")
+            return {}
+        return data if isinstance(data, dict) else {}
+
+    def _save(self) -> None:
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        with open(self.path, 'w', encoding='utf-8') as file:
+            json.dump(self._entries, file)
+
+    @staticmethod
+    def _key(server_id: str, client_name: str) -> str:
+        return f"{server_id}/{client_name}"
+
+    def get(self, server_id: str, client_name: str, digest: str) -> str | None:
+        with self._lock:
+            entry = self._entries.get(self._key(server_id, client_name))
+        if entry and entry.get('hash') == digest:
+            return entry.get('file_id')
+        return None
+
+    def put(self, server_id: str, client_name: str, digest: str, file_id: str) -> None:
+        with self._lock:
+            self._entries[self._key(server_id, client_name)] = {'hash': digest, 'file_id': file_id}
+            self._save()
+
+    def invalidate(self, server_id: str, client_name: str) -> None:
+        with self._lock:
+            if self._entries.pop(self._key(server_id, client_name), None) is not None:
+                self._save()
@@ -0,0 +1,93 @@
+import json
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+_held = threading.local()
+
+
+def _held_locks() -> dict:
+    locks = getattr(_held, 'locks', None)
+    if locks is None:
+        locks = _held.locks = {}
+    return locks
+
+
+def holds_exclusive(path: str) -> bool:
+    entry = _held_locks().get(os.path.abspath(path))
+    return entry is not None and not entry['shared']
+
+
+@contextmanager
+def file_lock(path: str, shared: bool = False):
+    """Рекомендательная блокировка файла между процессами (flock на path + '.lock').
+
+    shared=True — чтение, несколько читателей одновременно; иначе монопольная
+    блокировка для цикла «прочитать — изменить — сохранить». Блокировка
+    повторно входима в пределах потока: вложенный вызов под уже взятой
+    монопольной блокировкой ничего не ждёт. Повышение разделяемой блокировки
+    до монопольной не поддерживается — берите монопольную сразу.
+    Отдельный .lock-файл нужен потому, что сами данные заменяются через rename.
+    """
+    key = os.path.abspath(path)
+    locks = _held_locks()
+    entry = locks.get(key)
+    if entry is not None:
+        if entry['shared'] and not shared:
+            raise RuntimeError(f"Нельзя повысить разделяемую блокировку {path} до монопольной")
+        entry['depth'] += 1
+        try:
+            yield
+        finally:
+            entry['depth'] -= 1
+        return
+
+    os.makedirs(os.path.dirname(key), exist_ok=True)
+    fd = os.open(key + '.lock', os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        locks[key] = {'shared': shared, 'depth': 1}
+        try:
+            yield
+        finally:
+            del locks[key]
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+    finally:
+        os.close(fd)
+
+
+def atomic_write(path: str, text: str, encoding: str = 'utf-8') -> None:
+    """Запись через временный файл в том же каталоге и rename: читатель видит либо старый, либо новый файл целиком."""
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(prefix=f".{os.path.basename(path)}.", suffix='.tmp', dir=directory)
+    try:
+        with os.fdopen(fd, 'w', encoding=encoding) as file:
+            file.write(text)
+            file.flush()
+            os.fsync(file.fileno())
+        # mkstemp создаёт файл с правами 0600; сохраняем права исходного файла
+        try:
+            mode = os.stat(path).st_mode & 0o777
+        except FileNotFoundError:
+            mode = 0o644
+        os.chmod(tmp_path, mode)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
+
+
+def atomic_write_json(path: str, data, **dump_kwargs) -> None:
+    atomic_write(path, json.dumps(data, **dump_kwargs))
@@ -0,0 +1,187 @@
+import bisect
+import csv
+import ipaddress
+import logging
+import os
+import socket
+from array import array
+
+try:
+    import maxminddb
+except ImportError:  # pragma: no cover
+    maxminddb = None
+
+logger = logging.getLogger(__name__)
+
+# Поддерживаемые CSV/TSV форматы:
+# - iptoasn.com: range_start, range_end, AS_number, country_code, AS_description
+# - GeoLite2-ASN-Blocks: network, autonomous_system_number, autonomous_system_organization
+CSV_EXTENSIONS = {'.csv', '.tsv', '.txt'}
+
+
+class _RangeIndex:
+    """Отсортированные непересекающиеся диапазоны адресов с поиском через bisect."""
+
+    def __init__(self, typecode: str | None):
+        self._rows: list[tuple[int, int, int]] = []
+        self.starts = array(typecode) if typecode else []
+        self.ends = array(typecode) if typecode else []
+        self.labels = array('I')
+
+    def add(self, start: int, end: int, label_id: int) -> None:
+        self._rows.append((start, end, label_id))
+
+    def freeze(self) -> None:
+        self._rows.sort()
+        for start, end, label_id in self._rows:
+            self.starts.append(start)
+            self.ends.append(end)
+            self.labels.append(label_id)
+        self._rows = []
+
+    def find(self, value: int) -> int | None:
+        pos = bisect.bisect_right(self.starts, value) - 1
+        if pos < 0 or value > self.ends[pos]:
+            return None
+        return self.labels[pos]
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+
+def _parse_range(first: str, second: str | None) -> tuple[int, int, int] | None:
+    try:
+        if '/' in first:
+            network = ipaddress.ip_network(first.strip(), strict=False)
+            return network.version, int(network.network_address), int(network.broadcast_address)
+        start = ipaddress.ip_address(first.strip())
+        end = ipaddress.ip_address((second or first).strip())
+    except ValueError:
+        return None
+    if start.version != end.version:
+        return None
+    return start.version, int(start), int(end)
+
+
+class CsvAsnDatabase:
+    def __init__(self, path: str):
+        self.path = path
+        self._labels: list[dict[str, str]] = []
+        self._label_ids: dict[tuple, int] = {}
+        self._v4 = _RangeIndex('L')
+        self._v6 = _RangeIndex(None)
+        self._load()
+
+    def _label_id(self, record: dict[str, str]) -> int:
+        key = tuple(sorted(record.items()))
+        label_id = self._label_ids.get(key)
+        if label_id is None:
+            label_id = len(self._labels)
+            self._labels.append(record)
+            self._label_ids[key] = label_id
+        return label_id
+
+    def _load(self) -> None:
+        with open(self.path, 'r', encoding='utf-8', errors='replace', newline='') as file:
+            sample = file.readline()
+            delimiter = '\t' if '\t' in sample else ','
+            file.seek(0)
+            for row in csv.reader(file, delimiter=delimiter):
+                if not row or row[0].startswith('#'):
+                    continue
+                if '/' in row[0]:
+                    parsed = _parse_range(row[0], None)
+                    asn = row[1] if len(row) > 1 else ''
+                    country = ''
+                    org = row[2] if len(row) > 2 else ''
+                else:
+                    parsed = _parse_range(row[0], row[1] if len(row) > 1 else None)
+                    asn = row[2] if len(row) > 2 else ''
+                    country = row[3] if len(row) > 3 else ''
+                    org = row[4] if len(row) > 4 else ''
+                if not parsed:
+                    continue
+                asn = asn.strip()
+                if not asn or asn == '0':
+                    continue
+                version, start, end = parsed
+                record = {'isp': org.strip() or f"AS{asn}", 'as': f"AS{asn} {org.strip()}".strip()}
+                if country.strip() and country.strip() not in {'None', 'ZZ'}:
+                    record['countryCode'] = country.strip()
+                index = self._v4 if version == 4 else self._v6
+                index.add(start, end, self._label_id(record))
+        self._v4.freeze()
+        self._v6.freeze()
+        self._label_ids = {}
+
+    def lookup(self, ip: str) -> dict[str, str] | None:
+        try:
+            if ':' in ip:
+                index, value = self._v6, int.from_bytes(socket.inet_pton(socket.AF_INET6, ip), 'big')
+            else:
+                index, value = self._v4, int.from_bytes(socket.inet_pton(socket.AF_INET, ip), 'big')
+        except (OSError, TypeError):
+            return None
+        label_id = index.find(value)
+        if label_id is None:
+            return None
+        return dict(self._labels[label_id])
+
+    def __len__(self) -> int:
+        return len(self._v4) + len(self._v6)
+
+
+class MmdbAsnDatabase:
+    def __init__(self, path: str):
+        if maxminddb is None:
+            raise RuntimeError("Пакет maxminddb не установлен, mmdb база недоступна.")
+        self.path = path
+        self._reader = maxminddb.open_database(path, maxminddb.MODE_MMAP)
+
+    def lookup(self, ip: str) -> dict[str, str] | None:
+        try:
+            record = self._reader.get(ip)
+        except ValueError:
+            return None
+        if not isinstance(record, dict):
+            return None
+        asn = record.get('autonomous_system_number')
+        org = record.get('autonomous_system_organization') or record.get('organization')
+        isp = record.get('isp') or org
+        if not isp and not asn:
+            return None
+        result = {'isp': isp or f"AS{asn}"}
+        if org:
+            result['org'] = org
+        if asn:
+            result['as'] = f"AS{asn} {org or ''}".strip()
+        country = record.get('country')
+        if isinstance(country, dict) and country.get('iso_code'):
+            result['countryCode'] = country['iso_code']
+        return result
+
+    def close(self) -> None:
+        self._reader.close()
+
+
+def open_asn_database(path: str):
+    """Открывает локальную базу ASN/ISP по расширению файла; None, если открыть не удалось."""
+    if not path:
+        return None
+    if not os.path.isfile(path):
+        logger.error(f"Файл GeoIP базы не найден: {path}")
+        return None
+    extension = os.path.splitext(path)[1].lower()
+    try:
+        if extension == '.mmdb':
+            database = MmdbAsnDatabase(path)
+        elif extension in CSV_EXTENSIONS:
+            database = CsvAsnDatabase(path)
+            logger.info(f"Загружено {len(database)} диапазонов ASN из {path}")
+        else:
+            logger.error(f"Неизвестный формат GeoIP базы: {path}")
+            return None
+    except Exception as exc:
+        logger.error(f"Не удалось загрузить GeoIP базу {path}: {exc}")
+        return None
+    return database
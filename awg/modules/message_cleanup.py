@@ -0,0 +1,121 @@
+import asyncio
+import heapq
+import json
+import logging
+import os
+import time
+from typing import Any, Awaitable, Callable
+
+from aiogram.utils.exceptions import RetryAfter
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 20
+FLUSH_INTERVAL = 5.0
+# Telegram позволяет удалять сообщения бота только в течение 48 часов
+MAX_MESSAGE_AGE = 48 * 3600
+
+
+class DelayedMessageDeleter:
+    """Одна фоновая задача на все отложенные удаления сообщений.
+
+    Сроки хранятся в куче (due, chat_id, message_id); очередь периодически
+    сохраняется на диск и восстанавливается после перезапуска.
+    """
+
+    def __init__(self, delete: Callable[[int, int], Awaitable[Any]], path: str):
+        self._delete = delete
+        self.path = path
+        self._heap: list[tuple[float, int, int]] = []
+        self._wakeup = asyncio.Event()
+        self._runner: asyncio.Task | None = None
+        self._dirty = False
+        self._last_flush = 0.0
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._heap)
+
+    def schedule(self, chat_id: int, message_id: int, delay: float) -> None:
+        due = time.time() + delay
+        earliest = self._heap[0][0] if self._heap else None
+        heapq.heappush(self._heap, (due, chat_id, message_id))
+        self._dirty = True
+        if earliest is None or due < earliest:
+            self._wakeup.set()
+
+    def load(self) -> None:
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as file:
+                entries = json.load(file)
+        except (OSError, json.JSONDecodeError) as exc:
+            logger.error(f"Не удалось прочитать очередь удаления сообщений: {exc}")
+            return
+        now = time.time()
+        for due, chat_id, message_id in entries:
+            if now - due < MAX_MESSAGE_AGE:
+                self._heap.append((float(due), int(chat_id), int(message_id)))
+        heapq.heapify(self._heap)
+        logger.info(f"Восстановлено {len(self._heap)} отложенных удалений сообщений")
+
+    def flush(self) -> None:
+        if not self._dirty:
+            return
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as file:
+            json.dump(self._heap, file)
+        os.replace(tmp_path, self.path)
+        self._dirty = False
+        self._last_flush = time.monotonic()
+
+    def start(self) -> None:
+        if self._runner is None or self._runner.done():
+            self._runner = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._runner:
+            self._runner.cancel()
+            try:
+                await self._runner
+            except asyncio.CancelledError:
+                pass
+            self._runner = None
+        self.flush()
+
+    async def _run(self) -> None:
+        while True:
+            now = time.time()
+            due_batch = []
+            while self._heap and self._heap[0][0] <= now and len(due_batch) < BATCH_SIZE:
+                due_batch.append(heapq.heappop(self._heap))
+            if due_batch:
+                self._dirty = True
+                await asyncio.gather(*(self._delete_one(*entry) for entry in due_batch))
+                continue
+
+            if self._dirty and time.monotonic() - self._last_flush >= FLUSH_INTERVAL:
+                try:
+                    self.flush()
+                except OSError as exc:
+                    logger.error(f"Не удалось сохранить очередь удаления сообщений: {exc}")
+
+            timeout = FLUSH_INTERVAL
+            if self._heap:
+                timeout = min(timeout, max(0.0, self._heap[0][0] - now))
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _delete_one(self, due: float, chat_id: int, message_id: int) -> None:
+        try:
+            await self._delete(chat_id, message_id)
+        except RetryAfter as exc:
+            heapq.heappush(self._heap, (time.time() + exc.timeout, chat_id, message_id))
+        except Exception:
+            # Сообщение уже удалено пользователем или недоступно — это нормально
+            pass
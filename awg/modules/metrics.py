@@ -0,0 +1,204 @@
+import bisect
+import math
+from contextvars import ContextVar, Token
+from typing import Callable, Iterable
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50)
+
+
+class Counter:
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.value += amount
+
+
+class Gauge:
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+
+class Histogram:
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    @property
+    def mean(self) -> float:
+        return self.sum / self.count if self.count else 0.0
+
+    def quantile(self, q: float) -> float:
+        """Оценка квантиля сверху — граница бакета, в который он попадает."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for index, bucket_count in enumerate(self.counts):
+            seen += bucket_count
+            if seen >= rank:
+                return self.buckets[index] if index < len(self.buckets) else math.inf
+        return math.inf
+
+
+class MetricFamily:
+    """Метрика с набором меток; дочерние значения создаются при первом обращении.
+
+    Обновления не берут блокировок: в CPython dict.setdefault и инкремент
+    поля под GIL дают в худшем случае потерю единичного наблюдения при гонке,
+    что для статистики допустимо.
+    """
+
+    def __init__(self, name: str, documentation: str, kind: str, labelnames: tuple[str, ...], factory: Callable):
+        self.name = name
+        self.documentation = documentation
+        self.kind = kind
+        self.labelnames = labelnames
+        self._factory = factory
+        self._children: dict[tuple[str, ...], object] = {}
+        self._callbacks: dict[object, Callable[[], dict[tuple, float] | float]] = {}
+
+    def labels(self, *values: object):
+        key = tuple(str(value) for value in values)
+        child = self._children.get(key)
+        if child is None:
+            child = self._children.setdefault(key, self._factory())
+        return child
+
+    def add_callback(self, callback: Callable[[], dict[tuple, float] | float], name: str | None = None) -> None:
+        """Значения, вычисляемые только в момент выгрузки метрик.
+
+        Повторная регистрация с тем же name заменяет прежнюю: модуль, загруженный
+        второй раз (бот и встроенный API), не должен удваивать ряды.
+        """
+        self._callbacks[name if name is not None else id(callback)] = callback
+
+    def items(self) -> list[tuple[tuple[str, ...], object]]:
+        items = list(self._children.items())
+        seen = set(self._children)
+        for callback in list(self._callbacks.values()):
+            try:
+                values = callback()
+            except Exception:
+                continue
+            if not isinstance(values, dict):
+                values = {(): values}
+            for key, value in values.items():
+                key = tuple(str(part) for part in key)
+                # Prometheus отвергает выгрузку с повторяющимися рядами
+                if key in seen:
+                    continue
+                seen.add(key)
+                gauge = Gauge()
+                gauge.set(value)
+                items.append((key, gauge))
+        return items
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._families: dict[str, MetricFamily] = {}
+
+    def _register(self, name: str, documentation: str, kind: str, labelnames: Iterable[str], factory: Callable) -> MetricFamily:
+        family = self._families.get(name)
+        if family is None:
+            family = self._families.setdefault(
+                name, MetricFamily(name, documentation, kind, tuple(labelnames), factory)
+            )
+        return family
+
+    def counter(self, name: str, documentation: str, labelnames: Iterable[str] = ()) -> MetricFamily:
+        return self._register(name, documentation, 'counter', labelnames, Counter)
+
+    def gauge(self, name: str, documentation: str, labelnames: Iterable[str] = ()) -> MetricFamily:
+        return self._register(name, documentation, 'gauge', labelnames, Gauge)
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Iterable[str] = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ) -> MetricFamily:
+        return self._register(name, documentation, 'histogram', labelnames, lambda: Histogram(buckets))
+
+    def get(self, name: str) -> MetricFamily | None:
+        return self._families.get(name)
+
+    def render(self) -> str:
+        """Текстовый формат Prometheus (version 0.0.4)."""
+        lines = []
+        for family in list(self._families.values()):
+            lines.append(f"# HELP {family.name} {family.documentation}")
+            lines.append(f"# TYPE {family.name} {family.kind}")
+            for key, child in family.items():
+                labels = list(zip(family.labelnames, key))
+                if isinstance(child, Histogram):
+                    cumulative = 0
+                    for bound, bucket_count in zip(child.buckets + (math.inf,), child.counts):
+                        cumulative += bucket_count
+                        le = '+Inf' if bound == math.inf else _format_value(bound)
+                        lines.append(f"{family.name}_bucket{_format_labels(labels + [('le', le)])} {cumulative}")
+                    lines.append(f"{family.name}_sum{_format_labels(labels)} {_format_value(child.sum)}")
+                    lines.append(f"{family.name}_count{_format_labels(labels)} {child.count}")
+                else:
+                    lines.append(f"{family.name}{_format_labels(labels)} {_format_value(child.value)}")
+        return '\n'.join(lines) + '\n'
+
+
+def _escape_label(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels: list[tuple[str, str]]) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape_label(value)}"' for name, value in labels) + '}'
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+REGISTRY = MetricsRegistry()
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Счётчики вложенных вызовов (SSH, Telegram API) в рамках обработки одного апдейта
+_update_calls: ContextVar[dict[str, int] | None] = ContextVar('awg_update_calls', default=None)
+
+
+def begin_update() -> Token:
+    return _update_calls.set({})
+
+
+def end_update(token: Token) -> dict[str, int]:
+    calls = _update_calls.get() or {}
+    _update_calls.reset(token)
+    return calls
+
+
+def count_nested_call(kind: str) -> None:
+    calls = _update_calls.get()
+    if calls is not None:
+        calls[kind] = calls.get(kind, 0) + 1
@@ -0,0 +1,252 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable
+
+from aiogram.utils.exceptions import NetworkError
+from aiogram.utils.exceptions import RetryAfter
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 5
+PRIORITY_LOW = 10
+
+# Лимиты Bot API: ~30 сообщений в секунду суммарно и ~1 в секунду на чат
+GLOBAL_RATE = 30.0
+PER_CHAT_RATE = 1.0
+MAX_MESSAGE_LENGTH = 4096
+MAX_ATTEMPTS = 5
+MAX_IN_FLIGHT = 8
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float | None = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now: float) -> float:
+        self._refill(now)
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def consume(self, now: float) -> None:
+        self._refill(now)
+        self.tokens -= 1
+
+    def block(self, until: float) -> None:
+        self.blocked_until = max(self.blocked_until, until)
+
+    def idle(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.capacity and now >= self.blocked_until
+
+
+@dataclass
+class OutboundMessage:
+    chat_id: int
+    text: str
+    priority: int
+    seq: int
+    options: dict[str, Any]
+    coalesce: bool = False
+    on_sent: list[Callable[[Any], Any]] = field(default_factory=list)
+    attempts: int = 0
+    merged: bool = False
+
+
+class OutboundDispatcher:
+    """Очередь исходящих сообщений с лимитами Telegram.
+
+    Сообщения отправляются в порядке приоритета с учётом глобального и
+    поканального token bucket. RetryAfter возвращает сообщение в очередь
+    на указанное Telegram время, а уведомления с coalesce=True для одного
+    чата склеиваются в одно сводное сообщение.
+    """
+
+    def __init__(
+        self,
+        send: Callable[..., Awaitable[Any]],
+        global_rate: float = GLOBAL_RATE,
+        per_chat_rate: float = PER_CHAT_RATE,
+        max_attempts: int = MAX_ATTEMPTS,
+    ):
+        self._send = send
+        self._global = TokenBucket(global_rate)
+        self._per_chat_rate = per_chat_rate
+        self._chats: dict[int, TokenBucket] = {}
+        self._max_attempts = max_attempts
+        self._ready: list[tuple[int, int, OutboundMessage]] = []
+        self._delayed: list[tuple[float, int, OutboundMessage]] = []
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._in_flight = asyncio.Semaphore(MAX_IN_FLIGHT)
+        self._tasks: set[asyncio.Task] = set()
+        self._runner: asyncio.Task | None = None
+
+    @property
+    def queue_depth(self) -> int:
+        return sum(1 for *_, item in self._ready + self._delayed if not item.merged)
+
+    def start(self) -> None:
+        if self._runner is None or self._runner.done():
+            self._runner = asyncio.create_task(self._run())
+
+    async def stop(self, timeout: float = 5.0) -> None:
+        deadline = time.monotonic() + timeout
+        while self.queue_depth and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+        if self._runner:
+            self._runner.cancel()
+            try:
+                await self._runner
+            except asyncio.CancelledError:
+                pass
+            self._runner = None
+        if self._tasks:
+            await asyncio.wait(self._tasks, timeout=max(0.1, deadline - time.monotonic()))
+
+    def enqueue(
+        self,
+        chat_id: int,
+        text: str,
+        *,
+        priority: int = PRIORITY_NORMAL,
+        coalesce: bool = False,
+        on_sent: Callable[[Any], Any] | None = None,
+        **options: Any,
+    ) -> None:
+        item = OutboundMessage(
+            chat_id=chat_id,
+            text=text,
+            priority=priority,
+            seq=next(self._seq),
+            options=options,
+            coalesce=coalesce,
+            on_sent=[on_sent] if on_sent else [],
+        )
+        heapq.heappush(self._ready, (item.priority, item.seq, item))
+        self._wakeup.set()
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) > 1024:
+                now = time.monotonic()
+                self._chats = {key: value for key, value in self._chats.items() if not value.idle(now)}
+            bucket = self._chats[chat_id] = TokenBucket(self._per_chat_rate)
+        return bucket
+
+    def _defer(self, item: OutboundMessage, ready_at: float) -> None:
+        heapq.heappush(self._delayed, (ready_at, item.seq, item))
+
+    def _promote_delayed(self, now: float) -> None:
+        while self._delayed and self._delayed[0][0] <= now:
+            _, _, item = heapq.heappop(self._delayed)
+            heapq.heappush(self._ready, (item.priority, item.seq, item))
+
+    def _coalesce(self, head: OutboundMessage) -> None:
+        # Присоединяем к head остальные ожидающие уведомления того же чата
+        parts = [head.text]
+        length = len(head.text)
+        for *_, other in sorted(self._ready + self._delayed, key=lambda entry: entry[2].seq):
+            if (
+                other is head
+                or other.merged
+                or not other.coalesce
+                or other.chat_id != head.chat_id
+                or other.options != head.options
+            ):
+                continue
+            if length + len(other.text) + 2 > MAX_MESSAGE_LENGTH:
+                break
+            parts.append(other.text)
+            length += len(other.text) + 2
+            other.merged = True
+            head.on_sent.extend(other.on_sent)
+            head.priority = min(head.priority, other.priority)
+        if len(parts) > 1:
+            head.text = "\n\n".join(parts)
+
+    async def _run(self) -> None:
+        while True:
+            now = time.monotonic()
+            self._promote_delayed(now)
+            if not self._ready:
+                timeout = self._delayed[0][0] - now if self._delayed else None
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            _, _, item = heapq.heappop(self._ready)
+            if item.merged:
+                continue
+            chat_wait = self._chat_bucket(item.chat_id).wait_time(now)
+            if chat_wait > 0:
+                self._defer(item, now + chat_wait)
+                continue
+            global_wait = self._global.wait_time(now)
+            if global_wait > 0:
+                heapq.heappush(self._ready, (item.priority, item.seq, item))
+                await asyncio.sleep(global_wait)
+                continue
+
+            if item.coalesce:
+                self._coalesce(item)
+            self._global.consume(now)
+            self._chat_bucket(item.chat_id).consume(now)
+            await self._in_flight.acquire()
+            task = asyncio.create_task(self._deliver(item))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _deliver(self, item: OutboundMessage) -> None:
+        try:
+            item.attempts += 1
+            try:
+                message = await self._send(item.chat_id, item.text, **item.options)
+            except RetryAfter as exc:
+                retry_at = time.monotonic() + exc.timeout
+                self._chat_bucket(item.chat_id).block(retry_at)
+                logger.warning(f"Flood control для чата {item.chat_id}, повтор через {exc.timeout} с")
+                self._requeue(item, retry_at)
+                return
+            except NetworkError as exc:
+                logger.warning(f"Сетевая ошибка при отправке в чат {item.chat_id}: {exc}")
+                self._requeue(item, time.monotonic() + 2 ** item.attempts)
+                return
+            except Exception as exc:
+                logger.error(f"Не удалось отправить сообщение в чат {item.chat_id}: {exc}")
+                return
+            for callback in item.on_sent:
+                try:
+                    result = callback(message)
+                    if asyncio.iscoroutine(result):
+                        await result
+                except Exception as exc:
+                    logger.error(f"Ошибка в обработчике отправленного сообщения: {exc}")
+        finally:
+            self._in_flight.release()
+
+    def _requeue(self, item: OutboundMessage, ready_at: float) -> None:
+        if item.attempts >= self._max_attempts:
+            logger.error(f"Сообщение для чата {item.chat_id} отброшено после {item.attempts} попыток")
+            return
+        self._defer(item, ready_at)
+        self._wakeup.set()
@@ -0,0 +1,100 @@
+import shlex
+import threading
+import time
+from typing import Callable
+
+from . import metrics
+
+# Сколько секунд проверенный отпечаток считается актуальным без повторной проверки:
+# несколько функций подряд читают одни и те же файлы в рамках одного действия
+FRESH_SECONDS = 5.0
+
+CACHE_REQUESTS = metrics.REGISTRY.counter('awg_cache_requests_total', 'Обращения к кешам', ('cache', 'result'))
+
+
+def fingerprint_command(docker_container: str, paths: list[str]) -> str:
+    quoted = ' '.join(shlex.quote(path) for path in paths)
+    return f"docker exec -i {docker_container} sha256sum {quoted}"
+
+
+def parse_fingerprints(output: str) -> dict[str, str]:
+    fingerprints = {}
+    for line in output.splitlines():
+        digest, _, path = line.strip().partition('  ')
+        if digest and path:
+            fingerprints[path] = digest
+    return fingerprints
+
+
+class RemoteSnapshotCache:
+    """Копии конфигурационных файлов серверов, проверяемые по sha256.
+
+    Вместо полного содержимого wg0.conf и clientsTable на каждом опросе
+    передаются только их хеши одной командой; файл скачивается заново,
+    лишь когда хеш изменился.
+    """
+
+    def __init__(self, fresh_seconds: float = FRESH_SECONDS):
+        self.fresh_seconds = fresh_seconds
+        # server_id -> особый срок актуальности или None; например, более
+        # долгий, пока за файлами сервера следит канал наблюдения
+        self.fresh_window: Callable[[str], float | None] | None = None
+        # (server_id, path) -> (sha256, содержимое, время проверки)
+        self._entries: dict[tuple[str, str], tuple[str, str, float]] = {}
+        self._lock = threading.Lock()
+
+    def read(
+        self,
+        server_id: str,
+        docker_container: str,
+        paths: list[str],
+        run: Callable[[str], object],
+    ) -> dict[str, str | None] | None:
+        """Содержимое файлов по путям; None для отсутствующего файла, None целиком при ошибке."""
+        now = time.monotonic()
+        fresh_seconds = self._fresh_seconds(server_id)
+        cached = {path: self._entries.get((server_id, path)) for path in paths}
+        if all(entry is not None and now - entry[2] < fresh_seconds for entry in cached.values()):
+            CACHE_REQUESTS.labels('remote_snapshot', 'hit').inc(len(paths))
+            return {path: entry[1] for path, entry in cached.items()}
+
+        result = run(fingerprint_command(docker_container, paths))
+        # sha256sum завершается с кодом 1, если части файлов нет, но хеши остальных печатает
+        if result.exit_status is None:
+            return None
+        fingerprints = parse_fingerprints(result.stdout)
+
+        contents: dict[str, str | None] = {}
+        for path in paths:
+            digest = fingerprints.get(path)
+            entry = cached[path]
+            if digest is None:
+                contents[path] = None
+                with self._lock:
+                    self._entries.pop((server_id, path), None)
+                continue
+            if entry is not None and entry[0] == digest:
+                CACHE_REQUESTS.labels('remote_snapshot', 'hit').inc()
+                contents[path] = entry[1]
+                with self._lock:
+                    self._entries[(server_id, path)] = (digest, entry[1], now)
+                continue
+            CACHE_REQUESTS.labels('remote_snapshot', 'miss').inc()
+            fetched = run(f"docker exec -i {docker_container} cat {shlex.quote(path)}")
+            if not fetched.ok:
+                return None
+            contents[path] = fetched.stdout
+            with self._lock:
+                self._entries[(server_id, path)] = (digest, fetched.stdout, now)
+        return contents
+
+    def _fresh_seconds(self, server_id: str) -> float:
+        window = self.fresh_window(server_id) if self.fresh_window is not None else None
+        return self.fresh_seconds if window is None else window
+
+    def invalidate(self, server_id: str, path: str | None = None) -> None:
+        """Следующее чтение сверит хеш с сервером; неизменившийся файл не скачивается повторно."""
+        with self._lock:
+            for key, (digest, content, _) in list(self._entries.items()):
+                if key[0] == server_id and (path is None or key[1] == path):
+                    self._entries[key] = (digest, content, float('-inf'))
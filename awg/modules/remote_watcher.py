@@ -0,0 +1,149 @@
+import logging
+import posixpath
+import shlex
+import threading
+import time
+from typing import Callable
+
+from .channel_reader import drain_channel
+from .ssh_keeper import backoff_delay
+
+logger = logging.getLogger(__name__)
+
+POLL_INTERVAL = 5
+SUPERVISE_INTERVAL = 10.0
+CHANGED_MARKER = 'changed'
+
+
+def watch_command(docker_container: str, paths: list[str], poll_interval: int = POLL_INTERVAL) -> str:
+    """Команда наблюдения за файлами внутри контейнера.
+
+    При наличии inotifywait печатает путь каждого изменённого файла в каталогах
+    наблюдения (docker cp заменяет файл целиком, поэтому следим за каталогами).
+    Иначе раз в poll_interval сравнивает sha256 и печатает 'changed'.
+    Первая строка — выбранный режим. Наблюдатель работает в фоне и завершается,
+    когда закрывается stdin, то есть вместе с SSH-каналом: иначе docker exec
+    оставил бы процесс в контейнере после разрыва.
+    """
+    quoted_paths = ' '.join(shlex.quote(path) for path in paths)
+    quoted_dirs = ' '.join(shlex.quote(path) for path in sorted({posixpath.dirname(path) for path in paths}))
+    script = (
+        "( if command -v inotifywait >/dev/null 2>&1; then "
+        "echo inotify; "
+        f"exec inotifywait -m -q -e close_write,moved_to,create,delete --format '%w/%f' {quoted_dirs}; "
+        "else "
+        "echo poll; prev=; "
+        f"while :; do cur=$(sha256sum {quoted_paths} 2>/dev/null); "
+        f"if [ \"$cur\" != \"$prev\" ]; then [ -n \"$prev\" ] && echo {CHANGED_MARKER}; prev=$cur; fi; "
+        f"sleep {int(poll_interval)}; done; "
+        "fi ) & pid=$!; cat >/dev/null; kill $pid 2>/dev/null"
+    )
+    return f"docker exec -i {docker_container} sh -c {shlex.quote(script)}"
+
+
+class RemoteChangeWatcher:
+    """Держит по одному долгоживущему каналу наблюдения на сервер.
+
+    Каждый канал обслуживает свой поток. Поток-супервизор раз в
+    SUPERVISE_INTERVAL сверяет список серверов: запускает наблюдение для новых,
+    перезапускает оборвавшиеся с экспоненциальной паузой и останавливает
+    наблюдение за удалёнными. on_change(server_id, path) вызывается из потока
+    наблюдения; path=None означает «изменилось что-то из файлов».
+    """
+
+    def __init__(
+        self,
+        list_targets: Callable[[], dict[str, tuple[str, list[str]]]],
+        open_channel: Callable[[str, str], object | None],
+        on_change: Callable[[str, str | None], None],
+        poll_interval: int = POLL_INTERVAL,
+    ):
+        self._list_targets = list_targets
+        self._open_channel = open_channel
+        self._on_change = on_change
+        self.poll_interval = poll_interval
+        self._stop = threading.Event()
+        self._supervisor: threading.Thread | None = None
+        self._channels: dict[str, object] = {}
+        self._threads: dict[str, threading.Thread] = {}
+        self._attempts: dict[str, int] = {}
+        self._next_attempt: dict[str, float] = {}
+        self.modes: dict[str, str] = {}
+
+    def start(self) -> None:
+        if self._supervisor is not None and self._supervisor.is_alive():
+            return
+        self._stop.clear()
+        self._supervisor = threading.Thread(target=self._supervise, name='remote-watcher', daemon=True)
+        self._supervisor.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        for channel in list(self._channels.values()):
+            try:
+                channel.close()
+            except Exception:
+                pass
+
+    def _supervise(self) -> None:
+        while not self._stop.is_set():
+            try:
+                targets = self._list_targets()
+            except Exception as exc:
+                logger.error(f"Не удалось получить список серверов для наблюдения: {exc}")
+                targets = {}
+            now = time.monotonic()
+            for server_id, (docker_container, paths) in targets.items():
+                thread = self._threads.get(server_id)
+                if thread is not None and thread.is_alive():
+                    continue
+                if self._next_attempt.get(server_id, 0.0) > now:
+                    continue
+                thread = threading.Thread(
+                    target=self._watch,
+                    args=(server_id, docker_container, paths),
+                    name=f'remote-watcher-{server_id}',
+                    daemon=True,
+                )
+                self._threads[server_id] = thread
+                thread.start()
+            for server_id in set(self._channels) - set(targets):
+                channel = self._channels.pop(server_id, None)
+                if channel is not None:
+                    channel.close()
+            self._stop.wait(SUPERVISE_INTERVAL)
+
+    def _watch(self, server_id: str, docker_container: str, paths: list[str]) -> None:
+        watched = set(paths)
+
+        def handle_line(line: str) -> None:
+            line = line.strip()
+            if line in ('inotify', 'poll'):
+                self.modes[server_id] = line
+                logger.info(f"Наблюдение за файлами сервера {server_id}: {line}")
+                # Пока наблюдение не работало, файлы могли измениться
+                self._on_change(server_id, None)
+            elif line == CHANGED_MARKER:
+                self._on_change(server_id, None)
+            elif posixpath.normpath(line) in watched:
+                self._on_change(server_id, posixpath.normpath(line))
+
+        started = time.monotonic()
+        try:
+            channel = self._open_channel(server_id, watch_command(docker_container, paths, self.poll_interval))
+            if channel is None:
+                raise ConnectionError("нет соединения")
+            self._channels[server_id] = channel
+            drain_channel(channel, timeout=None, on_stdout_line=handle_line, collect=False)
+        except Exception as exc:
+            logger.warning(f"Наблюдение за файлами сервера {server_id} прервано: {exc}")
+        finally:
+            self._channels.pop(server_id, None)
+            self.modes.pop(server_id, None)
+
+        if self._stop.is_set():
+            return
+        # Канал, проживший дольше минуты, считаем успешным и начинаем паузы заново
+        attempt = 1 if time.monotonic() - started > 60 else self._attempts.get(server_id, 0) + 1
+        self._attempts[server_id] = attempt
+        self._next_attempt[server_id] = time.monotonic() + backoff_delay(attempt)
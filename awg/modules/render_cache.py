@@ -0,0 +1,73 @@
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from typing import Any, Hashable
+
+MAX_ENTRIES = 4096
+
+
+def render_digest(text: str, reply_markup: Any = None, parse_mode: str | None = None) -> str:
+    markup = reply_markup.to_python() if hasattr(reply_markup, 'to_python') else reply_markup
+    payload = json.dumps([text, markup, parse_mode], ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+class _BoundedDict:
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._data: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Any:
+        with self._lock:
+            value = self._data.get(key)
+            if value is not None:
+                self._data.move_to_end(key)
+            return value
+
+    def put(self, key: Hashable, value: Any) -> None:
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key: Hashable) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+
+class RenderCache:
+    """Хеш последнего текста и клавиатуры, отправленных в главное сообщение чата.
+
+    Запись считается актуальной, только пока edit_date сообщения совпадает
+    с датой нашего последнего редактирования: если сообщение успели изменить
+    другие обработчики, кеш не используется.
+    """
+
+    def __init__(self, maxsize: int = MAX_ENTRIES):
+        self._entries = _BoundedDict(maxsize)
+        self.hits = 0
+        self.misses = 0
+
+    def is_rendered(self, chat_id: int, message_id: int, digest: str, edit_date: Any) -> bool:
+        entry = self._entries.get((chat_id, message_id))
+        if entry is not None and edit_date is not None and entry == (digest, edit_date):
+            self.hits += 1
+            return True
+        self.misses += 1
+        return False
+
+    def remember(self, chat_id: int, message_id: int, digest: str, edit_date: Any) -> None:
+        if edit_date is None:
+            self.forget(chat_id, message_id)
+            return
+        self._entries.put((chat_id, message_id), (digest, edit_date))
+
+    def forget(self, chat_id: int, message_id: int) -> None:
+        self._entries.pop((chat_id, message_id))
+
+
+class KeyboardMemo(_BoundedDict):
+    """Готовые клавиатуры, привязанные к версии исходных данных."""
@@ -0,0 +1,231 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_ENTRIES = 2048
+DEFAULT_TTL = 30 * 24 * 3600
+_MISSING = object()
+
+
+class SessionDatabase:
+    """SQLite-файл, общий для всех пространств имён сессий."""
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS sessions ('
+            ' namespace TEXT NOT NULL,'
+            ' key TEXT NOT NULL,'
+            ' value TEXT NOT NULL,'
+            ' updated_at REAL NOT NULL,'
+            ' PRIMARY KEY (namespace, key))'
+        )
+        self.conn.commit()
+
+    def close(self) -> None:
+        with self.lock:
+            self.conn.close()
+
+
+class SessionStore:
+    """Словарь сессий с LRU+TTL в памяти и записью в SQLite.
+
+    Значения — обычные dict, которые обработчики меняют на месте, поэтому
+    запись отложенная: ключи, к которым обращались, помечаются, а flush()
+    сохраняет только те из них, чьё содержимое действительно изменилось.
+    Вытесненные из памяти записи подгружаются с диска при следующем обращении.
+    """
+
+    def __init__(
+        self,
+        database: SessionDatabase,
+        namespace: str,
+        maxsize: int = DEFAULT_MAX_ENTRIES,
+        ttl: float = DEFAULT_TTL,
+    ):
+        self.db = database
+        self.namespace = namespace
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: OrderedDict[Hashable, tuple[Any, float]] = OrderedDict()
+        self._persisted: dict[Hashable, tuple[str, float]] = {}
+        self._touched: set[Hashable] = set()
+        self._deleted: set[Hashable] = set()
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self._lookup(key) is not _MISSING
+
+    def __getitem__(self, key: Hashable) -> Any:
+        value = self._lookup(key)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key: Hashable, value: Any) -> None:
+        with self._lock:
+            self._entries[key] = (value, time.time())
+            self._entries.move_to_end(key)
+            self._touched.add(key)
+            self._deleted.discard(key)
+            self._evict()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        value = self._lookup(key)
+        return default if value is _MISSING else value
+
+    def setdefault(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            value = self._lookup(key)
+            if value is _MISSING:
+                self[key] = default
+                return default
+            return value
+
+    def pop(self, key: Hashable, default: Any = _MISSING) -> Any:
+        with self._lock:
+            value = self._lookup(key)
+            self._entries.pop(key, None)
+            self._touched.discard(key)
+            if value is _MISSING:
+                if default is _MISSING:
+                    raise KeyError(key)
+                return default
+            self._deleted.add(key)
+            return value
+
+    def _lookup(self, key: Hashable) -> Any:
+        with self._lock:
+            entry = self._entries.get(key)
+            now = time.time()
+            if entry is None:
+                if key in self._deleted:
+                    return _MISSING
+                value = self._load(key, now)
+                if value is _MISSING:
+                    return _MISSING
+                entry = (value, now)
+            elif now - entry[1] > self.ttl:
+                self._entries.pop(key, None)
+                self._deleted.add(key)
+                return _MISSING
+            self._entries[key] = (entry[0], now)
+            self._entries.move_to_end(key)
+            self._touched.add(key)
+            self._evict()
+            return entry[0]
+
+    def _load(self, key: Hashable, now: float) -> Any:
+        with self.db.lock:
+            row = self.db.conn.execute(
+                'SELECT value, updated_at FROM sessions WHERE namespace = ? AND key = ?',
+                (self.namespace, json.dumps(key)),
+            ).fetchone()
+        if row is None or now - row[1] > self.ttl:
+            return _MISSING
+        self._persisted[key] = (row[0], row[1])
+        return json.loads(row[0])
+
+    def _evict(self) -> None:
+        evicted = []
+        while len(self._entries) > self.maxsize:
+            evicted.append(self._entries.popitem(last=False))
+        if evicted:
+            self._write({key: entry for key, entry in evicted if key in self._touched})
+            for key, _ in evicted:
+                self._touched.discard(key)
+                self._persisted.pop(key, None)
+
+    def _write(self, entries: dict[Hashable, tuple[Any, float]]) -> int:
+        return self._store_rows(self._serialize(entries))
+
+    def _serialize(self, entries: dict[Hashable, tuple[Any, float]]) -> list[tuple[Hashable, str, float]]:
+        rows = []
+        for key, (value, accessed_at) in entries.items():
+            try:
+                serialized = json.dumps(value, ensure_ascii=False, sort_keys=True)
+            except Exception as exc:
+                # Ключ остаётся помеченным: следующий flush попробует снова
+                logger.error(f"Сессия {self.namespace}/{key} не сериализуется: {exc}")
+                if key in self._entries:
+                    self._touched.add(key)
+                continue
+            persisted = self._persisted.get(key)
+            # Неизменённую сессию перезаписываем лишь изредка, чтобы продлить её TTL на диске
+            if persisted and persisted[0] == serialized and accessed_at - persisted[1] < self.ttl / 4:
+                continue
+            rows.append((key, serialized, accessed_at))
+        return rows
+
+    def _store_rows(self, rows: list[tuple[Hashable, str, float]]) -> int:
+        if rows:
+            with self.db.lock:
+                self.db.conn.executemany(
+                    'INSERT OR REPLACE INTO sessions (namespace, key, value, updated_at) VALUES (?, ?, ?, ?)',
+                    [(self.namespace, json.dumps(key), serialized, accessed_at) for key, serialized, accessed_at in rows],
+                )
+                self.db.conn.commit()
+        with self._lock:
+            for key, serialized, accessed_at in rows:
+                self._persisted[key] = (serialized, accessed_at)
+        return len(rows)
+
+    def prepare_flush(self) -> tuple[list[tuple[Hashable, str, float]], list[Hashable]]:
+        """Снимок изменённых и удалённых сессий для commit_flush().
+
+        Обработчики меняют словари сессий на месте без блокировки, поэтому
+        вызывать нужно в том же потоке, что и они (в потоке цикла событий):
+        тогда сериализация не увидит наполовину изменённое состояние.
+        """
+        with self._lock:
+            touched = {key: self._entries[key] for key in self._touched if key in self._entries}
+            deleted = list(self._deleted)
+            self._touched.clear()
+            self._deleted.clear()
+            return self._serialize(touched), deleted
+
+    def commit_flush(self, batch: tuple[list[tuple[Hashable, str, float]], list[Hashable]]) -> int:
+        """Записывает снимок prepare_flush() в SQLite; можно вызывать из другого потока."""
+        rows, deleted = batch
+        try:
+            written = self._store_rows(rows)
+            with self.db.lock:
+                if deleted:
+                    self.db.conn.executemany(
+                        'DELETE FROM sessions WHERE namespace = ? AND key = ?',
+                        [(self.namespace, json.dumps(key)) for key in deleted],
+                    )
+                self.db.conn.execute(
+                    'DELETE FROM sessions WHERE namespace = ? AND updated_at < ?',
+                    (self.namespace, time.time() - self.ttl),
+                )
+                self.db.conn.commit()
+        except Exception:
+            # Не записанное вернётся в следующий flush
+            with self._lock:
+                self._touched.update(key for key, _, _ in rows if key in self._entries)
+                self._deleted.update(key for key in deleted if key not in self._entries)
+            raise
+        with self._lock:
+            for key in deleted:
+                self._persisted.pop(key, None)
+        return written
+
+    def flush(self) -> int:
+        """Сохраняет изменённые сессии и удаляет устаревшие; возвращает число записанных строк."""
+        return self.commit_flush(self.prepare_flush())
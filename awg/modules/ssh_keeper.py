@@ -0,0 +1,101 @@
+import asyncio
+import logging
+import random
+import time
+from typing import Callable
+
+logger = logging.getLogger(__name__)
+
+CHECK_INTERVAL = 10.0
+BASE_DELAY = 2.0
+MAX_DELAY = 300.0
+
+
+def backoff_delay(attempt: int, base: float = BASE_DELAY, cap: float = MAX_DELAY) -> float:
+    """Экспоненциальная задержка с разбросом: от половины до полного значения.
+
+    Разброс не даёт нескольким серверам (и нескольким процессам) переподключаться
+    одновременно после общего сбоя сети.
+    """
+    delay = min(cap, base * (2 ** max(attempt - 1, 0)))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+class ConnectionKeeper:
+    """Фоновая задача, которая держит SSH-соединения со всеми серверами открытыми.
+
+    При старте подключается ко всем серверам параллельно, затем раз в
+    CHECK_INTERVAL проверяет транспорты и переподключает упавшие, не дожидаясь
+    запроса пользователя. Подключение выполняется в пуле потоков.
+    """
+
+    def __init__(
+        self,
+        list_servers: Callable[[], list[str]],
+        is_connected: Callable[[str], bool],
+        connect: Callable[[str], bool],
+        should_skip: Callable[[str], bool] | None = None,
+        interval: float = CHECK_INTERVAL,
+    ):
+        self._list_servers = list_servers
+        self._is_connected = is_connected
+        self._connect = connect
+        self._should_skip = should_skip
+        self.interval = interval
+        self._attempts: dict[str, int] = {}
+        self._next_attempt: dict[str, float] = {}
+        self._runner: asyncio.Task | None = None
+
+    def start(self) -> None:
+        if self._runner is None or self._runner.done():
+            self._runner = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._runner:
+            self._runner.cancel()
+            try:
+                await self._runner
+            except asyncio.CancelledError:
+                pass
+            self._runner = None
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.check_all()
+            except Exception as exc:
+                logger.error(f"Ошибка фоновой проверки SSH-соединений: {exc}")
+            await asyncio.sleep(self.interval)
+
+    async def check_all(self) -> None:
+        now = time.monotonic()
+        due = []
+        for server_id in self._list_servers():
+            if self._is_connected(server_id):
+                self._attempts.pop(server_id, None)
+                self._next_attempt.pop(server_id, None)
+                continue
+            if self._should_skip is not None and self._should_skip(server_id):
+                continue
+            if self._next_attempt.get(server_id, 0.0) <= now:
+                due.append(server_id)
+        if due:
+            await asyncio.gather(*(self._reconnect(server_id) for server_id in due))
+
+    async def _reconnect(self, server_id: str) -> None:
+        loop = asyncio.get_running_loop()
+        try:
+            connected = await loop.run_in_executor(None, self._connect, server_id)
+        except Exception as exc:
+            logger.error(f"Ошибка подключения к серверу {server_id}: {exc}")
+            connected = False
+        if connected:
+            if self._attempts.pop(server_id, None):
+                logger.info(f"Соединение с сервером {server_id} восстановлено в фоне")
+            self._next_attempt.pop(server_id, None)
+            return
+        attempt = self._attempts.get(server_id, 0) + 1
+        self._attempts[server_id] = attempt
+        delay = backoff_delay(attempt)
+        self._next_attempt[server_id] = time.monotonic() + delay
+        logger.warning(f"Не удалось подключиться к серверу {server_id}, попытка {attempt}, следующая через {delay:.0f} с")
@@ -0,0 +1,123 @@
+import base64
+import hashlib
+import struct
+import threading
+import zlib
+from collections import OrderedDict
+
+VPN_URI_PREFIX = 'vpn://'
+COMPRESSION_LEVEL = 8
+CACHE_SIZE = 512
+
+
+def q_compress(data: bytes, level: int = -1) -> bytes:
+    """Аналог qCompress из Qt: 4 байта длины (big-endian) + zlib поток."""
+    return struct.pack('>I', len(data)) + zlib.compress(data, level)
+
+
+def q_uncompress(data: bytes) -> bytes:
+    if len(data) < 4:
+        return b''
+    uncompressed_size = struct.unpack('>I', data[:4])[0]
+    try:
+        uncompressed = zlib.decompress(data[4:])
+    except zlib.error:
+        return b''
+    if len(uncompressed) != uncompressed_size:
+        return b''
+    return uncompressed
+
+
+def base64url_encode(data: bytes) -> bytes:
+    return base64.urlsafe_b64encode(data).rstrip(b'=')
+
+
+def base64url_decode(data: bytes) -> bytes:
+    return base64.urlsafe_b64decode(data + b'=' * ((4 - len(data) % 4) % 4))
+
+
+def _encode(conf_text: str) -> str:
+    compressed = q_compress(conf_text.encode('utf-8'), level=COMPRESSION_LEVEL)
+    return VPN_URI_PREFIX + base64url_encode(compressed).decode('ascii')
+
+
+def _decode(vpn_uri: str) -> str:
+    payload = vpn_uri.strip()
+    if payload.startswith(VPN_URI_PREFIX):
+        payload = payload[len(VPN_URI_PREFIX):]
+    compressed = base64url_decode(payload.encode('ascii'))
+    uncompressed = q_uncompress(compressed)
+    return (uncompressed or compressed).decode('utf-8')
+
+
+class _LruCache:
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._data: OrderedDict[str, str] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> str | None:
+        with self._lock:
+            value = self._data.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: str, value: str) -> None:
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+
+_encode_cache = _LruCache(CACHE_SIZE)
+_decode_cache = _LruCache(CACHE_SIZE)
+
+
+def _digest(value: str) -> str:
+    return hashlib.sha256(value.encode('utf-8')).hexdigest()
+
+
+def encode_vpn_uri(conf_text: str) -> str:
+    """Кодирует содержимое .conf в vpn:// с кешированием по хешу содержимого."""
+    key = _digest(conf_text)
+    cached = _encode_cache.get(key)
+    if cached is not None:
+        return cached
+    vpn_uri = _encode(conf_text)
+    _encode_cache.put(key, vpn_uri)
+    return vpn_uri
+
+
+def decode_vpn_uri(vpn_uri: str) -> str:
+    key = _digest(vpn_uri)
+    cached = _decode_cache.get(key)
+    if cached is not None:
+        return cached
+    conf_text = _decode(vpn_uri)
+    _decode_cache.put(key, conf_text)
+    return conf_text
+
+
+def encode_conf_file(conf_path: str) -> str:
+    with open(conf_path, 'r', encoding='utf-8') as file:
+        return encode_vpn_uri(file.read())
+
+
+def cache_info() -> dict[str, int]:
+    return {
+        'encode_hits': _encode_cache.hits,
+        'encode_misses': _encode_cache.misses,
+        'decode_hits': _decode_cache.hits,
+        'decode_misses': _decode_cache.misses,
+    }
@@ -0,0 +1,127 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable
+
+from aiohttp import web
+from aiogram import Bot, types
+from aiogram.dispatcher import Dispatcher
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WORKERS = 8
+QUEUE_SIZE_PER_WORKER = 64
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+
+class WebhookUpdateQueue:
+    """Принимает апдейты по HTTP и обрабатывает их ограниченным пулом воркеров."""
+
+    def __init__(self, dispatcher: Dispatcher, workers: int = DEFAULT_WORKERS, secret_token: str | None = None):
+        self.dispatcher = dispatcher
+        self.workers = max(1, workers)
+        self.secret_token = secret_token
+        self._queue: asyncio.Queue | None = None
+        self._tasks: list[asyncio.Task] = []
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize() if self._queue else 0
+
+    async def handle(self, request: web.Request) -> web.Response:
+        if self.secret_token and request.headers.get(SECRET_HEADER) != self.secret_token:
+            return web.Response(status=403)
+        try:
+            update = types.Update(**(await request.json()))
+        except Exception as exc:
+            logger.error(f"Некорректный апдейт webhook: {exc}")
+            return web.Response(status=400)
+        # Ответ Telegram отдаём сразу, обработка идёт в воркерах;
+        # при переполненной очереди запрос ждёт, создавая обратное давление
+        await self._queue.put(update)
+        return web.Response(text='ok')
+
+    async def start(self) -> None:
+        self._queue = asyncio.Queue(maxsize=self.workers * QUEUE_SIZE_PER_WORKER)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self) -> None:
+        if self._queue:
+            try:
+                await asyncio.wait_for(self._queue.join(), timeout=10)
+            except asyncio.TimeoutError:
+                logger.warning("Не все апдейты webhook обработаны до остановки")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _worker(self) -> None:
+        Bot.set_current(self.dispatcher.bot)
+        Dispatcher.set_current(self.dispatcher)
+        while True:
+            update = await self._queue.get()
+            try:
+                await self.dispatcher.process_update(update)
+            except Exception as exc:
+                logger.error(f"Ошибка обработки апдейта {update.update_id}: {exc}")
+            finally:
+                self._queue.task_done()
+
+
+def build_webhook_app(
+    dispatcher: Dispatcher,
+    webhook_url: str,
+    path: str,
+    workers: int = DEFAULT_WORKERS,
+    secret_token: str | None = None,
+    on_startup: Callable[[Dispatcher], Awaitable[None]] | None = None,
+    on_shutdown: Callable[[Dispatcher], Awaitable[None]] | None = None,
+) -> web.Application:
+    updates = WebhookUpdateQueue(dispatcher, workers=workers, secret_token=secret_token)
+    app = web.Application()
+    app['updates'] = updates
+    app.router.add_post(path, updates.handle)
+
+    async def _startup(_: web.Application) -> None:
+        Bot.set_current(dispatcher.bot)
+        Dispatcher.set_current(dispatcher)
+        await updates.start()
+        full_url = webhook_url.rstrip('/') + path
+        await dispatcher.bot.set_webhook(full_url, secret_token=secret_token)
+        logger.info(f"Webhook установлен: {full_url}, воркеров: {updates.workers}")
+        if on_startup:
+            await on_startup(dispatcher)
+
+    async def _shutdown(_: web.Application) -> None:
+        await updates.stop()
+        if on_shutdown:
+            await on_shutdown(dispatcher)
+        await dispatcher.storage.close()
+        await dispatcher.storage.wait_closed()
+        session = await dispatcher.bot.get_session()
+        await session.close()
+
+    app.on_startup.append(_startup)
+    app.on_shutdown.append(_shutdown)
+    return app
+
+
+def attach_asgi_app(app: web.Application, asgi_app, host: str, port: int) -> None:
+    """Запускает ASGI-приложение (админский API) через uvicorn в том же event loop."""
+    import uvicorn
+
+    server = uvicorn.Server(uvicorn.Config(asgi_app, host=host, port=port, log_level='info'))
+
+    async def _start(_: web.Application) -> None:
+        app['asgi_server_task'] = asyncio.create_task(server.serve())
+
+    async def _stop(_: web.Application) -> None:
+        server.should_exit = True
+        await app['asgi_server_task']
+
+    app.on_startup.append(_start)
+    app.on_cleanup.append(_stop)
+
+
+def run_webhook_app(app: web.Application, host: str, port: int) -> None:
+    web.run_app(app, host=host, port=port)
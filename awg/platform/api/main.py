@@ -6,7 +6,9 @@
 
 import os
 import sys
-from typing import Literal, NoReturn
+import time
+from contextlib import asynccontextmanager
+from typing import Any, Literal, NoReturn
 
 if __package__ in {None, ""}:
     project_root = os.path.abspath(
@@ -16,8 +18,8 @@ if __package__ in {None, ""}:
         sys.path.insert(0, project_root)
 
 try:
-    from fastapi import FastAPI, HTTPException, Path, Query, Request
-    from fastapi.responses import JSONResponse
+    from fastapi import FastAPI, Header, HTTPException, Path, Query, Request
+    from fastapi.responses import JSONResponse, PlainTextResponse
     from pydantic import BaseModel, Field
 except ImportError as exc:  # pragma: no cover
     raise RuntimeError(
@@ -25,7 +27,23 @@ except ImportError as exc:  # pragma: no cover
         "когда начнете перенос API слоя."
     ) from exc
 
-from awg.platform.application.profile_service import ProfileService
+from awg import db
+from awg.modules import vpn_codec
+from awg.platform.application.idempotency import (
+    IdempotencyConflict,
+    IdempotencyStore,
+)
+from awg.platform.application.job_service import (
+    Job,
+    JobFailed,
+    JobService,
+    QueueFull,
+)
+from awg.platform.application.profile_service import (
+    BatchItemResult,
+    CreatedProfile,
+    ProfileService,
+)
 from awg.platform.application.server_service import ServerService
 from awg.platform.application.user_service import UserService
 
@@ -85,6 +103,42 @@ class DeleteProfileResponse(BaseModel):
     data: DeleteProfileData
 
 
+class BatchCreateItemData(BaseModel):
+    index: int = Field(description="Позиция элемента в запросе")
+    ok: bool
+    data: CreatedProfileData | None = None
+    error: ApiError | None = None
+
+
+class BatchCreateProfilesData(BaseModel):
+    created: int
+    failed: int
+    items: list[BatchCreateItemData]
+
+
+class BatchCreateProfilesResponse(BaseModel):
+    ok: Literal[True] = Field(default=True)
+    data: BatchCreateProfilesData
+
+
+class BatchDeleteItemData(BaseModel):
+    index: int = Field(description="Позиция элемента в запросе")
+    ok: bool
+    data: DeleteProfileData | None = None
+    error: ApiError | None = None
+
+
+class BatchDeleteProfilesData(BaseModel):
+    deleted: int
+    failed: int
+    items: list[BatchDeleteItemData]
+
+
+class BatchDeleteProfilesResponse(BaseModel):
+    ok: Literal[True] = Field(default=True)
+    data: BatchDeleteProfilesData
+
+
 class UserData(BaseModel):
     user_id: str | int
     profiles_count: int
@@ -138,6 +192,70 @@ class ServerTestResponse(BaseModel):
     data: ServerTestData
 
 
+class PhaseTiming(BaseModel):
+    mean: float = Field(description="Среднее время, с")
+    p95: float | None = Field(
+        default=None,
+        description="Верхняя граница p95 по бакетам гистограммы, с",
+    )
+
+
+class SshTimingData(BaseModel):
+    server_id: str
+    kind: str = Field(description="Тип команды, например docker:wg")
+    count: int
+    phases: dict[str, PhaseTiming]
+
+
+class SlowCommandData(BaseModel):
+    at: float = Field(description="Unix-время завершения")
+    server_id: str
+    kind: str
+    command: str = Field(
+        description="Программы команды без аргументов, например echo | docker:wg",
+    )
+    phases: dict[str, float]
+
+
+class CircuitStateData(BaseModel):
+    server_id: str
+    state: Literal["closed", "open", "half_open"]
+    failures: int = Field(description="Ошибок подключения подряд")
+    last_error: str | None = None
+    retry_in: float = Field(description="Секунд до следующей пробы")
+
+
+class SshDiagnosticsData(BaseModel):
+    timings: list[SshTimingData]
+    slow_commands: list[SlowCommandData]
+    circuits: list[CircuitStateData]
+
+
+class SshDiagnosticsResponse(BaseModel):
+    ok: Literal[True] = Field(default=True)
+    data: SshDiagnosticsData
+
+
+class JobData(BaseModel):
+    job_id: str
+    kind: str = Field(examples=["profile_create"])
+    server_id: str
+    status: Literal["queued", "running", "succeeded", "failed"]
+    created_at: float = Field(description="Unix-время постановки в очередь")
+    started_at: float | None = None
+    finished_at: float | None = None
+    result: dict[str, Any] | None = Field(
+        default=None,
+        description="Поле data синхронного ответа той же операции",
+    )
+    error: ApiError | None = None
+
+
+class JobResponse(BaseModel):
+    ok: Literal[True] = Field(default=True)
+    data: JobData
+
+
 class CreateProfileRequest(BaseModel):
     server_id: str = Field(min_length=1, description="ID сервера")
     user_id: str | int = Field(description="ID пользователя владельца")
@@ -148,6 +266,14 @@ class CreateProfileRequest(BaseModel):
     )
 
 
+class BatchCreateProfilesRequest(BaseModel):
+    items: list[CreateProfileRequest] = Field(min_length=1, max_length=1000)
+
+
+class BatchDeleteProfilesRequest(BaseModel):
+    profile_ids: list[str] = Field(min_length=1, max_length=1000)
+
+
 class CreateServerRequest(BaseModel):
     server_id: int | str = Field(description="ID сервера")
     server_name: str = Field(
@@ -177,14 +303,74 @@ class UpdateServerRequest(BaseModel):
     key_path: str | None = None
 
 
+@asynccontextmanager
+async def lifespan(_: FastAPI):
+    # Бот пишет в data/ из своего процесса: кеши API сбрасываются по событиям наблюдателя
+    db.start_data_watcher()
+    yield
+    job_service.shutdown()
+
+
 app = FastAPI(
     title="AWG Admin API",
     version="0.3.0",
     description="HTTP API для управления профилями AWG и серверами.",
+    lifespan=lifespan,
 )
 user_service = UserService()
 profile_service = ProfileService()
 server_service = ServerService()
+job_service = JobService()
+idempotency_store = IdempotencyStore()
+# Сколько повтор запроса с тем же Idempotency-Key ждёт завершения первого
+IDEMPOTENCY_WAIT_SECONDS = 60
+
+# Реестр берём у db: при запуске вместе с ботом awg.db — это модуль db бота
+# (см. _share_modules_with_admin_api в bot_manager), и реестр тот же,
+# в который пишут SSH-вызовы и фоновые задачи бота
+metrics = db.metrics
+REQUEST_DURATION = metrics.REGISTRY.histogram(
+    "awg_api_request_duration_seconds",
+    "Время обработки HTTP-запроса",
+    ("method", "route", "status"),
+)
+metrics.REGISTRY.counter(
+    "awg_cache_requests_total", "Обращения к кешам", ("cache", "result")
+).add_callback(
+    lambda: {
+        ("vpn_codec_encode", "hit"): vpn_codec.cache_info()["encode_hits"],
+        ("vpn_codec_encode", "miss"): vpn_codec.cache_info()["encode_misses"],
+    },
+    name="api_vpn_codec",
+)
+metrics.REGISTRY.gauge(
+    "awg_api_job_queue_depth",
+    "Задачи API в очереди и в работе",
+    ("server_id",),
+).add_callback(
+    lambda: {
+        (server_id,): depth
+        for server_id, depth in job_service.queue_depths().items()
+    },
+    name="api_jobs",
+)
+
+
+@app.middleware("http")
+async def request_metrics_middleware(request: Request, call_next):
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        route = request.scope.get("route")
+        REQUEST_DURATION.labels(
+            request.method,
+            getattr(route, "path", "unmatched"),
+            status,
+        ).observe(time.perf_counter() - started)
 
 
 def _error(status_code: int, code: str, message: str) -> NoReturn:
@@ -194,6 +380,58 @@ def _error(status_code: int, code: str, message: str) -> NoReturn:
     )
 
 
+def _wants_async(prefer: str | None) -> bool:
+    return "respond-async" in (prefer or "").lower()
+
+
+def _job_data(job: Job) -> JobData:
+    return JobData(**job.snapshot())
+
+
+def _accepted(job: Job) -> JSONResponse:
+    return JSONResponse(
+        status_code=202,
+        content=JobResponse(data=_job_data(job)).model_dump(),
+        headers={"Location": f"/api/v1/jobs/{job.job_id}"},
+    )
+
+
+def _submit_job(
+    kind: str,
+    server_id: str,
+    handler,
+    *args,
+) -> Job:
+    """Ставит синхронный обработчик маршрута в очередь сервера."""
+
+    def run() -> dict[str, Any]:
+        try:
+            return handler(*args).data.model_dump()
+        except HTTPException as exc:
+            detail = exc.detail if isinstance(exc.detail, dict) else {}
+            raise JobFailed(
+                str(detail.get("code") or "http_error"),
+                str(detail.get("message") or exc.detail),
+            ) from exc
+
+    try:
+        return job_service.submit(kind, server_id, run)
+    except QueueFull as exc:
+        _error(429, "job_queue_full", str(exc))
+
+
+def _call_in_queue(kind: str, server_id: str, handler, *args):
+    """Выполняет синхронный обработчик в очереди сервера и ждёт ответа.
+
+    Все изменения wg0.conf через API проходят через очередь сервера, поэтому
+    синхронные, фоновые и пакетные операции не перезаписывают файл друг друга.
+    """
+    try:
+        return job_service.call(kind, server_id, lambda: handler(*args))
+    except QueueFull as exc:
+        _error(429, "job_queue_full", str(exc))
+
+
 def _server_data(server_dict: dict) -> ServerData:
     external_id = server_dict.get("id")
     if external_id is None:
@@ -249,6 +487,23 @@ def _profile_data(item: dict[str, str | int | None]) -> ProfileData:
     )
 
 
+def _created_profile_data(created: CreatedProfile) -> CreatedProfileData:
+    return CreatedProfileData(
+        profile_id=created.profile_id,
+        server_id=created.server_id,
+        user_id=created.user_id,
+        profile_name=created.profile_name,
+        conf_text=created.conf_text,
+        vpn_uri=created.vpn_uri,
+    )
+
+
+def _batch_error(item: BatchItemResult) -> ApiError | None:
+    if item.ok:
+        return None
+    return ApiError(code=item.error_code or "internal_error", message=item.error or "")
+
+
 def _user_data(item: dict[str, str | int]) -> UserData:
     return UserData(
         user_id=item.get("user_id") or "",
@@ -277,6 +532,19 @@ def health() -> HealthResponse:
     return HealthResponse(data=HealthData())
 
 
+@app.get("/metrics", include_in_schema=False)
+def prometheus_metrics() -> PlainTextResponse:
+    """Метрики в текстовом формате Prometheus.
+
+    Аргументы: нет.
+    Возможные значения: нет.
+    """
+    return PlainTextResponse(
+        metrics.REGISTRY.render(),
+        media_type=metrics.CONTENT_TYPE,
+    )
+
+
 @app.get(
     "/api/v1/servers/{server_id}/profiles",
     response_model=ProfileListResponse,
@@ -304,10 +572,30 @@ def profiles_by_server(
 @app.post(
     "/api/v1/profiles",
     response_model=CreateProfileResponse,
-    responses={400: {"model": ErrorResponse}, 500: {"model": ErrorResponse}},
+    responses={
+        202: {"model": JobResponse},
+        400: {"model": ErrorResponse},
+        404: {"model": ErrorResponse},
+        409: {"model": ErrorResponse},
+        422: {"model": ErrorResponse},
+        429: {"model": ErrorResponse},
+        500: {"model": ErrorResponse},
+    },
     summary="Создать профиль",
 )
-def create_profile(payload: CreateProfileRequest) -> CreateProfileResponse:
+def create_profile(
+    payload: CreateProfileRequest,
+    prefer: str | None = Header(
+        default=None,
+        description="respond-async — выполнить в фоне и ответить 202",
+    ),
+    idempotency_key: str | None = Header(
+        default=None,
+        alias="Idempotency-Key",
+        max_length=255,
+        description="Ключ повтора: запрос с тем же ключом вернет исходный ответ",
+    ),
+):
     """Создает профиль пользователя на сервере.
 
     Аргументы (body):
@@ -319,7 +607,94 @@ def create_profile(payload: CreateProfileRequest) -> CreateProfileResponse:
     - user_id: int или str.
     - profile_name: латиница/цифры/`_`/`-`/`.`.
     - server_id: существующий ID сервера.
+    - Prefer: respond-async — ответ 202 с задачей, результат в /api/v1/jobs/{job_id}.
+    - Idempotency-Key: повтор с тем же ключом и телом возвращает ответ
+      первого успешного запроса, не обращаясь к серверу; с другим телом — 422;
+      если профиль с тех пор удален — 404 profile_not_found.
     """
+    if idempotency_key:
+        return _create_profile_idempotent(
+            payload, idempotency_key, _wants_async(prefer)
+        )
+    if _wants_async(prefer):
+        return _accepted(
+            _submit_job(
+                "profile_create", payload.server_id, _create_profile, payload
+            )
+        )
+    return _call_in_queue(
+        "profile_create", payload.server_id, _create_profile, payload
+    )
+
+
+def _create_profile_idempotent(
+    payload: CreateProfileRequest,
+    key: str,
+    respond_async: bool,
+):
+    """Выполняет создание один раз на ключ; повтор получает исходный ответ."""
+    fingerprint = payload.model_dump_json()
+    for _ in range(2):
+        try:
+            entry, is_new = idempotency_store.begin(key, fingerprint)
+        except IdempotencyConflict as exc:
+            _error(422, "idempotency_key_reused", str(exc))
+        if is_new:
+            break
+        if entry.done:
+            return _replay_created_profile(entry.profile_id)
+        # Задача видна только воркеру, который её поставил
+        job = job_service.get(entry.job_id) if entry.job_id else None
+        if job is not None:
+            return _accepted(job)
+        # Первый запрос ещё выполняется; если он завершится ошибкой, ключ освободится
+        if not idempotency_store.wait(entry, IDEMPOTENCY_WAIT_SECONDS):
+            _error(
+                409,
+                "request_in_progress",
+                "Запрос с этим Idempotency-Key еще выполняется.",
+            )
+        if entry.done:
+            return _replay_created_profile(entry.profile_id)
+    else:
+        _error(
+            409,
+            "request_in_progress",
+            "Запрос с этим Idempotency-Key еще выполняется.",
+        )
+
+    def run() -> CreateProfileResponse:
+        try:
+            response = _create_profile(payload)
+        except BaseException:
+            idempotency_store.fail(entry)
+            raise
+        idempotency_store.complete(entry, response.data.profile_id)
+        return response
+
+    try:
+        if not respond_async:
+            return _call_in_queue("profile_create", payload.server_id, run)
+        job = _submit_job("profile_create", payload.server_id, run)
+    except BaseException:
+        idempotency_store.fail(entry)
+        raise
+    idempotency_store.attach_job(entry, job.job_id)
+    return _accepted(job)
+
+
+def _replay_created_profile(profile_id: str | None) -> CreateProfileResponse:
+    # Хранилище ключей помнит только profile_id: .conf читается заново
+    try:
+        created = profile_service.get_created_profile(profile_id or "")
+    except KeyError as exc:
+        _error(404, "profile_not_found", str(exc))
+    except RuntimeError as exc:
+        _error(500, "profile_create_failed", str(exc))
+    return CreateProfileResponse(data=_created_profile_data(created))
+
+
+def _create_profile(payload: CreateProfileRequest) -> CreateProfileResponse:
     try:
         created = profile_service.create_profile(
             server_id=payload.server_id,
@@ -331,14 +706,106 @@ def create_profile(payload: CreateProfileRequest) -> CreateProfileResponse:
     except RuntimeError as exc:
         _error(500, "profile_create_failed", str(exc))
 
-    return CreateProfileResponse(
-        data=CreatedProfileData(
-            profile_id=created.profile_id,
-            server_id=created.server_id,
-            user_id=created.user_id,
-            profile_name=created.profile_name,
-            conf_text=created.conf_text,
-            vpn_uri=created.vpn_uri,
+    return CreateProfileResponse(data=_created_profile_data(created))
+
+
+@app.post(
+    "/api/v1/profiles:batchCreate",
+    response_model=BatchCreateProfilesResponse,
+    responses={500: {"model": ErrorResponse}},
+    summary="Создать несколько профилей",
+)
+def batch_create_profiles(
+    payload: BatchCreateProfilesRequest,
+) -> BatchCreateProfilesResponse:
+    """Создает профили пачкой: одна запись конфигурации и один перезапуск на сервер.
+
+    Аргументы (body):
+    - items: до 1000 элементов в формате POST /api/v1/profiles.
+
+    Возможные значения:
+    - items[].ok: true — профиль создан, data как у POST /api/v1/profiles;
+    - items[].error.code: invalid_profile_payload, profile_exists,
+      profile_create_failed, job_queue_full, duplicate_item (то же имя на том
+      же сервере уже есть в запросе).
+    """
+    try:
+        results = profile_service.batch_create_profiles(
+            [
+                (item.server_id, item.user_id, item.profile_name)
+                for item in payload.items
+            ],
+            run_on_server=job_service.call,
+        )
+    except Exception as exc:
+        _error(500, "profiles_batch_create_failed", str(exc))
+
+    items = [
+        BatchCreateItemData(
+            index=item.index,
+            ok=item.ok,
+            data=_created_profile_data(item.profile) if item.ok else None,
+            error=_batch_error(item),
+        )
+        for item in results
+    ]
+    created = sum(item.ok for item in items)
+    return BatchCreateProfilesResponse(
+        data=BatchCreateProfilesData(
+            created=created,
+            failed=len(items) - created,
+            items=items,
+        )
+    )
+
+
+@app.post(
+    "/api/v1/profiles:batchDelete",
+    response_model=BatchDeleteProfilesResponse,
+    responses={500: {"model": ErrorResponse}},
+    summary="Удалить несколько профилей",
+)
+def batch_delete_profiles(
+    payload: BatchDeleteProfilesRequest,
+) -> BatchDeleteProfilesResponse:
+    """Удаляет профили пачкой: одна запись конфигурации и один перезапуск на сервер.
+
+    Аргументы (body):
+    - profile_ids: до 1000 UUID профилей из реестра.
+
+    Возможные значения:
+    - items[].error.code: profile_not_found, profile_delete_failed,
+      job_queue_full, duplicate_item (тот же profile_id уже есть в запросе).
+    """
+    try:
+        results = profile_service.batch_delete_profiles(
+            payload.profile_ids,
+            run_on_server=job_service.call,
+        )
+    except Exception as exc:
+        _error(500, "profiles_batch_delete_failed", str(exc))
+
+    items = [
+        BatchDeleteItemData(
+            index=item.index,
+            ok=item.ok,
+            data=(
+                DeleteProfileData(
+                    profile_id=item.profile.profile_id,
+                    status=item.profile.status,
+                )
+                if item.ok else None
+            ),
+            error=_batch_error(item),
+        )
+        for item in results
+    ]
+    deleted = sum(item.ok for item in items)
+    return BatchDeleteProfilesResponse(
+        data=BatchDeleteProfilesData(
+            deleted=deleted,
+            failed=len(items) - deleted,
+            items=items,
         )
     )
 
@@ -346,12 +813,21 @@ def create_profile(payload: CreateProfileRequest) -> CreateProfileResponse:
 @app.delete(
     "/api/v1/profiles/{profile_id}",
     response_model=DeleteProfileResponse,
-    responses={404: {"model": ErrorResponse}, 500: {"model": ErrorResponse}},
+    responses={
+        202: {"model": JobResponse},
+        404: {"model": ErrorResponse},
+        429: {"model": ErrorResponse},
+        500: {"model": ErrorResponse},
+    },
     summary="Удалить профиль",
 )
 def delete_profile(
     profile_id: str = Path(description="Идентификатор профиля"),
-) -> DeleteProfileResponse:
+    prefer: str | None = Header(
+        default=None,
+        description="respond-async — выполнить в фоне и ответить 202",
+    ),
+):
     """Удаляет профиль по profile_id.
 
     Аргументы:
@@ -359,7 +835,20 @@ def delete_profile(
 
     Возможные значения:
     - profile_id: валидный UUID, ранее выданный API.
+    - Prefer: respond-async — ответ 202 с задачей, результат в /api/v1/jobs/{job_id}.
     """
+    try:
+        server_id = profile_service.get_profile_server(profile_id)
+    except KeyError as exc:
+        _error(404, "profile_not_found", str(exc))
+    if _wants_async(prefer):
+        return _accepted(
+            _submit_job("profile_delete", server_id, _delete_profile, profile_id)
+        )
+    return _call_in_queue("profile_delete", server_id, _delete_profile, profile_id)
+
+
+def _delete_profile(profile_id: str) -> DeleteProfileResponse:
     try:
         result = profile_service.delete_profile(profile_id)
     except KeyError as exc:
@@ -587,12 +1076,21 @@ def delete_server(
 @app.post(
     "/api/v1/servers/{server_id}/test-connection",
     response_model=ServerTestResponse,
-    responses={404: {"model": ErrorResponse}, 500: {"model": ErrorResponse}},
+    responses={
+        202: {"model": JobResponse},
+        404: {"model": ErrorResponse},
+        429: {"model": ErrorResponse},
+        500: {"model": ErrorResponse},
+    },
     summary="Проверить SSH подключение",
 )
 def test_server_connection(
     server_id: str = Path(description="ID сервера"),
-) -> ServerTestResponse:
+    prefer: str | None = Header(
+        default=None,
+        description="respond-async — выполнить в фоне и ответить 202",
+    ),
+):
     """Проверяет SSH-подключение к серверу.
 
     Аргументы:
@@ -600,7 +1098,18 @@ def test_server_connection(
 
     Возможные значения:
     - server_id: существующий ID сервера.
+    - Prefer: respond-async — ответ 202 с задачей, результат в /api/v1/jobs/{job_id}.
     """
+    if _wants_async(prefer):
+        return _accepted(
+            _submit_job(
+                "server_test", server_id, _test_server_connection, server_id
+            )
+        )
+    return _test_server_connection(server_id)
+
+
+def _test_server_connection(server_id: str) -> ServerTestResponse:
     try:
         result = server_service.test_connection(server_id)
     except KeyError as exc:
@@ -610,6 +1119,67 @@ def test_server_connection(
     return ServerTestResponse(data=ServerTestData(**result))
 
 
+@app.get(
+    "/api/v1/jobs/{job_id}",
+    response_model=JobResponse,
+    responses={404: {"model": ErrorResponse}},
+    summary="Состояние фоновой задачи",
+)
+async def get_job(
+    job_id: str = Path(description="Идентификатор задачи из ответа 202"),
+    wait: float = Query(
+        default=0,
+        ge=0,
+        le=60,
+        description="Сколько секунд ждать завершения задачи",
+    ),
+) -> JobResponse:
+    """Возвращает состояние задачи; с wait > 0 работает как long-poll.
+
+    Аргументы:
+    - job_id: идентификатор задачи.
+    - wait: 0..60 секунд ожидания завершения.
+
+    Возможные значения:
+    - status: queued, running, succeeded, failed;
+    - result: поле data ответа синхронной операции;
+    - error: код и текст ошибки, как в синхронном ответе.
+    """
+    job = job_service.get(job_id)
+    if job is None:
+        _error(404, "job_not_found", "Задача не найдена или уже удалена.")
+    job = await job_service.wait(job, wait)
+    return JobResponse(data=_job_data(job))
+
+
+@app.get(
+    "/api/v1/diagnostics/ssh",
+    response_model=SshDiagnosticsResponse,
+    summary="Время выполнения команд на серверах",
+)
+def ssh_diagnostics(
+    limit: int = Query(default=20, ge=1, le=100),
+) -> SshDiagnosticsResponse:
+    """Фазы выполнения команд по серверам и последние медленные команды.
+
+    Аргументы:
+    - limit: сколько последних медленных команд вернуть.
+
+    Возможные значения:
+    - фазы: connect, channel_open, first_byte, total;
+    - состояние цепи сервера: closed, open, half_open.
+    """
+    return SshDiagnosticsResponse(
+        data=SshDiagnosticsData(
+            timings=[SshTimingData(**item) for item in db.get_ssh_timings()],
+            slow_commands=[
+                SlowCommandData(**item) for item in db.get_slow_commands(limit)
+            ],
+            circuits=[CircuitStateData(**item) for item in db.get_circuit_states()],
+        )
+    )
+
+
 if __name__ == "__main__":
     import uvicorn
 
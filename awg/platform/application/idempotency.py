@@ -0,0 +1,200 @@
+import json
+import os
+import threading
+import time
+from dataclasses import dataclass
+from uuid import uuid4
+
+from awg import db
+
+try:
+    from modules.file_lock import atomic_write_json, file_lock
+except ImportError:
+    from awg.modules.file_lock import atomic_write_json, file_lock
+
+STORE_PATH = os.path.join('data', 'api_idempotency.json')
+TTL_SECONDS = float(os.getenv('API_IDEMPOTENCY_TTL_SECONDS') or 86400)
+MAX_KEYS = int(os.getenv('API_IDEMPOTENCY_MAX_KEYS') or 10000)
+# Незавершённая запись старше этого срока считается брошенной (процесс API упал)
+PENDING_SECONDS = float(os.getenv('API_IDEMPOTENCY_PENDING_SECONDS') or 900)
+# Как часто повтор проверяет файл, если первый запрос выполняет другой воркер
+POLL_SECONDS = 0.5
+
+CACHE_REQUESTS = db.metrics.REGISTRY.counter(
+    'awg_cache_requests_total',
+    'Обращения к кешам',
+    ('cache', 'result'),
+)
+
+
+class IdempotencyConflict(ValueError):
+    pass
+
+
+@dataclass
+class IdempotencyEntry:
+    key: str
+    fingerprint: str
+    token: str
+    done: bool = False
+    profile_id: str | None = None
+    job_id: str | None = None
+
+
+def _read_store(path: str) -> dict[str, dict]:
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, 'r', encoding='utf-8') as file:
+            data = json.load(file)
+    except json.JSONDecodeError:
+        return {}
+    if isinstance(data, dict):
+        return data
+    return {}
+
+
+def _entry_from_record(key: str, record: dict) -> IdempotencyEntry:
+    return IdempotencyEntry(
+        key=key,
+        fingerprint=record.get('fingerprint', ''),
+        token=record.get('token', ''),
+        done=record.get('status') == 'done',
+        profile_id=record.get('profile_id'),
+        job_id=record.get('job_id'),
+    )
+
+
+class IdempotencyStore:
+    """Результаты запросов по заголовку Idempotency-Key.
+
+    Ключи хранятся в data/api_idempotency.json под file_lock, поэтому повтор
+    узнаёт результат, даже если первый запрос обслужил другой воркер uvicorn.
+    Запоминается только profile_id созданного профиля: конфигурация с
+    приватным ключом на диск не пишется и собирается заново при повторе.
+    После ошибки ключ освобождается и повтор выполнит запрос заново.
+    Хранилище ограничено MAX_KEYS ключами и TTL_SECONDS секундами.
+    """
+
+    def __init__(
+        self,
+        path: str = STORE_PATH,
+        ttl: float = TTL_SECONDS,
+        max_keys: int = MAX_KEYS,
+        pending_ttl: float = PENDING_SECONDS,
+    ):
+        self.path = path
+        self.ttl = ttl
+        self.max_keys = max_keys
+        self.pending_ttl = pending_ttl
+        # Ожидания внутри процесса будятся сразу, без опроса файла
+        self._events: dict[str, threading.Event] = {}
+        self._lock = threading.Lock()
+
+    def begin(self, key: str, fingerprint: str) -> tuple[IdempotencyEntry, bool]:
+        """Запись ключа и True, если запрос нужно выполнить; False — это повтор."""
+        now = time.time()
+        with file_lock(self.path):
+            store = self._read()
+            self._evict(store, now)
+            record = store.get(key)
+            if record is not None:
+                if record.get('fingerprint') != fingerprint:
+                    CACHE_REQUESTS.labels('idempotency', 'conflict').inc()
+                    raise IdempotencyConflict(
+                        'Idempotency-Key уже использован для другого запроса.'
+                    )
+                CACHE_REQUESTS.labels('idempotency', 'hit').inc()
+                return _entry_from_record(key, record), False
+            CACHE_REQUESTS.labels('idempotency', 'miss').inc()
+            entry = IdempotencyEntry(key=key, fingerprint=fingerprint, token=uuid4().hex)
+            store[key] = {
+                'fingerprint': fingerprint,
+                'token': entry.token,
+                'status': 'pending',
+                'started_at': now,
+                'expires_at': now + self.ttl,
+            }
+            self._save(store)
+        with self._lock:
+            self._events[key] = threading.Event()
+        return entry, True
+
+    def attach_job(self, entry: IdempotencyEntry, job_id: str) -> None:
+        entry.job_id = job_id
+        self._update(entry, {'job_id': job_id})
+
+    def complete(self, entry: IdempotencyEntry, profile_id: str) -> None:
+        entry.profile_id = profile_id
+        entry.done = True
+        self._update(entry, {'status': 'done', 'profile_id': profile_id})
+        self._notify(entry.key)
+
+    def fail(self, entry: IdempotencyEntry) -> None:
+        with file_lock(self.path):
+            store = self._read()
+            record = store.get(entry.key)
+            if record is not None and record.get('token') == entry.token:
+                del store[entry.key]
+                self._save(store)
+        self._notify(entry.key)
+
+    def wait(self, entry: IdempotencyEntry, timeout: float) -> bool:
+        """Ждёт завершения первого запроса; False — не дождались за timeout.
+
+        После успешного завершения entry.done и entry.profile_id обновлены;
+        если первый запрос завершился ошибкой, entry.done остаётся False.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            with self._lock:
+                event = self._events.get(entry.key)
+            with file_lock(self.path, shared=True):
+                record = self._read().get(entry.key)
+            if record is None or record.get('token') != entry.token:
+                return True
+            if record.get('status') == 'done':
+                entry.done = True
+                entry.profile_id = record.get('profile_id')
+                return True
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            if event is not None:
+                event.wait(min(remaining, POLL_SECONDS))
+            else:
+                time.sleep(min(remaining, POLL_SECONDS))
+
+    def _update(self, entry: IdempotencyEntry, changes: dict) -> None:
+        with file_lock(self.path):
+            store = self._read()
+            record = store.get(entry.key)
+            if record is None or record.get('token') != entry.token:
+                return
+            record.update(changes)
+            self._save(store)
+
+    def _notify(self, key: str) -> None:
+        with self._lock:
+            event = self._events.pop(key, None)
+        if event is not None:
+            event.set()
+
+    def _read(self) -> dict[str, dict]:
+        return _read_store(self.path)
+
+    def _save(self, store: dict[str, dict]) -> None:
+        atomic_write_json(self.path, store)
+
+    def _evict(self, store: dict[str, dict], now: float) -> None:
+        # Ключи лежат в порядке создания; выполняющиеся запросы не вытесняются,
+        # пока не истечёт pending_ttl
+        overflow = len(store) - self.max_keys + 1
+        for key, record in list(store.items()):
+            done = record.get('status') == 'done'
+            expired = record.get('expires_at', 0) <= now or (
+                not done and record.get('started_at', 0) + self.pending_ttl <= now
+            )
+            if expired or (overflow > 0 and done):
+                del store[key]
+                overflow -= 1
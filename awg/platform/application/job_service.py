@@ -0,0 +1,221 @@
+import asyncio
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable, Literal
+from uuid import uuid4
+
+from awg import db
+
+# Операции одного сервера правят один и тот же wg0.conf, поэтому по умолчанию
+# выполняются по очереди; разные серверы обслуживаются параллельно
+WORKERS_PER_SERVER = int(os.getenv('API_JOB_WORKERS_PER_SERVER') or 1)
+QUEUE_LIMIT = int(os.getenv('API_JOB_QUEUE_LIMIT') or 100)
+RESULT_TTL_SECONDS = float(os.getenv('API_JOB_TTL_SECONDS') or 3600)
+STORE_LIMIT = 1000
+
+JobStatus = Literal['queued', 'running', 'succeeded', 'failed']
+
+JOBS = db.metrics.REGISTRY.counter(
+    'awg_api_jobs_total',
+    'Завершённые фоновые задачи API',
+    ('kind', 'status'),
+)
+JOB_DURATION = db.metrics.REGISTRY.histogram(
+    'awg_api_job_duration_seconds',
+    'Время выполнения фоновой задачи API',
+    ('kind',),
+)
+
+
+class JobFailed(Exception):
+    """Ошибка задачи с кодом, который увидит клиент."""
+
+    def __init__(self, code: str, message: str):
+        super().__init__(message)
+        self.code = code
+        self.message = message
+
+
+class QueueFull(RuntimeError):
+    pass
+
+
+@dataclass
+class Job:
+    job_id: str
+    kind: str
+    server_id: str
+    status: JobStatus = 'queued'
+    created_at: float = field(default_factory=time.time)
+    started_at: float | None = None
+    finished_at: float | None = None
+    result: Any = None
+    error: dict[str, str] | None = None
+    _callbacks: list[Callable[['Job'], None]] = field(default_factory=list, repr=False)
+
+    @property
+    def done(self) -> bool:
+        return self.status in ('succeeded', 'failed')
+
+    def snapshot(self) -> dict[str, Any]:
+        return {
+            'job_id': self.job_id,
+            'kind': self.kind,
+            'server_id': self.server_id,
+            'status': self.status,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            'result': self.result,
+            'error': self.error,
+        }
+
+
+class JobService:
+    """Очередь длительных операций API с отдельным пулом потоков на сервер.
+
+    HTTP-запрос только ставит задачу и сразу отвечает её идентификатором;
+    SSH-команды выполняются в пуле сервера. Очередь сервера ограничена
+    QUEUE_LIMIT задачами, завершённые задачи хранятся RESULT_TTL_SECONDS.
+    """
+
+    def __init__(
+        self,
+        workers_per_server: int = WORKERS_PER_SERVER,
+        queue_limit: int = QUEUE_LIMIT,
+        result_ttl: float = RESULT_TTL_SECONDS,
+    ):
+        self.workers_per_server = workers_per_server
+        self.queue_limit = queue_limit
+        self.result_ttl = result_ttl
+        self._jobs: OrderedDict[str, Job] = OrderedDict()
+        self._executors: dict[str, ThreadPoolExecutor] = {}
+        self._pending: dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def submit(self, kind: str, server_id: str, fn: Callable[[], Any]) -> Job:
+        server_id = str(server_id)
+        with self._lock:
+            self._prune()
+            if self._pending.get(server_id, 0) >= self.queue_limit:
+                raise QueueFull(
+                    f'Очередь задач сервера {server_id} заполнена, повторите позже.'
+                )
+            job = Job(job_id=str(uuid4()), kind=kind, server_id=server_id)
+            self._jobs[job.job_id] = job
+            self._pending[server_id] = self._pending.get(server_id, 0) + 1
+            executor = self._executors.get(server_id)
+            if executor is None:
+                executor = ThreadPoolExecutor(
+                    max_workers=self.workers_per_server,
+                    thread_name_prefix=f'api-jobs-{server_id}',
+                )
+                self._executors[server_id] = executor
+        executor.submit(self._run, job, fn)
+        return job
+
+    def call(self, kind: str, server_id: str, fn: Callable[[], Any]) -> Any:
+        """Выполняет fn в очереди сервера и ждёт результата в текущем потоке.
+
+        Нужен синхронным операциям, которые меняют wg0.conf: они встают в
+        ту же очередь, что и фоновые задачи, и не пересекаются с ними.
+        Исключение fn пробрасывается вызывающему.
+        """
+        outcome: dict[str, Any] = {}
+        finished = threading.Event()
+
+        def run() -> None:
+            try:
+                outcome['value'] = fn()
+            except BaseException as exc:
+                outcome['error'] = exc
+                raise
+
+        job = self.submit(kind, server_id, run)
+        with self._lock:
+            if job.done:
+                finished.set()
+            else:
+                job._callbacks.append(lambda _: finished.set())
+        finished.wait()
+        if 'error' in outcome:
+            raise outcome['error']
+        return outcome.get('value')
+
+    def get(self, job_id: str) -> Job | None:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    async def wait(self, job: Job, timeout: float) -> Job:
+        """Ждёт завершения задачи не дольше timeout, не занимая поток."""
+        if job.done or timeout <= 0:
+            return job
+        loop = asyncio.get_running_loop()
+        finished = loop.create_future()
+
+        def notify(_: Job) -> None:
+            loop.call_soon_threadsafe(
+                lambda: finished.done() or finished.set_result(None)
+            )
+
+        with self._lock:
+            if job.done:
+                return job
+            job._callbacks.append(notify)
+        try:
+            await asyncio.wait_for(finished, timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            with self._lock:
+                if notify in job._callbacks:
+                    job._callbacks.remove(notify)
+        return job
+
+    def queue_depths(self) -> dict[str, int]:
+        with self._lock:
+            return dict(self._pending)
+
+    def shutdown(self) -> None:
+        with self._lock:
+            executors = list(self._executors.values())
+            self._executors.clear()
+        for executor in executors:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def _run(self, job: Job, fn: Callable[[], Any]) -> None:
+        job.started_at = time.time()
+        job.status = 'running'
+        started = time.perf_counter()
+        try:
+            result, error = fn(), None
+        except JobFailed as exc:
+            result, error = None, {'code': exc.code, 'message': exc.message}
+        except Exception as exc:
+            result, error = None, {'code': 'internal_error', 'message': str(exc)}
+        JOB_DURATION.labels(job.kind).observe(time.perf_counter() - started)
+
+        with self._lock:
+            job.result = result
+            job.error = error
+            job.finished_at = time.time()
+            job.status = 'failed' if error else 'succeeded'
+            self._pending[job.server_id] -= 1
+            callbacks, job._callbacks = job._callbacks, []
+        JOBS.labels(job.kind, job.status).inc()
+        for callback in callbacks:
+            callback(job)
+
+    def _prune(self) -> None:
+        # Задачи лежат в порядке создания; незавершённые не удаляются
+        now = time.time()
+        finished = [job for job in self._jobs.values() if job.done]
+        overflow = len(self._jobs) - STORE_LIMIT
+        for job in finished:
+            if now - job.finished_at > self.result_ttl or overflow > 0:
+                del self._jobs[job.job_id]
+                overflow -= 1
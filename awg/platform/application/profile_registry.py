@@ -1,18 +1,27 @@
 import json
 import os
-import threading
 from datetime import datetime, timezone
 from typing import Any
 from uuid import uuid4
 
+try:
+    from modules.data_watcher import BUS, CachedFile
+    from modules.file_lock import atomic_write_json, file_lock
+except ImportError:
+    from awg.modules.data_watcher import BUS, CachedFile
+    from awg.modules.file_lock import atomic_write_json, file_lock
+
 REGISTRY_PATH = os.path.join('data', 'profile_registry.json')
-_registry_lock = threading.Lock()
 
 
 def _load_registry() -> dict[str, dict[str, Any]]:
+    return _registry_cache.get()
+
+
+def _read_registry() -> dict[str, dict[str, Any]]:
     if not os.path.exists(REGISTRY_PATH):
         return {}
-    with open(REGISTRY_PATH, 'r', encoding='utf-8') as file:
+    with file_lock(REGISTRY_PATH, shared=True), open(REGISTRY_PATH, 'r', encoding='utf-8') as file:
         try:
             data = json.load(file)
         except json.JSONDecodeError:
@@ -23,18 +32,22 @@ def _load_registry() -> dict[str, dict[str, Any]]:
 
 
 def _save_registry(registry: dict[str, dict[str, Any]]) -> None:
-    os.makedirs(os.path.dirname(REGISTRY_PATH), exist_ok=True)
-    with open(REGISTRY_PATH, 'w', encoding='utf-8') as file:
-        json.dump(registry, file)
+    with file_lock(REGISTRY_PATH):
+        atomic_write_json(REGISTRY_PATH, registry)
+    BUS.publish(os.path.basename(REGISTRY_PATH))
+
+
+# Сбрасывается наблюдателем data/ при записи файла любым процессом
+_registry_cache = CachedFile(BUS, os.path.basename(REGISTRY_PATH), _read_registry, path=REGISTRY_PATH)
 
 
 def get_profile(profile_id: str) -> dict[str, Any] | None:
-    with _registry_lock:
+    with file_lock(REGISTRY_PATH, shared=True):
         return _load_registry().get(profile_id)
 
 
 def find_profile_id(server_id: str, username: str) -> str | None:
-    with _registry_lock:
+    with file_lock(REGISTRY_PATH, shared=True):
         registry = _load_registry()
         for profile_id, entry in registry.items():
             if (
@@ -45,50 +58,89 @@ def find_profile_id(server_id: str, username: str) -> str | None:
     return None
 
 
+def _upsert(
+    registry: dict[str, dict[str, Any]],
+    server_id: str,
+    username: str,
+    owner_id: str | int | None,
+) -> tuple[str, dict[str, Any], bool]:
+    for profile_id, entry in registry.items():
+        if (
+            entry.get('server_id') == server_id
+            and entry.get('username') == username
+        ):
+            if owner_id is not None and entry.get('owner_id') != owner_id:
+                entry['owner_id'] = owner_id
+                registry[profile_id] = entry
+                return profile_id, entry, True
+            return profile_id, entry, False
+
+    profile_id = str(uuid4())
+    entry = {
+        'profile_id': profile_id,
+        'server_id': server_id,
+        'username': username,
+        'owner_id': owner_id,
+        'created_at': datetime.now(timezone.utc).isoformat(),
+    }
+    registry[profile_id] = entry
+    return profile_id, entry, True
+
+
 def upsert_profile(
     server_id: str,
     username: str,
     owner_id: str | int | None,
 ) -> tuple[str, dict[str, Any]]:
-    with _registry_lock:
+    with file_lock(REGISTRY_PATH):
         registry = _load_registry()
-        for profile_id, entry in registry.items():
-            if (
-                entry.get('server_id') == server_id
-                and entry.get('username') == username
-            ):
-                if owner_id is not None and entry.get('owner_id') != owner_id:
-                    entry['owner_id'] = owner_id
-                    registry[profile_id] = entry
-                    _save_registry(registry)
-                return profile_id, entry
-
-        profile_id = str(uuid4())
-        entry = {
-            'profile_id': profile_id,
-            'server_id': server_id,
-            'username': username,
-            'owner_id': owner_id,
-            'created_at': datetime.now(timezone.utc).isoformat(),
-        }
-        registry[profile_id] = entry
-        _save_registry(registry)
+        profile_id, entry, changed = _upsert(
+            registry, server_id, username, owner_id
+        )
+        if changed:
+            _save_registry(registry)
         return profile_id, entry
 
 
+def upsert_profiles(
+    server_id: str,
+    profiles: list[tuple[str, str | int | None]],
+) -> list[str]:
+    """upsert_profile для списка (username, owner_id) одной записью файла."""
+    with file_lock(REGISTRY_PATH):
+        registry = _load_registry()
+        profile_ids = []
+        changed = False
+        for username, owner_id in profiles:
+            profile_id, _, updated = _upsert(
+                registry, server_id, username, owner_id
+            )
+            profile_ids.append(profile_id)
+            changed = changed or updated
+        if changed:
+            _save_registry(registry)
+        return profile_ids
+
+
 def delete_profile(profile_id: str) -> bool:
-    with _registry_lock:
+    return delete_profiles([profile_id]) == 1
+
+
+def delete_profiles(profile_ids: list[str]) -> int:
+    with file_lock(REGISTRY_PATH):
         registry = _load_registry()
-        if profile_id not in registry:
-            return False
-        del registry[profile_id]
-        _save_registry(registry)
-        return True
+        deleted = 0
+        for profile_id in profile_ids:
+            if registry.pop(profile_id, None) is not None:
+                deleted += 1
+        if deleted:
+            _save_registry(registry)
+        return deleted
 
 
 def list_profiles_by_owner(owner_id: str | int) -> list[dict[str, Any]]:
     owner_str = str(owner_id)
-    with _registry_lock:
+    with file_lock(REGISTRY_PATH, shared=True):
         registry = _load_registry()
         return [
             entry
@@ -98,5 +150,5 @@ def list_profiles_by_owner(owner_id: str | int) -> list[dict[str, Any]]:
 
 
 def list_all_profiles() -> list[dict[str, Any]]:
-    with _registry_lock:
+    with file_lock(REGISTRY_PATH, shared=True):
         return list(_load_registry().values())
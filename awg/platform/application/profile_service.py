@@ -1,15 +1,22 @@
 import re
-import struct
-import zlib
-import base64
 from dataclasses import dataclass
+from typing import Any, Callable
 
 from awg import db
+from awg.modules.vpn_codec import encode_vpn_uri
 from awg.platform.application import profile_registry
+from awg.platform.application.job_service import QueueFull
 
 
 _VALID_PROFILE_RE = re.compile(r'^[A-Za-z0-9_.-]{1,64}$')
 
+# (kind, server_id, fn) -> результат fn; по умолчанию fn выполняется сразу
+ServerRunner = Callable[[str, str, Callable[[], Any]], Any]
+
+
+def _run_directly(_: str, __: str, fn: Callable[[], Any]) -> Any:
+    return fn()
+
 
 @dataclass(frozen=True)
 class CreatedProfile:
@@ -27,6 +34,18 @@ class DeletedProfile:
     status: str
 
 
+@dataclass(frozen=True)
+class BatchItemResult:
+    index: int
+    profile: CreatedProfile | DeletedProfile | None = None
+    error_code: str | None = None
+    error: str | None = None
+
+    @property
+    def ok(self) -> bool:
+        return self.profile is not None
+
+
 class ProfileService:
     def list_profiles_by_server(
         self,
@@ -92,21 +111,7 @@ class ProfileService:
             owner_slug=owner_slug,
         )
 
-        conf_path = db.profile_file_path(
-            server_id,
-            normalized_name,
-            f'{normalized_name}.conf',
-            ensure=False,
-        )
-        try:
-            with open(conf_path, 'r', encoding='utf-8') as file:
-                conf_text = file.read()
-        except FileNotFoundError as exc:
-            raise RuntimeError(
-                'Профиль создан, но .conf файл не найден '
-                'в локальном хранилище.'
-            ) from exc
-
+        conf_text = self._read_conf_text(server_id, normalized_name)
         vpn_uri = self._encode_vpn_uri(conf_text)
         profile_id, _ = profile_registry.upsert_profile(
             server_id,
@@ -123,6 +128,277 @@ class ProfileService:
             vpn_uri=vpn_uri,
         )
 
+    def batch_create_profiles(
+        self,
+        items: list[tuple[str, str | int, str]],
+        run_on_server: ServerRunner = _run_directly,
+    ) -> list[BatchItemResult]:
+        """Создает профили из списка (server_id, user_id, profile_name).
+
+        Имена проверяются по одному снимку сервера, а все профили сервера
+        добавляются одной записью конфигурации и одним перезапуском
+        интерфейса. run_on_server выполняет работу по серверу, например
+        в его очереди задач. Результаты возвращаются в порядке items.
+        """
+        results: dict[int, BatchItemResult] = {}
+        by_server: dict[str, list[tuple[int, str | int, str]]] = {}
+        for index, (server_id, user_id, profile_name) in enumerate(items):
+            try:
+                normalized_name = self._normalize_profile_name(profile_name)
+            except ValueError as exc:
+                results[index] = BatchItemResult(
+                    index,
+                    error_code='invalid_profile_payload',
+                    error=str(exc),
+                )
+                continue
+            by_server.setdefault(server_id, []).append(
+                (index, user_id, normalized_name)
+            )
+
+        for server_id, server_items in by_server.items():
+            try:
+                results.update(
+                    run_on_server(
+                        'profile_batch_create',
+                        server_id,
+                        lambda server_id=server_id, server_items=server_items:
+                            self._batch_create_on_server(server_id, server_items),
+                    )
+                )
+            except Exception as exc:
+                results.update(
+                    self._batch_server_failed(
+                        [index for index, _, _ in server_items],
+                        exc,
+                        'profile_create_failed',
+                    )
+                )
+        return [results[index] for index in range(len(items))]
+
+    @staticmethod
+    def _batch_server_failed(
+        indexes: list[int],
+        exc: Exception,
+        error_code: str,
+    ) -> dict[int, BatchItemResult]:
+        if isinstance(exc, QueueFull):
+            error_code = 'job_queue_full'
+        return {
+            index: BatchItemResult(index, error_code=error_code, error=str(exc))
+            for index in indexes
+        }
+
+    @staticmethod
+    def _batch_duplicate(index: int, first: int, field: str) -> BatchItemResult:
+        return BatchItemResult(
+            index,
+            error_code='duplicate_item',
+            error=f'{field} повторяет элемент {first}; он обрабатывается один раз.',
+        )
+
+    def _batch_create_on_server(
+        self,
+        server_id: str,
+        items: list[tuple[int, str | int, str]],
+    ) -> dict[int, BatchItemResult]:
+        results: dict[int, BatchItemResult] = {}
+        clients = db.get_client_list(server_id=server_id)
+        if clients is None:
+            return self._batch_server_failed(
+                [index for index, _, _ in items],
+                RuntimeError('Не удалось прочитать список клиентов сервера.'),
+                'profile_create_failed',
+            )
+        existing = {item[0] for item in clients}
+        first_index: dict[str, int] = {}
+        pending: list[tuple[int, str | int, str, str]] = []
+        for index, user_id, profile_name in items:
+            if profile_name in first_index:
+                results[index] = self._batch_duplicate(
+                    index, first_index[profile_name], 'profile_name'
+                )
+                continue
+            first_index[profile_name] = index
+            if profile_name in existing:
+                results[index] = BatchItemResult(
+                    index,
+                    error_code='profile_exists',
+                    error='Профиль с таким именем уже существует на этом сервере.',
+                )
+                continue
+            pending.append(
+                (index, user_id, profile_name, self._owner_slug_from_user(user_id))
+            )
+        if not pending:
+            return results
+
+        outcome = db.root_add_batch(
+            [(profile_name, owner_slug) for _, _, profile_name, owner_slug in pending],
+            server_id=server_id,
+        )
+        created = []
+        for index, user_id, profile_name, owner_slug in pending:
+            error = outcome.get(profile_name, 'Профиль не был обработан.')
+            if error is None:
+                created.append((index, user_id, profile_name, owner_slug))
+            else:
+                results[index] = BatchItemResult(
+                    index,
+                    error_code='profile_create_failed',
+                    error=error,
+                )
+        if not created:
+            return results
+
+        db.set_users_expiration(
+            [
+                (profile_name, user_id, owner_slug)
+                for _, user_id, profile_name, owner_slug in created
+            ],
+            expiration=None,
+            traffic_limit='Неограниченно',
+            server_id=server_id,
+        )
+        profile_ids = profile_registry.upsert_profiles(
+            server_id,
+            [(profile_name, user_id) for _, user_id, profile_name, _ in created],
+        )
+        for (index, user_id, profile_name, _), profile_id in zip(
+            created, profile_ids
+        ):
+            try:
+                conf_text = self._read_conf_text(server_id, profile_name)
+            except RuntimeError as exc:
+                results[index] = BatchItemResult(
+                    index,
+                    error_code='profile_create_failed',
+                    error=str(exc),
+                )
+                continue
+            results[index] = BatchItemResult(
+                index,
+                profile=CreatedProfile(
+                    profile_id=profile_id,
+                    server_id=server_id,
+                    user_id=user_id,
+                    profile_name=profile_name,
+                    conf_text=conf_text,
+                    vpn_uri=self._encode_vpn_uri(conf_text),
+                ),
+            )
+        return results
+
+    def batch_delete_profiles(
+        self,
+        profile_ids: list[str],
+        run_on_server: ServerRunner = _run_directly,
+    ) -> list[BatchItemResult]:
+        """Удаляет профили по profile_id, по одной записи конфигурации на сервер."""
+        results: dict[int, BatchItemResult] = {}
+        by_server: dict[str, list[tuple[int, str, str]]] = {}
+        first_index: dict[str, int] = {}
+        for index, profile_id in enumerate(profile_ids):
+            if profile_id in first_index:
+                results[index] = self._batch_duplicate(
+                    index, first_index[profile_id], 'profile_id'
+                )
+                continue
+            first_index[profile_id] = index
+            entry = profile_registry.get_profile(profile_id)
+            if not entry:
+                results[index] = BatchItemResult(
+                    index,
+                    error_code='profile_not_found',
+                    error='Профиль не найден по profile_id.',
+                )
+                continue
+            by_server.setdefault(str(entry['server_id']), []).append(
+                (index, profile_id, entry['username'])
+            )
+
+        for server_id, server_items in by_server.items():
+            try:
+                results.update(
+                    run_on_server(
+                        'profile_batch_delete',
+                        server_id,
+                        lambda server_id=server_id, server_items=server_items:
+                            self._batch_delete_on_server(server_id, server_items),
+                    )
+                )
+            except Exception as exc:
+                results.update(
+                    self._batch_server_failed(
+                        [index for index, _, _ in server_items],
+                        exc,
+                        'profile_delete_failed',
+                    )
+                )
+        return [results[index] for index in range(len(profile_ids))]
+
+    def _batch_delete_on_server(
+        self,
+        server_id: str,
+        items: list[tuple[int, str, str]],
+    ) -> dict[int, BatchItemResult]:
+        results: dict[int, BatchItemResult] = {}
+        outcome = db.deactive_users_batch(
+            [username for _, _, username in items],
+            server_id=server_id,
+        )
+        deleted = []
+        for index, profile_id, username in items:
+            error = outcome.get(username, 'Профиль не был обработан.')
+            if error is None:
+                deleted.append((profile_id, username))
+                results[index] = BatchItemResult(
+                    index,
+                    profile=DeletedProfile(
+                        profile_id=profile_id,
+                        status='deleted',
+                    ),
+                )
+            else:
+                results[index] = BatchItemResult(
+                    index,
+                    error_code='profile_delete_failed',
+                    error=error,
+                )
+        if deleted:
+            db.remove_users_expiration(
+                [username for _, username in deleted],
+                server_id=server_id,
+            )
+            profile_registry.delete_profiles(
+                [profile_id for profile_id, _ in deleted]
+            )
+        return results
+
+    def get_created_profile(self, profile_id: str) -> CreatedProfile:
+        """Ответ создания профиля, собранный заново из локальных файлов."""
+        entry = profile_registry.get_profile(profile_id)
+        if not entry:
+            raise KeyError('Профиль не найден по profile_id.')
+
+        server_id = str(entry['server_id'])
+        profile_name = entry['username']
+        conf_text = self._read_conf_text(server_id, profile_name)
+        return CreatedProfile(
+            profile_id=profile_id,
+            server_id=server_id,
+            user_id=entry.get('owner_id'),
+            profile_name=profile_name,
+            conf_text=conf_text,
+            vpn_uri=self._encode_vpn_uri(conf_text),
+        )
+
+    def get_profile_server(self, profile_id: str) -> str:
+        entry = profile_registry.get_profile(profile_id)
+        if not entry:
+            raise KeyError('Профиль не найден по profile_id.')
+        return str(entry['server_id'])
+
     def delete_profile(self, profile_id: str) -> DeletedProfile:
         entry = profile_registry.get_profile(profile_id)
         if not entry:
@@ -192,14 +468,26 @@ class ProfileService:
         owner = re.sub(r'-{2,}', '-', owner).strip('-')
         return owner or 'user'
 
+    @staticmethod
+    def _read_conf_text(server_id: str, profile_name: str) -> str:
+        conf_path = db.profile_file_path(
+            server_id,
+            profile_name,
+            f'{profile_name}.conf',
+            ensure=False,
+        )
+        try:
+            with open(conf_path, 'r', encoding='utf-8') as file:
+                return file.read()
+        except FileNotFoundError as exc:
+            raise RuntimeError(
+                'Профиль создан, но .conf файл не найден '
+                'в локальном хранилище.'
+            ) from exc
+
     @staticmethod
     def _encode_vpn_uri(conf_text: str) -> str:
-        conf_bytes = conf_text.encode('utf-8')
-        compressed = zlib.compress(conf_bytes, 8)
-        payload = struct.pack('>I', len(conf_bytes)) + compressed
-        encoded = base64.urlsafe_b64encode(payload).rstrip(b'=')
-        encoded = encoded.decode('ascii')
-        return f'vpn://{encoded}'
+        return encode_vpn_uri(conf_text)
 
     @staticmethod
     def _resolve_owner_id(
@@ -80,43 +80,45 @@ class ServerService:
         key_path: str | None = None,
     ) -> dict:
         server_key = _server_key(server_id)
-        servers = db.load_servers()
-        if server_key not in servers:
-            raise KeyError('Сервер не найден.')
-
-        current = servers[server_key]
-        if server_name is not None:
-            current['name'] = server_name
-        if host is not None:
-            current['host'] = host
-        if port is not None:
-            current['port'] = port
-        if username is not None:
-            current['username'] = username
-        if endpoint is not None:
-            current['endpoint'] = endpoint
-
-        if auth_type == 'password':
-            if not password:
-                raise ValueError(
-                    'Для auth_type=password нужно передать password.'
-                )
-            current['auth_type'] = 'password'
-            current['key_path'] = None
-            db.save_servers(servers)
-            db.update_server_password(server_key, password)
-            servers = db.load_servers()
-            current = servers[server_key]
-        elif auth_type == 'key':
-            if not key_path:
-                raise ValueError('Для auth_type=key нужно передать key_path.')
-            db.save_servers(servers)
-            db.update_server_key(server_key, key_path)
+        # Весь цикл чтение-изменение-запись под блокировкой servers.json: бот пишет в тот же файл
+        with db.servers_transaction():
             servers = db.load_servers()
+            if server_key not in servers:
+                raise KeyError('Сервер не найден.')
+
             current = servers[server_key]
+            if server_name is not None:
+                current['name'] = server_name
+            if host is not None:
+                current['host'] = host
+            if port is not None:
+                current['port'] = port
+            if username is not None:
+                current['username'] = username
+            if endpoint is not None:
+                current['endpoint'] = endpoint
+
+            if auth_type == 'password':
+                if not password:
+                    raise ValueError(
+                        'Для auth_type=password нужно передать password.'
+                    )
+                current['auth_type'] = 'password'
+                current['key_path'] = None
+                db.save_servers(servers)
+                db.update_server_password(server_key, password)
+                servers = db.load_servers()
+                current = servers[server_key]
+            elif auth_type == 'key':
+                if not key_path:
+                    raise ValueError('Для auth_type=key нужно передать key_path.')
+                db.save_servers(servers)
+                db.update_server_key(server_key, key_path)
+                servers = db.load_servers()
+                current = servers[server_key]
 
-        db.save_servers(servers)
-        return current
+            db.save_servers(servers)
+            return current
 
     def test_connection(self, server_id: int | str) -> dict[str, str]:
         server_key = _server_key(server_id)